@@ -0,0 +1,2 @@
+# Kept in step with the version in pyproject.toml (checked by the tests)
+__version__ = "3.0.6"
@@ -0,0 +1,709 @@
+"""
+NumPy-native access to PSRFITS fold-mode archives.
+
+`ArchiveCube` memory-maps the DATA column of the SUBINT table so data is only read from disk when
+it is needed. The DAT_SCL, DAT_OFFS and DAT_WTS corrections are applied lazily in chunks of
+subintegrations and the scrunch operations fall back to bounded-memory chunked reductions when the
+archive would not fit in the memory budget, so large (e.g. 16k channel) archives never have to be
+fully resident in memory.
+
+Scrunching follows the psrchive convention of a weighted mean of the profiles with the weights summed.
+When frequency scrunching an archive that isn't dedispersed, the channels are first aligned to the new
+channel's centre frequency with Fourier phase shifts (as psrchive does), so the combined pulse isn't smeared.
+"""
+
+import os
+import copy
+import re
+import datetime
+import numpy as np
+from astropy.io import fits
+
+from meerpipe.profile_utils import fft_shift_profiles, dispersion_shifts
+
+# Default maximum memory used at once by the data and the temporaries of reducing it (bytes)
+DEFAULT_MEMORY_BUDGET = int(os.environ.get("MEERPIPE_MEMORY_BUDGET", 2 * 1024**3))
+
+# The reductions hold several copies of the float32 data they work on (the float64 FFT buffers of the
+# dispersion shifts, the weighted copy and the sums), so data is processed in pieces of at most this
+# fraction of the memory budget
+WORKING_SET_FACTOR = 8
+
+# Header keywords that describe the table structure and so are recreated when writing a new SUBINT table
+STRUCTURAL_KEYWORDS = re.compile(r"^(XTENSION|BITPIX|NAXIS\d*|PCOUNT|GCOUNT|TFIELDS|T(TYPE|FORM|DIM|UNIT|SCAL|ZERO|NULL|DISP)\d+)$")
+
+
+def group_edges(n, ngroup):
+    """
+    The start indices of ``ngroup`` contiguous (as evenly sized as possible) groups of ``n`` elements.
+    """
+    if ngroup < 1 or ngroup > n:
+        raise ValueError(f"Can not split {n} elements into {ngroup} groups")
+    # Same split as numpy.array_split, the first groups take the remainder
+    sizes = np.full(ngroup, n // ngroup)
+    sizes[:n % ngroup] += 1
+    return np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+
+def append_history_row(history, proc_cmd, updates=None):
+    """
+    A copy of a HISTORY table with a new row recording a processing step.
+
+    The new row is a copy of the last row with DATE_PRO set to now, PROC_CMD to ``proc_cmd`` and any
+    other columns in ``updates`` (e.g. {"NCHAN": 16}) replaced.
+    """
+    nrow = len(history.data)
+    new_history = fits.BinTableHDU.from_columns(history.columns, nrows=nrow + 1, header=history.header)
+    names = new_history.columns.names
+    if nrow:
+        for name in names:
+            new_history.data[name][nrow] = new_history.data[name][nrow - 1]
+    values = {
+        "DATE_PRO": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"),
+        "PROC_CMD": proc_cmd,
+    }
+    values.update(updates or {})
+    for name, value in values.items():
+        if name in names:
+            new_history.data[name][nrow] = value
+    return new_history
+
+
+def _ephemeris_period(hdul):
+    """
+    The spin period in seconds from the F0 (or P0) parameter of the PSRPARAM table, if there is one.
+    """
+    if "PSRPARAM" not in hdul:
+        return None
+    for line in hdul["PSRPARAM"].data["PARAM"]:
+        fields = str(line).split()
+        if len(fields) < 2 or fields[0] not in ("F0", "P0"):
+            continue
+        value = float(fields[1].replace("D", "E"))
+        return 1. / value if fields[0] == "F0" else value
+    return None
+
+
+class ArchiveCube:
+    """
+    A PSRFITS fold-mode archive as a (nsub, npol, nchan, nbin) cube.
+
+    A cube is either backed by a memory-mapped PSRFITS file (see `ArchiveCube.load`) or, for the
+    results of scrunching, by an in-memory array.
+
+    Parameters
+    ----------
+    data : `numpy.ndarray`
+        The (nsub, npol, nchan, nbin) float32 data.
+    weights : `numpy.ndarray`
+        The (nsub, nchan) channel weights.
+    freqs : `numpy.ndarray`
+        The (nchan,) centre frequency of each channel in MHz.
+    tsubint : `numpy.ndarray`
+        The (nsub,) duration of each subint in seconds.
+    offs_sub : `numpy.ndarray`
+        The (nsub,) offset of the centre of each subint from the start of the observation in seconds.
+    pol_type : str
+        The PSRFITS polarisation type (e.g. AABBCRCI, IQUV or INTEN).
+    primary_header : `astropy.io.fits.Header`
+        The primary header of the archive the cube came from.
+    subint_header : `astropy.io.fits.Header`
+        The SUBINT table header of the archive the cube came from.
+    period : `numpy.ndarray`
+        The (nsub,) folding period of each subint in seconds, if known.
+    filename : str
+        The archive file the cube came from.
+    memory_budget : int
+        Maximum size in bytes of data to hold in memory at once.
+    dedispersed : bool
+        Whether the inter-channel dispersion delays have been removed from the data.
+    """
+    def __init__(
+            self,
+            data,
+            weights,
+            freqs,
+            tsubint,
+            offs_sub,
+            pol_type,
+            primary_header=None,
+            subint_header=None,
+            period=None,
+            filename=None,
+            memory_budget=DEFAULT_MEMORY_BUDGET,
+            dedispersed=False,
+        ):
+        self._data = data
+        self._rows = None
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.freqs = np.asarray(freqs, dtype=np.float64)
+        self.tsubint = np.asarray(tsubint, dtype=np.float64)
+        self.offs_sub = np.asarray(offs_sub, dtype=np.float64)
+        self.pol_type = pol_type
+        self.primary_header = primary_header if primary_header is not None else fits.Header()
+        self.subint_header = subint_header if subint_header is not None else fits.Header()
+        self.period = None if period is None else np.asarray(period, dtype=np.float64)
+        self.filename = filename
+        self.memory_budget = memory_budget
+        self.dedispersed = dedispersed
+        # The memory-mapped SUBINT rows of the source file and the source row each subint starts at
+        self._source = None
+        self.source_rows = np.arange(len(self.tsubint))
+        if data is not None:
+            self._shape = data.shape
+
+    @classmethod
+    def load(cls, filename, memory_budget=DEFAULT_MEMORY_BUDGET):
+        """
+        Memory-map a PSRFITS archive. Only the headers and the small per-channel columns are read.
+
+        Parameters
+        ----------
+        filename : str
+            Path to the PSRFITS archive.
+        memory_budget : int
+            Maximum size in bytes of data to hold in memory at once.
+
+        Returns
+        -------
+        cube : `ArchiveCube`
+            The file-backed archive cube.
+        """
+        with fits.open(filename, memmap=True) as hdul:
+            primary_header = hdul[0].header.copy()
+            subint = hdul["SUBINT"]
+            subint_header = subint.header.copy()
+            data_offset = subint.fileinfo()["datLoc"]
+            row_dtype = subint.columns.dtype.newbyteorder(">")
+            data_column = subint.columns["DATA"]
+            data_scale = data_column.bscale
+            data_zero = data_column.bzero
+            ephemeris_period = _ephemeris_period(hdul)
+            dedispersed = False
+            if "HISTORY" in hdul and "DEDISP" in hdul["HISTORY"].columns.names and len(hdul["HISTORY"].data):
+                dedispersed = bool(hdul["HISTORY"].data["DEDISP"][-1])
+
+        nrow = subint_header["NAXIS2"]
+        rows = np.memmap(filename, dtype=row_dtype, mode="r", offset=data_offset, shape=(nrow,))
+        npol = subint_header["NPOL"]
+        nchan = subint_header["NCHAN"]
+        nbin = subint_header["NBIN"]
+        period = np.asarray(rows["PERIOD"], dtype=np.float64) if "PERIOD" in row_dtype.names else None
+        if (period is None or not np.any(period > 0.)) and ephemeris_period is not None:
+            # psrchive leaves the PERIOD column empty and folds with a predictor, so use the ephemeris spin period
+            period = np.full(nrow, ephemeris_period)
+
+        cube = cls(
+            None,
+            np.asarray(rows["DAT_WTS"], dtype=np.float32).reshape(nrow, nchan),
+            np.asarray(rows["DAT_FREQ"], dtype=np.float64).reshape(nrow, nchan)[0],
+            np.asarray(rows["TSUBINT"], dtype=np.float64),
+            np.asarray(rows["OFFS_SUB"], dtype=np.float64),
+            subint_header["POL_TYPE"].strip(),
+            primary_header=primary_header,
+            subint_header=subint_header,
+            period=period,
+            filename=filename,
+            memory_budget=memory_budget,
+            dedispersed=dedispersed,
+        )
+        cube._rows = rows
+        cube._source = rows
+        cube._shape = (nrow, npol, nchan, nbin)
+        cube._scales = np.asarray(rows["DAT_SCL"], dtype=np.float32).reshape(nrow, npol, nchan)
+        cube._offsets = np.asarray(rows["DAT_OFFS"], dtype=np.float32).reshape(nrow, npol, nchan)
+        cube._column_scale = data_scale
+        cube._column_zero = data_zero
+        return cube
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def nsub(self):
+        return self._shape[0]
+
+    @property
+    def npol(self):
+        return self._shape[1]
+
+    @property
+    def nchan(self):
+        return self._shape[2]
+
+    @property
+    def nbin(self):
+        return self._shape[3]
+
+    @property
+    def nbytes(self):
+        """
+        The size of the full float32 data cube in bytes.
+        """
+        return int(np.prod(self._shape)) * 4
+
+    @property
+    def in_memory(self):
+        """
+        Whether the full data cube is held in memory, or is small enough to be reduced in one piece within the memory budget.
+        """
+        return self._data is not None or self.nbytes * WORKING_SET_FACTOR <= self.memory_budget
+
+    @property
+    def chunk_nsub(self):
+        """
+        The number of subints processed at once by the chunked reductions.
+        """
+        subint_bytes = self.nbytes // self.nsub
+        # Leave room for the temporaries made while reducing each chunk
+        return int(max(1, min(self.nsub, self.memory_budget // (WORKING_SET_FACTOR * subint_bytes))))
+
+    @property
+    def length(self):
+        """
+        The total integration time in seconds.
+        """
+        return float(np.sum(self.tsubint))
+
+    @property
+    def start_mjd(self):
+        """
+        The start MJD of the observation as an (integer day, fractional day) tuple to preserve precision.
+        """
+        imjd = int(self.primary_header.get("STT_IMJD", 0))
+        seconds = float(self.primary_header.get("STT_SMJD", 0)) + float(self.primary_header.get("STT_OFFS", 0.))
+        return imjd, seconds / 86400.
+
+    @property
+    def dm(self):
+        """
+        The dispersion measure of the archive.
+        """
+        return float(self.subint_header.get("DM", 0.))
+
+    @property
+    def source(self):
+        return str(self.primary_header.get("SRC_NAME", "")).strip()
+
+    def get_data(self, start=0, stop=None):
+        """
+        The scaled float32 data of a range of subints.
+
+        Parameters
+        ----------
+        start : int
+            The first subint.
+        stop : int
+            One past the last subint (default: all remaining subints).
+
+        Returns
+        -------
+        data : `numpy.ndarray`
+            The (stop - start, npol, nchan, nbin) data.
+        """
+        if stop is None:
+            stop = self.nsub
+        if self._data is not None:
+            return self._data[start:stop]
+        raw = np.asarray(self._rows["DATA"][start:stop], dtype=np.float32).reshape(stop - start, *self._shape[1:])
+        if self._column_scale not in (None, 1.):
+            raw *= self._column_scale
+        if self._column_zero not in (None, 0.):
+            raw += self._column_zero
+        raw *= self._scales[start:stop, :, :, np.newaxis]
+        raw += self._offsets[start:stop, :, :, np.newaxis]
+        return raw
+
+    @property
+    def data(self):
+        """
+        The full scaled float32 (nsub, npol, nchan, nbin) data cube.
+        """
+        return self.get_data()
+
+    def iter_chunks(self):
+        """
+        Iterate over the scaled data in chunks of subints that can be reduced within the memory budget,
+        which splits up a cube that is already in memory too if its temporaries wouldn't fit.
+
+        Yields
+        ------
+        start : int
+            The first subint of the chunk.
+        stop : int
+            One past the last subint of the chunk.
+        data : `numpy.ndarray`
+            The (stop - start, npol, nchan, nbin) data of the chunk.
+        """
+        step = self.nsub if self.nbytes * WORKING_SET_FACTOR <= self.memory_budget else self.chunk_nsub
+        for start in range(0, self.nsub, step):
+            stop = min(start + step, self.nsub)
+            yield start, stop, self.get_data(start, stop)
+
+    def _derive(self, data, weights=None, freqs=None, tsubint=None, offs_sub=None, pol_type=None, period=None, source_rows=None, dedispersed=None):
+        """
+        Make a new in-memory cube with the metadata of this cube, replacing any given attributes.
+        """
+        cube = ArchiveCube(
+            data,
+            self.weights if weights is None else weights,
+            self.freqs if freqs is None else freqs,
+            self.tsubint if tsubint is None else tsubint,
+            self.offs_sub if offs_sub is None else offs_sub,
+            self.pol_type if pol_type is None else pol_type,
+            primary_header=self.primary_header,
+            subint_header=self.subint_header,
+            period=self.period if period is None else period,
+            filename=self.filename,
+            memory_budget=self.memory_budget,
+            dedispersed=self.dedispersed if dedispersed is None else dedispersed,
+        )
+        cube._source = self._source
+        cube.source_rows = self.source_rows if source_rows is None else source_rows
+        return cube
+
+    def _view(self, **attributes):
+        """
+        A shallow copy of this cube with the given attributes replaced, which keeps a memory-mapped cube mapped.
+        """
+        cube = copy.copy(self)
+        for name, value in attributes.items():
+            setattr(cube, name, value)
+        return cube
+
+    def _map_chunks(self, function):
+        """
+        Apply a per-subint reduction to each chunk and join the results along the subint axis.
+        """
+        return np.concatenate([
+            function(data, self.weights[start:stop])
+            for start, stop, data in self.iter_chunks()
+        ])
+
+    def scrunch(self, nsub=None, nchan=None):
+        """
+        Time and frequency scrunch in a single pass over the data (like ``pam --setnsub --setnchn``).
+
+        Parameters
+        ----------
+        nsub : int
+            The number of output subints (default: unchanged).
+        nchan : int
+            The number of output channels (default: unchanged).
+
+        Returns
+        -------
+        cube : `ArchiveCube`
+            A new in-memory cube.
+        """
+        nsub = self.nsub if nsub is None else nsub
+        nchan = self.nchan if nchan is None else nchan
+        time_edges = group_edges(self.nsub, nsub)
+        chan_edges = group_edges(self.nchan, nchan)
+        group = np.searchsorted(time_edges, np.arange(self.nsub), side="right") - 1
+
+        # psrchive uses the weighted centre frequency of the combined channels
+        chan_weights = self.weights.sum(axis=0)
+        total_weights = np.add.reduceat(chan_weights, chan_edges)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            freqs = np.where(
+                total_weights > 0.,
+                np.add.reduceat(self.freqs * chan_weights, chan_edges) / total_weights,
+                np.add.reduceat(self.freqs, chan_edges) / np.diff(np.append(chan_edges, self.nchan)),
+            )
+        # Like psrchive, remove the dispersion delays within each new channel when combining channels
+        dedisperse = nchan != self.nchan and not self.dedispersed and self.dm != 0. and self.period is not None
+        chan_group = np.searchsorted(chan_edges, np.arange(self.nchan), side="right") - 1
+
+        summed = np.zeros((nsub, self.npol, nchan, self.nbin), dtype=np.float64)
+        for start, stop, data in self.iter_chunks():
+            if dedisperse:
+                shifts = dispersion_shifts(
+                    self.freqs,
+                    self.dm,
+                    self.period[start:stop, np.newaxis],
+                    self.nbin,
+                    freqs[chan_group],
+                )
+                data = fft_shift_profiles(data, shifts[:, np.newaxis, :])
+            weighted = data * self.weights[start:stop, np.newaxis, :, np.newaxis]
+            if nchan != self.nchan:
+                weighted = np.add.reduceat(weighted, chan_edges, axis=2)
+            chunk_group = group[start:stop]
+            chunk_edges = np.flatnonzero(np.diff(chunk_group, prepend=-1))
+            summed[chunk_group[chunk_edges]] += np.add.reduceat(weighted, chunk_edges, axis=0)
+        summed_weights = np.add.reduceat(np.add.reduceat(self.weights, chan_edges, axis=1), time_edges, axis=0)
+        norm = summed_weights[:, np.newaxis, :, np.newaxis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            data = np.where(norm > 0., summed / norm, 0.).astype(np.float32)
+
+        tsubint = np.add.reduceat(self.tsubint, time_edges)
+        # The centre of each new subint is the duration weighted mean of the old centres
+        offs_sub = np.add.reduceat(self.offs_sub * self.tsubint, time_edges) / tsubint
+        period = None if self.period is None else np.add.reduceat(self.period * self.tsubint, time_edges) / tsubint
+        return self._derive(
+            data,
+            weights=summed_weights,
+            freqs=freqs,
+            tsubint=tsubint,
+            offs_sub=offs_sub,
+            period=period,
+            source_rows=self.source_rows[time_edges],
+        )
+
+    def tscrunch(self, nsub=1):
+        """
+        Time scrunch to ``nsub`` subints (like ``pam --setnsub``).
+
+        Returns
+        -------
+        cube : `ArchiveCube`
+            A new in-memory cube.
+        """
+        return self.scrunch(nsub=nsub)
+
+    def fscrunch(self, nchan=1):
+        """
+        Frequency scrunch to ``nchan`` channels (like ``pam --setnchn``).
+
+        Returns
+        -------
+        cube : `ArchiveCube`
+            A new in-memory cube.
+        """
+        return self.scrunch(nchan=nchan)
+
+    def pscrunch(self):
+        """
+        Polarisation scrunch to total intensity.
+
+        Returns
+        -------
+        cube : `ArchiveCube`
+            A new in-memory cube, or a view of this one if it is already total intensity.
+        """
+        if self.npol == 1:
+            return self._view()
+        if self.pol_type in ("AABBCRCI", "AABB"):
+            # Total intensity is the sum of the two auto correlations
+            pscrunch = lambda data, weights: data[:, 0:1] + data[:, 1:2]
+        else:
+            # Stokes I
+            pscrunch = lambda data, weights: data[:, 0:1].copy()
+        return self._derive(self._map_chunks(pscrunch), pol_type="INTEN")
+
+    def bscrunch(self, nbin):
+        """
+        Phase bin scrunch to ``nbin`` bins, which must divide the current number of bins.
+
+        Returns
+        -------
+        cube : `ArchiveCube`
+            A new in-memory cube.
+        """
+        if self.nbin % nbin:
+            raise ValueError(f"Can not bin scrunch {self.nbin} bins to {nbin} bins")
+        factor = self.nbin // nbin
+        bscrunch = lambda data, weights: data.reshape(data.shape[:3] + (nbin, factor)).mean(axis=-1)
+        return self._derive(self._map_chunks(bscrunch))
+
+    @property
+    def centre_frequency(self):
+        """
+        The centre frequency of the observation in MHz (OBSFREQ, or the mean channel frequency).
+        """
+        obsfreq = float(self.primary_header.get("OBSFREQ", 0.))
+        return obsfreq if obsfreq > 0. else float(np.mean(self.freqs))
+
+    def dedisperse(self, ref_freq=None):
+        """
+        Remove the inter-channel dispersion delays (like ``pam -D``).
+
+        Parameters
+        ----------
+        ref_freq : float
+            The frequency in MHz the channels are aligned to (default: the centre frequency).
+
+        Returns
+        -------
+        cube : `ArchiveCube`
+            A new in-memory cube, or a view of this one if there are no delays to remove.
+        """
+        if self.dedispersed or self.dm == 0. or self.period is None:
+            return self._view(dedispersed=True)
+        ref_freq = self.centre_frequency if ref_freq is None else ref_freq
+        data = np.concatenate([
+            fft_shift_profiles(
+                data,
+                dispersion_shifts(self.freqs, self.dm, self.period[start:stop, np.newaxis], self.nbin, ref_freq)[:, np.newaxis, :],
+            )
+            for start, stop, data in self.iter_chunks()
+        ])
+        return self._derive(data, dedispersed=True)
+
+    def convert_to_stokes(self):
+        """
+        Convert coherence products (AABBCRCI) to Stokes parameters (IQUV), like ``pam -S``.
+
+        The feed basis (FD_POLN) and handedness (FD_HAND) are taken from the primary header. No other
+        feed corrections (e.g. the symmetry angle) are applied.
+
+        Returns
+        -------
+        cube : `ArchiveCube`
+            A new in-memory cube, or a view of this one if it is already Stokes parameters.
+        """
+        if self.pol_type == "IQUV":
+            return self._view()
+        if self.pol_type != "AABBCRCI":
+            raise ValueError(f"Can not convert {self.pol_type} data to Stokes parameters")
+        circular = str(self.primary_header.get("FD_POLN", "LIN")).strip().upper().startswith("CIRC")
+        hand = float(self.primary_header.get("FD_HAND", 1))
+
+        def to_stokes(data, weights):
+            aa, bb, cr, ci = data[:, 0], data[:, 1], data[:, 2], data[:, 3]
+            if circular:
+                stokes = (aa + bb, 2 * cr, 2 * ci, aa - bb)
+            else:
+                stokes = (aa + bb, aa - bb, 2 * cr, 2 * ci)
+            stokes = np.stack(stokes, axis=1)
+            stokes[:, 3] *= hand
+            return stokes
+
+        return self._derive(self._map_chunks(to_stokes), pol_type="IQUV")
+
+    def _subint_columns(self, source_columns):
+        """
+        Column definitions of the output SUBINT table, resizing the per channel and data columns.
+        """
+        per_channel = {
+            "DAT_FREQ": self.nchan,
+            "DAT_WTS":  self.nchan,
+            "DAT_OFFS": self.nchan * self.npol,
+            "DAT_SCL":  self.nchan * self.npol,
+        }
+        columns = []
+        for column in source_columns:
+            if column.name in per_channel:
+                columns.append(fits.Column(name=column.name, format=f"{per_channel[column.name]}{column.format[-1]}", unit=column.unit))
+            elif column.name == "DATA":
+                columns.append(fits.Column(
+                    name="DATA",
+                    format=f"{self.nbin * self.nchan * self.npol}I",
+                    dim=f"({self.nbin},{self.nchan},{self.npol})",
+                    unit=column.unit,
+                ))
+            else:
+                columns.append(fits.Column(name=column.name, format=column.format, unit=column.unit, dim=column.dim))
+        return fits.ColDefs(columns)
+
+    def _history_hdu(self, history, proc_cmd, history_updates):
+        """
+        A copy of the HISTORY table with a new row describing the current state of the cube.
+        """
+        updates = {
+            "NBIN":     self.nbin,
+            "NCHAN":    self.nchan,
+            "NPOL":     self.npol,
+            "POL_TYPE": self.pol_type,
+            "CHAN_BW":  self._chan_bw,
+        }
+        if history_updates is not None:
+            updates.update(history_updates)
+        return append_history_row(history, proc_cmd, updates)
+
+    @property
+    def _chan_bw(self):
+        source_nchan = self.subint_header.get("NCHAN", self.nchan)
+        return float(self.subint_header.get("CHAN_BW", 0.)) * source_nchan / self.nchan
+
+    def unload(self, filename, proc_cmd="meerpipe", history_updates=None):
+        """
+        Write the cube to a new PSRFITS archive (like psrchive's ``Archive.unload``).
+
+        All other tables are copied from the source archive, a row is added to the HISTORY table and the
+        data are quantised to 16 bits with a scale and offset per profile. The SUBINT rows are written one
+        chunk at a time so file-backed cubes are never fully loaded into memory.
+
+        Parameters
+        ----------
+        filename : str
+            Path of the output archive.
+        proc_cmd : str
+            The processing command recorded in the new HISTORY row.
+        history_updates : dict
+            Additional HISTORY columns to set in the new row (e.g. {"DEDISP": 1}).
+        """
+        if self.filename is None:
+            raise ValueError("Can only unload a cube that was loaded from an archive")
+        with fits.open(self.filename, memmap=True) as hdul:
+            names = [hdu.name for hdu in hdul]
+            subint_index = names.index("SUBINT")
+            before = []
+            for hdu in hdul[:subint_index]:
+                if hdu.name == "HISTORY":
+                    before.append(self._history_hdu(hdu, proc_cmd, history_updates))
+                else:
+                    before.append(hdu.copy())
+            after = [(hdu.data, hdu.header.copy()) for hdu in hdul[subint_index + 1:]]
+            source_columns = hdul["SUBINT"].columns
+            columns = self._subint_columns(source_columns)
+
+            table = fits.BinTableHDU.from_columns(columns, nrows=1)
+            header = table.header
+            for card in self.subint_header.cards:
+                if card.keyword in ("COMMENT", "HISTORY"):
+                    header.append(card)
+                elif card.keyword and not STRUCTURAL_KEYWORDS.match(card.keyword):
+                    header[card.keyword] = (card.value, card.comment)
+            header["NAXIS2"] = self.nsub
+            header["NPOL"] = self.npol
+            header["POL_TYPE"] = self.pol_type
+            header["NBIN"] = self.nbin
+            header["NCHAN"] = self.nchan
+            header["CHAN_BW"] = self._chan_bw
+            row_dtype = table.columns.dtype.newbyteorder(">")
+
+            with open(filename, "wb") as f:
+                fits.HDUList(before).writeto(f)
+                f.write(header.tostring().encode("ascii"))
+                written = 0
+                for start, stop, data in self.iter_chunks():
+                    rows = self._quantise_rows(start, stop, data, row_dtype)
+                    f.write(rows.tobytes())
+                    written += rows.nbytes
+                f.write(b"\0" * (-written % 2880))
+
+        for data, header in after:
+            fits.append(filename, data, header)
+
+    def _quantise_rows(self, start, stop, data, row_dtype):
+        """
+        The SUBINT table rows of a chunk of subints with the data quantised to 16 bit integers.
+        """
+        rows = np.zeros(stop - start, dtype=row_dtype)
+        minimum = data.min(axis=-1)
+        maximum = data.max(axis=-1)
+        scales = np.where(maximum > minimum, (maximum - minimum) / 65534., 1.)
+        offsets = (maximum + minimum) / 2.
+        quantised = np.round((data - offsets[..., np.newaxis]) / scales[..., np.newaxis])
+
+        values = {
+            "DATA":     quantised,
+            "DAT_SCL":  scales,
+            "DAT_OFFS": offsets,
+            "DAT_WTS":  self.weights[start:stop],
+            "DAT_FREQ": np.broadcast_to(self.freqs, (stop - start, self.nchan)),
+            "TSUBINT":  self.tsubint[start:stop],
+            "OFFS_SUB": self.offs_sub[start:stop],
+        }
+        if self.period is not None:
+            values["PERIOD"] = self.period[start:stop]
+        for name in row_dtype.names:
+            if name in values:
+                rows[name] = values[name].reshape(rows[name].shape)
+            elif self._source is not None:
+                # Other columns (LST_SUB, RA_SUB, etc.) come from the first source row of each subint
+                rows[name] = self._source[name][self.source_rows[start:stop]]
+        return rows
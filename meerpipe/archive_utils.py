@@ -11,13 +11,10 @@ __version__ = "0.1"
 import os
 import numpy as np
 
-#Importing scintools (@dreardon)
-from scintools.dynspec import Dynspec
-
-#psrchive imports
-import psrchive as ps
-
+# psrchive is imported in the functions that use it so the scripts only importing the lightweight
+# helpers (e.g. get_band) start quickly
 from meerpipe.utils import setup_logging
+from meerpipe.scratch import make_scratch_dir
 
 def get_band(bw, freq):
     """
@@ -70,7 +67,11 @@ def get_band(bw, freq):
 # - matching the phase bins of the provided file, if possible
 # - de-dedispersing the template, if required
 # returns a copy of the template which can be safely deleted as needed
-def template_adjuster(template, archive, output_dir, logger):
+# (written to a private scratch directory, removed at exit, if no output_dir is given)
+def template_adjuster(template, archive, output_dir=None, logger=None):
+    if logger is None:
+        logger = setup_logging(console=True)
+    import psrchive as ps
 
     # setup
     template_ar = ps.Archive_load(str(template))
@@ -106,6 +107,8 @@ def template_adjuster(template, archive, output_dir, logger):
 
     # the scrunch has now either been done or it has not
     # write out the temporary standard
+    if output_dir is None:
+        output_dir = make_scratch_dir("template", required_bytes=os.path.getsize(str(template)))
     new_template = os.path.join(str(output_dir),"temporary_{}.std".format(archive_bins))
     template_ar.unload(new_template)
 
@@ -145,6 +148,7 @@ def chopping_utility(
     """
     if logger is None:
         logger = setup_logging(console=True)
+    import psrchive as ps
 
     # cloning archive and ensuring it has not been dedispersed
     cleaned_ar = ps.Archive_load(archive_path)
@@ -50,3 +50,128 @@ def calc_max_nsub(
         nsub = input_nsub
 
     return nsub
+
+
+def calc_max_nsub_array(
+        sn,
+        nchan,
+        duration,
+        input_nsub,
+        sn_desired=12.,
+        minimum_duration=480.,
+    ):
+    """
+    Vectorised version of `calc_max_nsub` for many observations at once.
+
+    Parameters
+    ----------
+    sn : array_like
+        The signal-to-noise ratio of each archive.
+    nchan : array_like
+        The number of frequency channels in each decimated archive.
+    duration : array_like
+        The duration of each archive in seconds.
+    input_nsub : array_like
+        The number of subintegrations of each input archive.
+    sn_desired : float
+        The desired signal-to-noise ratio (default: 12.).
+    minimum_duration : float
+        The minimum duration of the archive in seconds (default: 480.).
+
+    Returns
+    -------
+    nsub : `numpy.ndarray`
+        The estimated number of subintegrations for each archive, identical to calling `calc_max_nsub` on each element.
+    """
+    sn, nchan, duration, input_nsub = np.broadcast_arrays(
+        np.asarray(sn, dtype=float),
+        np.asarray(nchan, dtype=float),
+        np.asarray(duration, dtype=float),
+        np.asarray(input_nsub, dtype=float),
+    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sn_chan = sn / np.sqrt(nchan)
+        estimated_duration = duration * ( sn_desired / sn_chan ) **2
+        estimated_duration = np.maximum(estimated_duration, minimum_duration)
+        nsub = np.floor( duration / estimated_duration )
+    # Zero or negative S/N gives an infinite duration so no subints
+    nsub = np.nan_to_num(nsub, nan=0., posinf=0., neginf=0.)
+    nsub = np.minimum(nsub, input_nsub)
+    return nsub.astype(int)
+
+
+def plan_toa_yield(
+        sn,
+        nchan,
+        duration,
+        input_nsub,
+        nbin=1024,
+        npol=4,
+        sn_desired=12.,
+        minimum_duration=480.,
+    ):
+    """
+    Plan the decimation of many observations and estimate the resources it will need.
+
+    Parameters
+    ----------
+    sn : array_like
+        The signal-to-noise ratio of each archive.
+    nchan : array_like
+        The number of frequency channels in each decimated archive.
+    duration : array_like
+        The duration of each archive in seconds.
+    input_nsub : array_like
+        The number of subintegrations of each input archive.
+    nbin : array_like
+        The number of phase bins of each archive (default: 1024).
+    npol : array_like
+        The number of polarisations kept in each decimated archive (default: 4).
+    sn_desired : float
+        The desired signal-to-noise ratio (default: 12.).
+    minimum_duration : float
+        The minimum duration of the archive in seconds (default: 480.).
+
+    Returns
+    -------
+    plan : dict
+        A dictionary of arrays (one element per observation) with the keys:
+        ``nsub`` the chosen number of subintegrations (at least 1, as used by the pipeline),
+        ``ntoa`` the number of ToAs the decimated archive will produce,
+        ``size_bytes`` the estimated size of the decimated PSRFITS archive and
+        ``timing_cost`` the cost of timing the archive relative to a single 1024 phase bin ToA.
+    """
+    nsub = calc_max_nsub_array(
+        sn,
+        nchan,
+        duration,
+        input_nsub,
+        sn_desired=sn_desired,
+        minimum_duration=minimum_duration,
+    )
+    # The pipeline always makes at least one subint (see the max_1 output of the calc_max_nsub script)
+    nsub = np.maximum(nsub, 1)
+    nchan, nbin, npol = np.broadcast_arrays(
+        np.asarray(nchan, dtype=int),
+        np.asarray(nbin, dtype=int),
+        np.asarray(npol, dtype=int),
+    )
+    nchan = np.broadcast_to(nchan, nsub.shape)
+    nbin  = np.broadcast_to(nbin,  nsub.shape)
+    npol  = np.broadcast_to(npol,  nsub.shape)
+
+    ntoa = nsub * nchan
+
+    # PSRFITS stores 16 bit samples plus a float32 DAT_FREQ, DAT_WTS, DAT_OFFS and DAT_SCL per channel (and pol)
+    row_bytes = 2 * npol * nchan * nbin + 4 * nchan * (2 + 2 * npol)
+    size_bytes = nsub * row_bytes
+
+    # Template matching is dominated by an FFT per profile
+    timing_cost = ntoa * (nbin * np.log2(nbin)) / (1024 * np.log2(1024))
+
+    return {
+        "nsub": nsub,
+        "ntoa": ntoa,
+        "size_bytes": size_bytes,
+        "timing_cost": timing_cost,
+    }
@@ -0,0 +1,196 @@
+"""
+Combine the (e.g. 8 second) sub-archives of an observation into one PSRFITS archive without psradd.
+
+The sub-archives' headers are checked for consistency, and for sub-archives covering the same or
+overlapping times, up front without reading their data. The raw SUBINT rows are then streamed in time order
+straight into the output file, with only OFFS_SUB changed to be relative to the start of the first
+sub-archive, and a row recording the combination is added to the HISTORY table. A thread pool reads ahead a bounded number of chunks
+so disk reads overlap the writes while memory use doesn't depend on the length of the observation.
+"""
+
+import numpy as np
+from astropy.io import fits
+from concurrent.futures import ThreadPoolExecutor
+
+from meerpipe.utils import setup_logging
+from meerpipe.archive_cube import DEFAULT_MEMORY_BUDGET, append_history_row
+
+
+def read_archive_header(archive):
+    """
+    Read what is needed to combine a sub-archive: its start time, SUBINT layout and channel frequencies.
+
+    Only the headers, the first row's DAT_FREQ and the first and last rows' times are read.
+
+    Returns
+    -------
+    header : dict
+        The "archive", start MJD as ("imjd", "seconds"), "nbin", "nchan", "npol", "pol_type", "source",
+        "freqs", "nrow", the row "dtype", the file offset of the rows ("data_offset") and the "span" of the
+        subints as (start, end) in seconds from the start MJD.
+    """
+    with fits.open(archive, memmap=True) as hdul:
+        primary = hdul[0].header
+        subint = hdul["SUBINT"]
+        nrow = subint.header["NAXIS2"]
+        header = {
+            "archive":     archive,
+            "imjd":        int(primary["STT_IMJD"]),
+            "seconds":     float(primary["STT_SMJD"]) + float(primary["STT_OFFS"]),
+            "source":      str(primary.get("SRC_NAME", "")).strip(),
+            "nbin":        subint.header["NBIN"],
+            "nchan":       subint.header["NCHAN"],
+            "npol":        subint.header["NPOL"],
+            "pol_type":    subint.header["POL_TYPE"].strip(),
+            "nrow":        nrow,
+            "dtype":       subint.columns.dtype.newbyteorder(">"),
+            "data_offset": subint.fileinfo()["datLoc"],
+        }
+    rows = np.memmap(archive, dtype=header["dtype"], mode="r", offset=header["data_offset"], shape=(nrow,))
+    header["freqs"] = np.array(rows["DAT_FREQ"][0], dtype=np.float64).ravel() if nrow else np.empty(0)
+    if nrow:
+        edges = rows["OFFS_SUB"][[0, -1]] + np.array([-0.5, 0.5]) * rows["TSUBINT"][[0, -1]]
+        header["span"] = (float(edges[0]), float(edges[1]))
+    else:
+        header["span"] = (0., 0.)
+    del rows
+    return header
+
+
+def check_consistent(headers, freq_tolerance=1e-6):
+    """
+    Raise a ValueError if the sub-archives can't be combined: they must have the same source, nbin, nchan,
+    npol, polarisation type, SUBINT row layout and channel frequencies.
+    """
+    reference = headers[0]
+    problems = []
+    for header in headers[1:]:
+        for key in ("source", "nbin", "nchan", "npol", "pol_type"):
+            if header[key] != reference[key]:
+                problems.append(f"{header['archive']} has {key}={header[key]} but {reference['archive']} has {reference[key]}")
+        if header["dtype"] != reference["dtype"]:
+            problems.append(f"{header['archive']} has a different SUBINT table layout to {reference['archive']}")
+        elif header["nrow"] and reference["nrow"] and not np.allclose(header["freqs"], reference["freqs"], rtol=0., atol=freq_tolerance):
+            problems.append(f"{header['archive']} has different channel frequencies to {reference['archive']}")
+    if problems:
+        raise ValueError("Can not combine the archives:\n" + "\n".join(problems))
+
+
+def _offset_seconds(header, first):
+    """
+    The start time of a sub-archive in seconds after the start of the first one.
+    """
+    return (header["imjd"] - first["imjd"]) * 86400. + header["seconds"] - first["seconds"]
+
+
+def check_overlaps(headers, time_tolerance=1e-3):
+    """
+    Raise a ValueError if any of the sub-archives (sorted in time order) cover the same or overlapping
+    times, e.g. the same sub-archive given twice, which would duplicate subints in the combined archive.
+    """
+    problems = []
+    latest = None
+    for header in headers:
+        if not header["nrow"]:
+            continue
+        start, end = (_offset_seconds(header, headers[0]) + edge for edge in header["span"])
+        if latest is not None and start < latest_end - time_tolerance:
+            problems.append(f"{header['archive']} overlaps {latest['archive']} by {latest_end - start:.3f} s")
+        if latest is None or end > latest_end:
+            latest, latest_end = header, end
+    if problems:
+        raise ValueError("Can not combine the archives:\n" + "\n".join(problems))
+
+
+def _read_rows(header, start, stop, offset_seconds):
+    """
+    Read raw SUBINT rows of a sub-archive with OFFS_SUB shifted to be relative to the combined start time.
+    """
+    rows = np.fromfile(
+        header["archive"],
+        dtype=header["dtype"],
+        count=stop - start,
+        offset=header["data_offset"] + start * header["dtype"].itemsize,
+    )
+    rows["OFFS_SUB"] += offset_seconds
+    return rows
+
+
+def combine_archives(archives, output, nthreads=4, memory_budget=DEFAULT_MEMORY_BUDGET, logger=None):
+    """
+    Combine sub-archives into a single archive in time order, like ``psradd``.
+
+    The tables other than SUBINT (the primary header, HISTORY, PSRPARAM, predictor, etc.) are copied from
+    the earliest sub-archive, with a row added to the HISTORY table for the combination. Sub-archives
+    covering the same or overlapping times are rejected.
+
+    Parameters
+    ----------
+    archives : list of str
+        Paths to the sub-archives, in any order.
+    output : str
+        Path of the combined archive.
+    nthreads : int
+        The number of threads reading ahead (default: 4).
+    memory_budget : int
+        Maximum size in bytes of the rows held in memory at once.
+
+    Returns
+    -------
+    nrow : int
+        The number of subints in the combined archive.
+    """
+    if logger is None:
+        logger = setup_logging(console=True)
+    if len(archives) == 0:
+        raise ValueError("No archives to combine")
+
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        headers = list(executor.map(read_archive_header, archives))
+    check_consistent(headers)
+    headers.sort(key=lambda header: (header["imjd"], header["seconds"]))
+    check_overlaps(headers)
+    first = headers[0]
+    total_rows = sum(header["nrow"] for header in headers)
+    logger.info(f"Combining {len(headers)} archives with {total_rows} subints into {output}")
+
+    # Split each archive into chunks so the rows held in memory (the read-ahead window) stay within the budget
+    row_size = first["dtype"].itemsize
+    window = 2 * nthreads
+    chunk_rows = max(1, memory_budget // (window * row_size))
+    jobs = []
+    for header in headers:
+        offset_seconds = _offset_seconds(header, first)
+        for start in range(0, header["nrow"], chunk_rows):
+            jobs.append((header, start, min(start + chunk_rows, header["nrow"]), offset_seconds))
+
+    with fits.open(first["archive"], memmap=True) as hdul:
+        names = [hdu.name for hdu in hdul]
+        subint_index = names.index("SUBINT")
+        proc_cmd = f"combine_archives ({len(headers)} sub-archives)"
+        before = [append_history_row(hdu, proc_cmd) if hdu.name == "HISTORY" else hdu.copy() for hdu in hdul[:subint_index]]
+        after = []
+        for hdu in hdul[subint_index + 1:]:
+            if hdu.name == "HISTORY":
+                hdu = append_history_row(hdu, proc_cmd)
+            after.append((hdu.data, hdu.header.copy()))
+        subint_header = hdul["SUBINT"].header.copy()
+    subint_header["NAXIS2"] = total_rows
+
+    with open(output, "wb") as f, ThreadPoolExecutor(max_workers=nthreads) as executor:
+        fits.HDUList(before).writeto(f)
+        f.write(subint_header.tostring().encode("ascii"))
+        written = 0
+        # Keep a bounded number of reads in flight ahead of the one being written
+        pending = [executor.submit(_read_rows, *job) for job in jobs[:window]]
+        for i in range(len(jobs)):
+            rows = pending.pop(0).result()
+            if i + window < len(jobs):
+                pending.append(executor.submit(_read_rows, *jobs[i + window]))
+            f.write(rows.tobytes())
+            written += rows.nbytes
+        f.write(b"\0" * (-written % 2880))
+
+    for data, header in after:
+        fits.append(output, data, header)
+    return total_rows
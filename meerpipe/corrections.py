@@ -0,0 +1,179 @@
+"""
+Faraday rotation and dispersion corrections applied in-process (like ``pam -R <rm> -D``) in a single pass.
+
+The rotation measures come from the bundled catalogue (`meerpipe.data_load.RM_CAT`), which is parsed once
+into a dictionary. Each chunk of subints is dedispersed with Fourier phase ramps and has the Q/U plane of
+every channel rotated back by the Faraday rotation relative to the reference frequency, then the corrected
+cube is written with DEDISP and RM_CORR set in its HISTORY.
+"""
+
+import functools
+import numpy as np
+from astropy.io import fits
+
+from meerpipe.utils import setup_logging
+from meerpipe.data_load import RM_CAT
+from meerpipe.archive_cube import ArchiveCube
+from meerpipe.profile_utils import fft_shift_profiles, dispersion_shifts
+
+SPEED_OF_LIGHT = 299792458.
+
+# The polarisation types with Stokes Q and U (or the coherence products they come from) to Faraday rotate
+FARADAY_POL_TYPES = ("IQUV", "AABBCRCI")
+
+
+@functools.lru_cache(maxsize=None)
+def rm_catalogue(rm_cat=RM_CAT):
+    """
+    Index the rotation measure catalogue by pulsar name (the last entry of a pulsar wins).
+
+    Returns
+    -------
+    rms : dict
+        The rotation measure in rad m^-2 of each pulsar.
+    """
+    rms = {}
+    with open(rm_cat, "r") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 2 or fields[0].startswith("#"):
+                continue
+            try:
+                rms[fields[0]] = float(fields[1])
+            except ValueError:
+                continue
+    return rms
+
+
+def lookup_rm(pulsar, rm_cat=RM_CAT):
+    """
+    The catalogue rotation measure of a pulsar, or None if it isn't in the catalogue.
+    """
+    return rm_catalogue(rm_cat).get(pulsar)
+
+
+def faraday_angles(freqs, rm, ref_freq):
+    """
+    The Faraday rotation of the polarisation position angle (radians) of each channel relative to the reference frequency.
+    """
+    wavelength_sq = (SPEED_OF_LIGHT / (np.asarray(freqs, dtype=np.float64) * 1e6)) ** 2
+    ref_wavelength_sq = 0. if ref_freq is None or np.isinf(ref_freq) else (SPEED_OF_LIGHT / (ref_freq * 1e6)) ** 2
+    return rm * (wavelength_sq - ref_wavelength_sq)
+
+
+def _rotate_qu(data, angles, pol_type, circular):
+    """
+    Rotate the linear polarisation of a (nsub, npol, nchan, nbin) chunk by -2 * angle in each channel.
+    """
+    cos = np.cos(2 * angles)[:, np.newaxis]
+    sin = np.sin(2 * angles)[:, np.newaxis]
+    if pol_type == "IQUV":
+        q, u = data[:, 1].copy(), data[:, 2].copy()
+        data[:, 1] = cos * q + sin * u
+        data[:, 2] = cos * u - sin * q
+    elif pol_type == "AABBCRCI":
+        # Q and U are AA - BB and 2 CR for linear feeds, or 2 CR and 2 CI for circular feeds
+        if circular:
+            q, u = 2 * data[:, 2], 2 * data[:, 3]
+            data[:, 2] = (cos * q + sin * u) / 2
+            data[:, 3] = (cos * u - sin * q) / 2
+        else:
+            total = data[:, 0] + data[:, 1]
+            q, u = data[:, 0] - data[:, 1], 2 * data[:, 2]
+            new_q = cos * q + sin * u
+            data[:, 0] = (total + new_q) / 2
+            data[:, 1] = (total - new_q) / 2
+            data[:, 2] = (cos * u - sin * q) / 2
+    return data
+
+
+def correct_cube(cube, rm=None, dedisperse=True, ref_freq=None):
+    """
+    Dedisperse and Faraday de-rotate a cube in one pass over its data.
+
+    Parameters
+    ----------
+    cube : `ArchiveCube`
+        The cube to correct.
+    rm : float
+        The rotation measure in rad m^-2 to remove (None to skip the Faraday correction).
+    dedisperse : bool
+        Whether to remove the dispersion delays (skipped if the cube is already dedispersed).
+    ref_freq : float
+        The frequency in MHz the channels are aligned and rotated to (default: the centre frequency).
+
+    Returns
+    -------
+    cube : `ArchiveCube`
+        A new in-memory cube.
+    """
+    ref_freq = cube.centre_frequency if ref_freq is None else ref_freq
+    dedisperse = dedisperse and not cube.dedispersed and cube.dm != 0. and cube.period is not None
+    rotate = rm is not None and rm != 0. and cube.pol_type in FARADAY_POL_TYPES
+    circular = str(cube.primary_header.get("FD_POLN", "LIN")).strip().upper().startswith("CIRC")
+    angles = faraday_angles(cube.freqs, rm, ref_freq) if rotate else None
+
+    chunks = []
+    for start, stop, data in cube.iter_chunks():
+        data = np.array(data, dtype=np.float32)
+        if dedisperse:
+            shifts = dispersion_shifts(cube.freqs, cube.dm, cube.period[start:stop, np.newaxis], cube.nbin, ref_freq)
+            data = fft_shift_profiles(data, shifts[:, np.newaxis, :])
+        if rotate:
+            data = _rotate_qu(data, angles, cube.pol_type, circular)
+        chunks.append(data)
+    return cube._derive(np.concatenate(chunks), dedispersed=cube.dedispersed or dedisperse)
+
+
+def _history_value(archive, column):
+    with fits.open(archive, memmap=True) as hdul:
+        if "HISTORY" not in hdul or column not in hdul["HISTORY"].columns.names or not len(hdul["HISTORY"].data):
+            return 0
+        return int(hdul["HISTORY"].data[column][-1])
+
+
+def correct_archive(archive, output, rm=None, rm_cat=RM_CAT, dedisperse=True, logger=None):
+    """
+    Apply the RM and DM corrections to an archive and write the result (replacing ``pam -R <rm> -D``).
+
+    Parameters
+    ----------
+    archive : str
+        Path to the archive.
+    output : str
+        Path of the corrected archive.
+    rm : float
+        The rotation measure in rad m^-2 (default: from the catalogue, skipped if the pulsar isn't in it).
+    rm_cat : str
+        Path to the rotation measure catalogue.
+    dedisperse : bool
+        Whether to dedisperse the archive (default: True).
+
+    Returns
+    -------
+    rm : float
+        The rotation measure that was removed, or None if there was no Faraday correction (e.g. the archive
+        is already corrected or total intensity only).
+    """
+    if logger is None:
+        logger = setup_logging(console=True)
+    cube = ArchiveCube.load(archive)
+    if rm is None:
+        rm = lookup_rm(cube.source, rm_cat)
+        logger.info(f"Catalogue RM of {cube.source}: {rm}")
+    if rm is not None and _history_value(archive, "RM_CORR"):
+        logger.info(f"{archive} is already Faraday corrected")
+        rm = None
+    if rm is not None and cube.pol_type not in FARADAY_POL_TYPES:
+        logger.info(f"{archive} has no linear polarisation ({cube.pol_type}) to Faraday correct")
+        rm = None
+
+    corrected = correct_cube(cube, rm=rm, dedisperse=dedisperse)
+    history_updates = {"DEDISP": int(corrected.dedispersed)}
+    if rm is not None:
+        corrected.subint_header = corrected.subint_header.copy()
+        corrected.subint_header["RM"] = rm
+        history_updates["RM_CORR"] = 1
+    proc_cmd = "meerpipe correct" + (" -D" if dedisperse else "") + (f" -R {rm}" if rm is not None else "")
+    corrected.unload(output, proc_cmd=proc_cmd, history_updates=history_updates)
+    return rm
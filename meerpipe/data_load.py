@@ -19,3 +19,6 @@ RM_CAT = os.path.join(datadir, 'rm_catalogue.txt')
 
 # Delay config file for the PTUSE originally obtained from the dlyfix repo
 DELAY_CONFIG = os.path.join(datadir, 'ptuse.dlycfg')
+
+# The stages run on each observation (see meerpipe.pipeline)
+OBSERVATION_PIPELINE = os.path.join(datadir, 'observation_pipeline.json')
@@ -0,0 +1,227 @@
+"""
+Produce all of the decimated archives of an observation from a single read of the cleaned archive.
+
+The cleaned archive is scrunched once to the finest resolution any product needs, then each product is
+derived from the smallest already decimated archive it can be exactly formed from (a scrunch pyramid)
+instead of running ``pam --setnsub <nsub> --setnchn <nchan> -S`` on the full archive for every product.
+
+Decimation products are given by the ``decimation_products`` entry of the project config, either a path to
+a list file or an inline comma separated list. Each product is ``<nsub> <nchan> [<stokes_op>]`` where nsub
+may be ``max`` (the maximum number of sensitive subints from `meerpipe.calc_max_nsub.calc_max_nsub`) and the
+optional stokes_op is ``S`` (full Stokes, the default) or ``p`` (total intensity).
+"""
+
+import os
+import math
+import numpy as np
+
+from meerpipe.utils import setup_logging
+from meerpipe.archive_cube import ArchiveCube, group_edges
+from meerpipe.calc_max_nsub import calc_max_nsub
+
+
+def read_config(config_file):
+    """
+    Read a ``key = value`` project config file, ignoring comments.
+
+    Parameters
+    ----------
+    config_file : str
+        Path to the config file.
+
+    Returns
+    -------
+    config : dict
+        Dictionary of the config values as strings.
+    """
+    config = {}
+    with open(config_file, 'r') as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            config[key.strip()] = value.strip()
+    return config
+
+
+def parse_decimation_products(products):
+    """
+    Parse a decimation product list.
+
+    Parameters
+    ----------
+    products : str or list of str
+        Either a path to a file with one product per line, an inline comma separated string of products
+        or a list of product strings. Each product is ``<nsub> <nchan> [<stokes_op>]``.
+
+    Returns
+    -------
+    products : list of tuple
+        The (nsub, nchan, stokes_op) of each product where nsub is an int or "max" and stokes_op is "S" or "p".
+    """
+    if isinstance(products, str):
+        if os.path.isfile(products):
+            with open(products, 'r') as f:
+                products = f.readlines()
+        else:
+            products = products.split(",")
+
+    parsed = []
+    for product in products:
+        fields = product.split("#", 1)[0].split()
+        if len(fields) == 0:
+            continue
+        if len(fields) not in (2, 3):
+            raise ValueError(f"Can not parse decimation product '{product.strip()}', expected '<nsub> <nchan> [<stokes_op>]'")
+        nsub = fields[0].lower()
+        if nsub not in ("max", "max_nsub"):
+            nsub = int(nsub)
+        else:
+            nsub = "max"
+        stokes_op = fields[2] if len(fields) == 3 else "S"
+        if stokes_op not in ("S", "p"):
+            raise ValueError(f"Unknown stokes_op '{stokes_op}' in decimation product '{product.strip()}'")
+        product = (nsub, int(fields[1]), stokes_op)
+        if product not in parsed:
+            parsed.append(product)
+    return parsed
+
+
+def resolve_products(products, cube, sn=None, sn_desired=12., minimum_duration=480.):
+    """
+    Convert the products to (nsub, nchan, npol) that can be made from the archive.
+
+    Products with more subints or channels than the archive are limited to its resolution and products with
+    an nsub of "max" are converted using the signal-to-noise ratio of the archive.
+    """
+    resolved = []
+    for nsub, nchan, stokes_op in products:
+        nchan = min(nchan, cube.nchan)
+        if nsub == "max":
+            if sn is None:
+                raise ValueError("The archive S/N is required to make 'max' nsub decimation products")
+            nsub = calc_max_nsub(sn, nchan, cube.length, cube.nsub, sn_desired=sn_desired, minimum_duration=minimum_duration)
+        nsub = max(1, min(nsub, cube.nsub))
+        npol = 1 if stokes_op == "p" else cube.npol
+        if (nsub, nchan, npol) not in resolved:
+            resolved.append((nsub, nchan, npol))
+    return resolved
+
+
+def is_nested(n, parent, child):
+    """
+    Whether scrunching n elements to parent groups and then to child groups gives the same groups as
+    scrunching directly to child groups, so the child can be made exactly from the parent.
+    """
+    if parent < child:
+        return False
+    parent_edges = group_edges(n, parent)
+    return np.array_equal(parent_edges[group_edges(parent, child)], group_edges(n, child))
+
+
+def root_resolution(cube, products):
+    """
+    The coarsest (nsub, nchan) every product can be exactly derived from.
+    """
+    nsub = min(math.lcm(*[product[0] for product in products]), cube.nsub)
+    nchan = min(math.lcm(*[product[1] for product in products]), cube.nchan)
+    if not all(is_nested(cube.nsub, nsub, product[0]) for product in products):
+        nsub = cube.nsub
+    if not all(is_nested(cube.nchan, nchan, product[1]) for product in products):
+        nchan = cube.nchan
+    return nsub, nchan
+
+
+def decimated_filename(archive, output_dir, nsub, nchan, npol):
+    """
+    The output path of a decimated product, e.g. ``<stem>.16ch4p32t.ar``.
+    """
+    stem = os.path.splitext(os.path.basename(archive))[0]
+    return os.path.join(output_dir, f"{stem}.{nchan}ch{npol}p{nsub}t.ar")
+
+
+def decimate_archive(
+        archive,
+        products,
+        output_dir="./",
+        sn=None,
+        sn_desired=12.,
+        minimum_duration=480.,
+        logger=None,
+    ):
+    """
+    Make all of the decimation products of an archive while only reading it once.
+
+    Parameters
+    ----------
+    archive : str
+        Path to the cleaned archive.
+    products : str or list
+        The decimation products (see `parse_decimation_products`).
+    output_dir : str
+        Directory to write the decimated archives to (default: ./).
+    sn : float
+        The signal-to-noise ratio of the archive, required for "max" nsub products.
+    sn_desired : float
+        The desired signal-to-noise ratio of "max" nsub products (default: 12.).
+    minimum_duration : float
+        The minimum duration of the subints of "max" nsub products in seconds (default: 480.).
+
+    Returns
+    -------
+    outputs : list of str
+        The paths of the decimated archives in the order of the products.
+    """
+    if logger is None:
+        logger = setup_logging(console=True)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    cube = ArchiveCube.load(archive)
+    products = resolve_products(
+        parse_decimation_products(products),
+        cube,
+        sn=sn,
+        sn_desired=sn_desired,
+        minimum_duration=minimum_duration,
+    )
+    if len(products) == 0:
+        logger.warning("No decimation products to make")
+        return []
+
+    # The single pass over the archive
+    root_nsub, root_nchan = root_resolution(cube, products)
+    logger.info(f"Scrunching {archive} from nsub={cube.nsub} nchan={cube.nchan} to nsub={root_nsub} nchan={root_nchan}")
+    root = cube.scrunch(nsub=root_nsub, nchan=root_nchan)
+    if root.npol == 4 and root.pol_type != "IQUV":
+        # Stokes I is AA+BB so total intensity products can also be made from the Stokes root
+        root = root.convert_to_stokes()
+    built = {(root_nsub, root_nchan, root.npol): root}
+
+    # Make the finest products first so coarser ones can be derived from them
+    outputs = {}
+    for nsub, nchan, npol in sorted(products, key=lambda product: (-product[0] * product[1], -product[2])):
+        parents = [
+            (key, parent) for key, parent in built.items()
+            if key[2] >= npol
+            and is_nested(cube.nsub, key[0], nsub)
+            and is_nested(cube.nchan, key[1], nchan)
+        ]
+        _, parent = min(parents, key=lambda item: item[1].nbytes)
+        product = parent
+        if (parent.nsub, parent.nchan) != (nsub, nchan):
+            product = product.scrunch(nsub=nsub, nchan=nchan)
+        if npol != product.npol:
+            product = product.pscrunch()
+        built[(nsub, nchan, npol)] = product
+
+        output = decimated_filename(archive, output_dir, nsub, nchan, npol)
+        product.unload(
+            output,
+            proc_cmd=f"decimate --setnsub {nsub} --setnchn {nchan} {'-p' if npol == 1 else '-S'}",
+        )
+        logger.info(f"Wrote {output}")
+        outputs[(nsub, nchan, npol)] = output
+
+    return [outputs[product] for product in products]
@@ -0,0 +1,157 @@
+"""
+In-process dynamic spectra (the template matched flux of every subint and channel), replacing psrflux.
+
+The flux of every (subint, channel) profile is the least squares scale factor of the template, computed for
+the whole cube at once from the Fourier transforms of the profiles. The result can be handed straight to
+scintools and is only written as a psrflux format ``.dynspec`` text file when needed for compatibility.
+"""
+
+import numpy as np
+
+from meerpipe.utils import setup_logging
+from meerpipe.archive_cube import ArchiveCube
+from meerpipe.obs_stats import off_pulse_window
+from meerpipe.profile_utils import fft_shift_profiles, resample_profile, cross_correlation_shifts
+
+
+def template_profile(template, nbin):
+    """
+    Load a template archive as a total intensity profile with nbin phase bins (replacing `template_adjuster`).
+
+    Parameters
+    ----------
+    template : str
+        Path to the template (standard) archive.
+    nbin : int
+        The number of phase bins of the archive the template will be matched to.
+
+    Returns
+    -------
+    profile : `numpy.ndarray`
+        The (nbin,) template profile.
+    """
+    cube = ArchiveCube.load(template).pscrunch().scrunch(nsub=1, nchan=1)
+    return resample_profile(cube.data[0, 0, 0].astype(np.float64), nbin)
+
+
+def template_flux(profiles, template):
+    """
+    Fit every profile as a scaled copy of the template plus a baseline.
+
+    Parameters
+    ----------
+    profiles : `numpy.ndarray`
+        The (..., nbin) profiles.
+    template : `numpy.ndarray`
+        The (nbin,) template profile, aligned with the profiles.
+
+    Returns
+    -------
+    scale : `numpy.ndarray`
+        The template scale factor of each profile.
+    scale_err : `numpy.ndarray`
+        The uncertainty of each scale factor from the rms of the fit residuals.
+    """
+    nbin = profiles.shape[-1]
+    spectra = np.fft.rfft(profiles, axis=-1)
+    template_spectrum = np.fft.rfft(template)
+    # Each harmonic (except DC and Nyquist) appears twice in the real profile, and DC only holds the baseline
+    harmonic_weights = np.full(nbin // 2 + 1, 2.)
+    harmonic_weights[0] = 0.
+    if nbin % 2 == 0:
+        harmonic_weights[-1] = 1.
+
+    template_power = np.sum(harmonic_weights * np.abs(template_spectrum) ** 2) / nbin
+    cross_power = np.sum(harmonic_weights * (spectra * np.conj(template_spectrum)).real, axis=-1) / nbin
+    profile_power = np.sum(harmonic_weights * np.abs(spectra) ** 2, axis=-1) / nbin
+    if template_power == 0.:
+        zeros = np.zeros(profiles.shape[:-1])
+        return zeros, zeros
+    scale = cross_power / template_power
+    # Residual power after removing the baseline and the scaled template
+    residual_var = np.maximum(profile_power - scale ** 2 * template_power, 0.) / max(nbin - 2, 1)
+    scale_err = np.sqrt(residual_var / template_power)
+    return scale, scale_err
+
+
+def dynamic_spectrum(archive, template, logger=None):
+    """
+    Calculate the dynamic spectrum of an archive like ``psrflux -s <template>``.
+
+    Parameters
+    ----------
+    archive : str or `ArchiveCube`
+        The archive (or an already loaded cube) to make the dynamic spectrum of.
+    template : str or `numpy.ndarray`
+        Path to the template archive or a total intensity template profile.
+
+    Returns
+    -------
+    flux : `numpy.ndarray`
+        The (nsub, nchan) flux, zero for zapped channels.
+    flux_err : `numpy.ndarray`
+        The (nsub, nchan) uncertainty of the flux, zero for zapped channels.
+    cube : `ArchiveCube`
+        The dedispersed total intensity cube the fluxes were measured from.
+    """
+    if logger is None:
+        logger = setup_logging(console=True)
+
+    cube = archive if isinstance(archive, ArchiveCube) else ArchiveCube.load(archive)
+    logger.info("Dedispersing the total intensity data")
+    cube = cube.pscrunch().dedisperse()
+    profiles = cube.data[:, 0].astype(np.float64)
+
+    if isinstance(template, str):
+        template = template_profile(template, cube.nbin)
+    template = resample_profile(np.asarray(template, dtype=np.float64), cube.nbin)
+
+    # Align the template to the total profile once rather than fitting a phase for each profile
+    total = cube.scrunch(nsub=1, nchan=1).data[0, 0, 0].astype(np.float64)
+    shift = cross_correlation_shifts(total[np.newaxis], template)[0]
+    template = fft_shift_profiles(template, shift)
+    logger.info(f"Aligned the template by {shift:.3f} bins")
+
+    scale, scale_err = template_flux(profiles, template)
+    # Flux in the units of the archive is the scale times the mean of the baseline subtracted template
+    template_mean = np.mean(template - np.mean(template[off_pulse_window(template)]))
+    zapped = cube.weights == 0.
+    flux = np.where(zapped, 0., scale * template_mean)
+    flux_err = np.where(zapped, 0., scale_err * abs(template_mean))
+    return flux, flux_err, cube
+
+
+def write_psrflux_dynspec(dynspec_file, cube, flux, flux_err, archive_name="", template_name=""):
+    """
+    Write a dynamic spectrum in the psrflux text format that `scintools.dynspec.Dynspec` can read.
+
+    Parameters
+    ----------
+    dynspec_file : str
+        Path of the output file (usually ``<archive>.dynspec``).
+    cube : `ArchiveCube`
+        The cube the dynamic spectrum was made from.
+    flux, flux_err : `numpy.ndarray`
+        The (nsub, nchan) flux and uncertainty.
+    """
+    imjd, frac = cube.start_mjd
+    # psrflux times are the subint centres in minutes since the start of the observation
+    times = (cube.offs_sub - (cube.offs_sub[0] - cube.tsubint[0] / 2)) / 60.
+    isub, ichan = np.meshgrid(np.arange(cube.nsub), np.arange(cube.nchan), indexing="ij")
+    rows = np.column_stack([
+        isub.ravel(),
+        ichan.ravel(),
+        np.repeat(times, cube.nchan),
+        np.tile(cube.freqs, cube.nsub),
+        flux.ravel(),
+        flux_err.ravel(),
+    ])
+    header = "\n".join([
+        "Dynamic spectrum computed by meerpipe.dynspec",
+        f"Data file: {archive_name}",
+        f"Template: {template_name}",
+        f"MJD0: {imjd + frac:.10f}",
+        "Data columns:",
+        "isub ichan time(min) freq(MHz) flux flux_err",
+    ])
+    np.savetxt(dynspec_file, rows, fmt=["%d", "%d", "%.6f", "%.6f", "%.6e", "%.6e"], header=header, comments="# ")
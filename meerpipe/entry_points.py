@@ -0,0 +1,76 @@
+"""
+Registry of the meerpipe console scripts so they can be run in-process with their command line arguments.
+
+`CONSOLE_SCRIPTS` mirrors ``[tool.poetry.scripts]`` in pyproject.toml (checked by the tests).
+"""
+
+import sys
+import importlib
+
+ENTRY_POINTS = {
+    "fluxcal_meerkat":         "meerpipe.scripts.fluxcal_meerkat:main",
+    "generate_images_results": "meerpipe.scripts.generate_images_results:main",
+    "dlyfix":                  "meerpipe.scripts.dlyfix:main",
+    "make_stokes_movie":       "meerpipe.scripts.make_stokes_movie:main",
+    "chop_edge_channels":      "meerpipe.scripts.chop_edge_channels:main",
+    "calc_max_nsub":           "meerpipe.scripts.calc_max_nsub:main",
+    "plan_toa_yield":          "meerpipe.scripts.plan_toa_yield:main",
+    "decimate_archive":        "meerpipe.scripts.decimate_archive:main",
+    "obs_stats":               "meerpipe.scripts.obs_stats:main",
+    "scintillation":           "meerpipe.scripts.scintillation:main",
+    "generate_toas":           "meerpipe.scripts.generate_toas:main",
+    "toa_select":              "meerpipe.scripts.toa_select:main",
+    "residual_store":          "meerpipe.scripts.residual_store:main",
+    "plot_global_residuals":   "meerpipe.scripts.plot_global_residuals:main",
+    "combine_archives":        "meerpipe.scripts.combine_archives:main",
+    "correct_archive":         "meerpipe.scripts.correct_archive:main",
+    "import_benchmark":        "meerpipe.scripts.import_benchmark:main",
+}
+
+# Every console script, including the pipeline runner which isn't run as a stage or worker task itself
+CONSOLE_SCRIPTS = dict(ENTRY_POINTS, meerpipe="meerpipe.scripts.run:main")
+
+
+def load_entry_point(name):
+    """
+    Import the main function of an entry point, given its name or a "module:function" path.
+    """
+    target = ENTRY_POINTS.get(name, name)
+    if ":" not in target:
+        raise KeyError(f"Unknown entry point {name}")
+    module, function = target.split(":")
+    return getattr(importlib.import_module(module), function)
+
+
+def run_entry_point(name, args=()):
+    """
+    Run an entry point as if it was called from the command line.
+
+    Parameters
+    ----------
+    name : str
+        The entry point name (e.g. "calc_max_nsub") or a "module:function" path.
+    args : list of str
+        The command line arguments.
+
+    Returns
+    -------
+    returncode : int
+        The exit code the console script would have exited with.
+    """
+    main = load_entry_point(name)
+    saved_argv = sys.argv
+    sys.argv = [name] + [str(arg) for arg in args]
+    try:
+        main()
+        return 0
+    except SystemExit as error:
+        if error.code is None:
+            return 0
+        if isinstance(error.code, int):
+            return error.code
+        # sys.exit("message") prints the message and exits with 1
+        print(error.code, file=sys.stderr)
+        return 1
+    finally:
+        sys.argv = saved_argv
@@ -0,0 +1,157 @@
+"""
+Measure the start up (import) time of the meerpipe console scripts with ``python -X importtime``.
+
+Each script's module is imported in a fresh interpreter and the import times reported on stderr are
+summed, excluding what the interpreter imports at start up anyway. A script fails the benchmark if its
+imports take longer than its budget (`THRESHOLDS`) or if it imports one of the heavy libraries
+(`LAZY_MODULES`) at start up, which should only be imported by the functions that need them.
+"""
+
+import sys
+import subprocess
+
+from meerpipe.entry_points import CONSOLE_SCRIPTS
+
+# Libraries that are slow to import and only needed on some code paths
+LAZY_MODULES = ("psrchive", "scintools", "coast_guard", "matplotlib", "PIL")
+
+# Scripts that always need one of the lazy libraries
+ALLOWED_MODULES = {
+    "plot_global_residuals": ("matplotlib", "PIL"),
+}
+
+# Maximum import time in seconds of the scripts without a budget in THRESHOLDS
+DEFAULT_THRESHOLD = 1.
+
+# The import time budget in seconds of each script, about three times what it takes on a workstation. The
+# scripts that only need numpy have the tightest budgets, so e.g. a top level import of astropy fails them
+THRESHOLDS = {
+    "meerpipe":                0.3,
+    "import_benchmark":        0.3,
+    "dlyfix":                  0.3,
+    "calc_max_nsub":           0.3,
+    "chop_edge_channels":      0.3,
+    "plan_toa_yield":          0.3,
+    "make_stokes_movie":       0.3,
+    "toa_select":              0.4,
+    "residual_store":          0.4,
+    "fluxcal_meerkat":         0.8,
+    "decimate_archive":        1.,
+    "obs_stats":               1.,
+    "scintillation":           1.2,
+    "generate_toas":           1.,
+    "combine_archives":        1.2,
+    "correct_archive":         1.,
+    "generate_images_results": 1.5,
+    "plot_global_residuals":   2.,
+}
+
+
+def parse_importtime(stderr):
+    """
+    Parse the ``-X importtime`` report.
+
+    Returns
+    -------
+    imports : list of tuple
+        The (module, self seconds, cumulative seconds, depth) of each import in the order they finished,
+        where depth 0 is a top level import.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2][1:] if fields[2].startswith(" ") else fields[2]
+        module = name.lstrip()
+        depth = (len(name) - len(module)) // 2
+        imports.append((module, int(fields[0]) * 1e-6, int(fields[1]) * 1e-6, depth))
+    return imports
+
+
+def _importtime(code, python=sys.executable):
+    proc = subprocess.run([python, "-X", "importtime", "-c", code], capture_output=True, text=True)
+    return proc.returncode, proc.stderr
+
+
+def import_time(module, repeat=3, python=sys.executable):
+    """
+    The time to import a module in a fresh interpreter (the fastest of several runs).
+
+    Returns
+    -------
+    result : dict
+        The "seconds" spent importing, the "modules" that were imported, the "slowest" five imports by
+        their own ("self") time, and the "error" message if the import failed.
+    """
+    _, baseline = _importtime("pass", python)
+    startup = {module for module, _, _, _ in parse_importtime(baseline)}
+
+    best = None
+    for _ in range(repeat):
+        returncode, stderr = _importtime(f"import {module}", python)
+        if returncode != 0:
+            error = [line for line in stderr.splitlines() if not line.startswith("import time:")]
+            return {"seconds": None, "modules": [], "slowest": [], "error": error[-1] if error else "import failed"}
+        imports = [entry for entry in parse_importtime(stderr) if entry[0] not in startup]
+        seconds = sum(cumulative for _, _, cumulative, depth in imports if depth == 0)
+        if best is None or seconds < best["seconds"]:
+            slowest = sorted(imports, key=lambda entry: entry[1], reverse=True)[:5]
+            best = {
+                "seconds": seconds,
+                "modules": [entry[0] for entry in imports],
+                "slowest": [[name, self_time] for name, self_time, _, _ in slowest],
+                "error": None,
+            }
+    return best
+
+
+def lazy_violations(script, modules):
+    """
+    The heavy libraries (`LAZY_MODULES`) a script imported at start up that it isn't allowed to.
+    """
+    allowed = ALLOWED_MODULES.get(script, ())
+    loaded = {module.split(".")[0] for module in modules}
+    return sorted(lazy for lazy in LAZY_MODULES if lazy in loaded and lazy not in allowed)
+
+
+def benchmark_entry_points(scripts=None, thresholds=None, default_threshold=DEFAULT_THRESHOLD, repeat=3, python=sys.executable):
+    """
+    Benchmark the import time of console scripts.
+
+    Parameters
+    ----------
+    scripts : list of str
+        The console script names (default: all of `CONSOLE_SCRIPTS`).
+    thresholds : dict
+        The maximum import time in seconds of individual scripts, overriding `THRESHOLDS`.
+    default_threshold : float
+        The maximum import time in seconds of the scripts without a threshold.
+    repeat : int
+        The number of times each script is imported (the fastest is used).
+
+    Returns
+    -------
+    report : dict
+        For each script: its "module", import "seconds", "threshold", the "lazy_violations", the
+        "slowest" imports, any import "error" and whether it "passed".
+    """
+    thresholds = dict(THRESHOLDS, **(thresholds or {}))
+    report = {}
+    for script in scripts or CONSOLE_SCRIPTS:
+        module = CONSOLE_SCRIPTS[script].split(":")[0]
+        result = import_time(module, repeat=repeat, python=python)
+        threshold = thresholds.get(script, default_threshold)
+        violations = lazy_violations(script, result["modules"])
+        report[script] = {
+            "module":          module,
+            "seconds":         result["seconds"],
+            "threshold":       threshold,
+            "lazy_violations": violations,
+            "slowest":         result["slowest"],
+            "error":           result["error"],
+            "passed":          result["error"] is None and result["seconds"] <= threshold and not violations,
+        }
+    return report
@@ -0,0 +1,176 @@
+"""
+Observation statistics computed in a single pass over a cleaned archive and stored in a small sidecar.
+
+The sidecar is a JSON file of the scalar statistics (S/N, nsub, length, zap fraction, etc.) with the
+per-channel and per-subint arrays in an NPZ file next to it. Later stages (calc_max_nsub, fluxcal and
+generate_images_results) read the sidecar instead of reloading the archive or calling psrstat and vap.
+"""
+
+import os
+import json
+import numpy as np
+
+from meerpipe.utils import setup_logging
+from meerpipe.archive_cube import ArchiveCube
+from meerpipe.zap_stats import zap_stats
+
+
+def off_pulse_window(profile, duty_cycle=0.15):
+    """
+    Find the off-pulse region as the window of lowest mean (like psrchive's default baseline estimator).
+
+    Parameters
+    ----------
+    profile : `numpy.ndarray`
+        The (nbin,) total intensity profile.
+    duty_cycle : float
+        The width of the window as a fraction of the pulse period (default: 0.15).
+
+    Returns
+    -------
+    mask : `numpy.ndarray`
+        Boolean (nbin,) mask of the off-pulse bins.
+    """
+    nbin = len(profile)
+    width = max(1, int(round(duty_cycle * nbin)))
+    # Circular running sums of every window from the cumulative sum of the wrapped profile
+    cumulative = np.concatenate([[0.], np.cumsum(np.concatenate([profile, profile[:width]]))])
+    window_sums = cumulative[width:width + nbin] - cumulative[:nbin]
+    start = np.argmin(window_sums)
+    mask = np.zeros(nbin, dtype=bool)
+    mask[(start + np.arange(width)) % nbin] = True
+    return mask
+
+
+def snr_pdmp(profile, off_mask=None):
+    """
+    Signal-to-noise ratio of a profile using the pdmp method (psrstat ``snr=pdmp``).
+
+    The baseline mean and rms are measured in the off-pulse window and the S/N is the maximum over all
+    boxcar widths (from 1 bin to half the profile) and phases of the summed flux divided by its noise.
+
+    Parameters
+    ----------
+    profile : `numpy.ndarray`
+        The (nbin,) total intensity profile.
+    off_mask : `numpy.ndarray`
+        Boolean (nbin,) mask of the off-pulse bins (default: from `off_pulse_window`).
+
+    Returns
+    -------
+    snr : float
+        The signal-to-noise ratio.
+    """
+    nbin = len(profile)
+    if off_mask is None:
+        off_mask = off_pulse_window(profile)
+    rms = np.std(profile[off_mask])
+    if rms == 0.:
+        return 0.
+    baselined = profile - np.mean(profile[off_mask])
+    cumulative = np.concatenate([[0.], np.cumsum(np.concatenate([baselined, baselined]))])
+    widths = np.arange(1, nbin // 2 + 1)
+    # (width, phase) boxcar sums
+    sums = cumulative[widths[:, np.newaxis] + np.arange(nbin)] - cumulative[np.arange(nbin)]
+    return float(np.max(sums / (rms * np.sqrt(widths[:, np.newaxis]))))
+
+
+def compute_obs_stats(archive, logger=None):
+    """
+    Compute the statistics of an archive in a single pass over its data.
+
+    Parameters
+    ----------
+    archive : str
+        Path to the (cleaned) archive.
+
+    Returns
+    -------
+    stats : dict
+        The scalar statistics (archive, source, nsub, nchan, nbin, length, bw, sn, zap_fraction).
+    arrays : dict
+        The per-channel (freqs, offrms, chan_zap_fraction) and per-subint (subint_zap_fraction) arrays, the
+        zap mask (zap_shape, zap_runs) and the frequency and time scrunched total intensity profile. The
+        offrms of zapped channels is NaN.
+    """
+    if logger is None:
+        logger = setup_logging(console=True)
+
+    logger.info(f"Computing observation statistics of {archive}")
+    cube = ArchiveCube.load(archive)
+    # The only pass over the data, everything else uses the (nchan, nbin) total intensity profiles
+    scrunched = cube.tscrunch().pscrunch()
+    channel_profiles = scrunched.data[0, 0].astype(np.float64)
+    chan_weights = cube.weights.sum(axis=0)
+    profile = scrunched.fscrunch().data[0, 0, 0].astype(np.float64)
+    off_mask = off_pulse_window(profile)
+    offrms = np.std(channel_profiles[:, off_mask], axis=1)
+    # Zapped channels have no off-pulse rms
+    offrms[chan_weights == 0.] = np.nan
+
+    zapped = zap_stats(cube.weights)
+    stats = {
+        "archive":      os.path.abspath(archive),
+        "source":       cube.source,
+        "nsub":         int(cube.nsub),
+        "nchan":        int(cube.nchan),
+        "nbin":         int(cube.nbin),
+        "length":       float(cube.length),
+        "bw":           float(abs(cube._chan_bw) * cube.nchan),
+        "sn":           snr_pdmp(profile, off_mask),
+        "zap_fraction": zapped.pop("zap_fraction"),
+    }
+    arrays = {
+        "freqs":   cube.freqs,
+        "offrms":  offrms,
+        "profile": profile,
+    }
+    # Per-channel and per-subint zap fractions and the run-length encoded zap mask
+    arrays.update(zapped)
+    logger.info(f"S/N: {stats['sn']:.2f}  nsub: {stats['nsub']}  length: {stats['length']:.1f} s  zap fraction: {stats['zap_fraction']:.3f}")
+    return stats, arrays
+
+
+def stats_files(prefix):
+    """
+    The JSON and NPZ sidecar paths for an output prefix (usually the archive path).
+    """
+    return f"{prefix}.stats.json", f"{prefix}.stats.npz"
+
+
+def write_obs_stats(prefix, stats, arrays):
+    """
+    Write the statistics sidecar.
+
+    Returns
+    -------
+    json_file : str
+        Path to the JSON sidecar, which records the name of the NPZ file of arrays.
+    """
+    json_file, npz_file = stats_files(prefix)
+    np.savez(npz_file, **arrays)
+    with open(json_file, "w") as f:
+        json.dump(dict(stats, arrays=os.path.basename(npz_file)), f, indent=1)
+    return json_file
+
+
+def load_obs_stats(json_file):
+    """
+    Read a statistics sidecar.
+
+    Parameters
+    ----------
+    json_file : str
+        Path to the JSON sidecar.
+
+    Returns
+    -------
+    stats : dict
+        The scalar statistics with the arrays from the NPZ file added.
+    """
+    with open(json_file, "r") as f:
+        stats = json.load(f)
+    npz_file = os.path.join(os.path.dirname(json_file), stats.pop("arrays"))
+    with np.load(npz_file) as data:
+        stats.update({key: data[key] for key in data.files})
+    return stats
@@ -0,0 +1,302 @@
+"""
+Run the per-observation stages of meerpipe as a DAG on a local process pool, skipping cached stages.
+
+A pipeline is a JSON file listing stages, each running an entry point (see `meerpipe.entry_points`) with
+command line arguments, the files it reads ("inputs") and the files it writes ("outputs")::
+
+    {
+        "variables": {"archive": "J1909-3744.ar", "template": "J1909-3744.std"},
+        "stages": [
+            {"name": "stats", "entry_point": "obs_stats", "args": ["{archive}"],
+             "inputs": ["{archive}"], "outputs": ["{archive}.stats.json", "{archive}.stats.npz"]},
+            {"name": "toas", "entry_point": "generate_toas", "args": ["{archive}", "-t", "{template}", "-o", "{archive}.tim"],
+             "inputs": ["{archive}", "{template}"], "outputs": ["{archive}.tim"]}
+        ]
+    }
+
+A stage may also give a "stdout" file that the entry point's standard output is written to (e.g. the
+"max_<nsub>" printed by calc_max_nsub), which is one of its outputs.
+
+A stage depends on the stages that produce its inputs (and any listed in "after"), and independent stages
+run concurrently. Each stage's cache key is the hash of its entry point, arguments, the contents of its
+inputs, the meerpipe version and the source of the entry point's script. When a previous run with the same
+key recorded outputs that are still unchanged, the stage is skipped, so changing e.g. the template only reruns
+the stages that read it and the stages downstream of them, and upgrading meerpipe reruns everything.
+
+meerpipe ships the stages run on each observation as the "observation" pipeline (meerpipe/data/observation_pipeline.json)::
+
+    meerpipe run observation -v archive=J1909-3744.ar obs=J1909-3744 nsub=32 psr_name=J1909-3744 ...
+
+which delay corrects, chops the edge channels of and flux calibrates the cleaned archive, then works out the
+maximum number of sensitive subints and generates the images and results.json. Its paths are relative to the
+current directory.
+"""
+
+import os
+import json
+import hashlib
+import contextlib
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from meerpipe import __version__
+from meerpipe.utils import setup_logging
+from meerpipe.data_load import OBSERVATION_PIPELINE
+from meerpipe.entry_points import ENTRY_POINTS, run_entry_point
+
+# The pipelines shipped with meerpipe, which can be given by name instead of a file
+PIPELINES = {
+    "observation": OBSERVATION_PIPELINE,
+}
+
+
+class FileHasher:
+    """
+    SHA-256 content hashes of files, remembered (on disk) by path, size and modification time so
+    unchanged files are only read once.
+    """
+    def __init__(self, memo_file=None):
+        self.memo_file = memo_file
+        self.memo = {}
+        if memo_file is not None and os.path.isfile(memo_file):
+            with open(memo_file, "r") as f:
+                self.memo = json.load(f)
+
+    def __call__(self, path):
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        if path in self.memo and self.memo[path][0] == signature:
+            return self.memo[path][1]
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        self.memo[path] = [signature, sha.hexdigest()]
+        return self.memo[path][1]
+
+    def save(self):
+        if self.memo_file is not None:
+            with open(self.memo_file + ".tmp", "w") as f:
+                json.dump(self.memo, f)
+            os.replace(self.memo_file + ".tmp", self.memo_file)
+
+
+class Stage:
+    """
+    One entry point call of a pipeline.
+    """
+    def __init__(self, name, entry_point, args=(), inputs=(), outputs=(), after=(), stdout=None, variables=None):
+        variables = variables or {}
+        self.name = name
+        self.entry_point = entry_point
+        self.args = [str(arg).format(**variables) for arg in args]
+        self.inputs = [str(path).format(**variables) for path in inputs]
+        self.outputs = [str(path).format(**variables) for path in outputs]
+        self.after = list(after)
+        self.stdout = None if stdout is None else str(stdout).format(**variables)
+        if self.stdout is not None and self.stdout not in self.outputs:
+            self.outputs.append(self.stdout)
+
+    def source_file(self):
+        """
+        The source file of the entry point's module (found without importing it).
+        """
+        module = ENTRY_POINTS.get(self.entry_point, self.entry_point).split(":")[0]
+        try:
+            spec = importlib.util.find_spec(module)
+        except (ImportError, ValueError):
+            return None
+        return None if spec is None else spec.origin
+
+    def key(self, hasher, workdir="."):
+        """
+        The cache key from the entry point, arguments, the contents of the inputs (relative to workdir) and
+        the code that runs them: the meerpipe version and the entry point's source file.
+        """
+        source_file = self.source_file()
+        description = {
+            "entry_point": self.entry_point,
+            "args":        self.args,
+            "stdout":      self.stdout,
+            "inputs":      {path: hasher(os.path.join(workdir, path)) for path in sorted(self.inputs)},
+            "version":     __version__,
+            "source":      None if source_file is None else hasher(source_file),
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def load_pipeline(pipeline_file, variables=None):
+    """
+    Read a pipeline JSON file.
+
+    Parameters
+    ----------
+    pipeline_file : str
+        Path to the pipeline, or the name of one shipped with meerpipe (see `PIPELINES`).
+    variables : dict
+        Values for the {placeholders} in the stages, overriding the file's "variables".
+
+    Returns
+    -------
+    stages : list of `Stage`
+        The stages.
+    workdir : str
+        The directory the stages run in (the file's "workdir", relative to the pipeline file's directory,
+        or to the current directory for the shipped pipelines).
+    """
+    if pipeline_file in PIPELINES:
+        pipeline_file = PIPELINES[pipeline_file]
+        basedir = os.getcwd()
+    else:
+        basedir = os.path.dirname(os.path.abspath(pipeline_file))
+    with open(pipeline_file, "r") as f:
+        pipeline = json.load(f)
+    merged = dict(pipeline.get("variables", {}))
+    merged.update(variables or {})
+    stages = []
+    for stage in pipeline["stages"]:
+        name, entry_point = stage["name"], stage["entry_point"]
+        try:
+            stages.append(Stage(
+                name,
+                entry_point,
+                args=stage.get("args", []),
+                inputs=stage.get("inputs", []),
+                outputs=stage.get("outputs", []),
+                after=stage.get("after", []),
+                stdout=stage.get("stdout"),
+                variables=merged,
+            ))
+        except KeyError as error:
+            raise ValueError(f"The pipeline variable {error} of stage {name} is not set") from None
+    workdir = os.path.join(basedir, pipeline.get("workdir", "."))
+    return stages, workdir
+
+
+def stage_dependencies(stages):
+    """
+    The names of the stages each stage depends on, from its "after" list and the producers of its inputs.
+    """
+    names = {stage.name for stage in stages}
+    if len(names) != len(stages):
+        raise ValueError("Stage names must be unique")
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            producers[os.path.normpath(output)] = stage.name
+    dependencies = {}
+    for stage in stages:
+        unknown = set(stage.after) - names
+        if unknown:
+            raise ValueError(f"Stage {stage.name} runs after unknown stages {sorted(unknown)}")
+        depends = set(stage.after)
+        depends.update(producers[os.path.normpath(path)] for path in stage.inputs if os.path.normpath(path) in producers)
+        depends.discard(stage.name)
+        dependencies[stage.name] = depends
+    return dependencies
+
+
+def _run_stage(entry_point, args, workdir, stdout=None):
+    os.chdir(workdir)
+    if stdout is None:
+        return run_entry_point(entry_point, args)
+    with open(stdout, "w") as f, contextlib.redirect_stdout(f):
+        return run_entry_point(entry_point, args)
+
+
+def run_pipeline(stages, workdir=".", cache_dir=None, nproc=None, force=False, logger=None):
+    """
+    Run the stages of a pipeline, concurrently where they don't depend on each other.
+
+    Parameters
+    ----------
+    stages : list of `Stage`
+        The stages to run.
+    workdir : str
+        The directory the stages run in and their paths are relative to.
+    cache_dir : str
+        Directory of the stage records (default: .meerpipe_cache in the workdir).
+    nproc : int
+        The number of stages run at once (default: the number of CPUs).
+    force : bool
+        Rerun every stage even if it is cached.
+
+    Returns
+    -------
+    status : dict
+        The outcome of each stage: "ran", "cached", "failed" or "skipped" (an upstream stage failed).
+    """
+    if logger is None:
+        logger = setup_logging(console=True)
+    workdir = os.path.abspath(workdir)
+    cache_dir = os.path.join(workdir, ".meerpipe_cache") if cache_dir is None else cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    hasher = FileHasher(os.path.join(cache_dir, "file_hashes.json"))
+    dependencies = stage_dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+
+    def path(name):
+        return os.path.join(workdir, name)
+
+    def record_file(key):
+        return os.path.join(cache_dir, f"{key}.json")
+
+    def cached(key):
+        if force or not os.path.isfile(record_file(key)):
+            return False
+        with open(record_file(key), "r") as f:
+            record = json.load(f)
+        return all(hasher(path(output)) == digest for output, digest in record["outputs"].items())
+
+    status = {}
+    keys = {}
+    running = {}
+    with ProcessPoolExecutor(max_workers=nproc) as executor:
+        while len(status) < len(stages):
+            for stage in stages:
+                if stage.name in status or stage.name in running.values():
+                    continue
+                upstream = [status.get(name) for name in dependencies[stage.name]]
+                if any(state in ("failed", "skipped") for state in upstream):
+                    status[stage.name] = "skipped"
+                    logger.error(f"Skipping {stage.name} because an upstream stage failed")
+                    continue
+                if any(state is None for state in upstream):
+                    continue
+                key = stage.key(hasher, workdir)
+                keys[stage.name] = key
+                if cached(key):
+                    status[stage.name] = "cached"
+                    logger.info(f"{stage.name} is up to date")
+                    continue
+                logger.info(f"Running {stage.name}: {stage.entry_point} {' '.join(stage.args)}")
+                running[executor.submit(_run_stage, stage.entry_point, stage.args, workdir, stage.stdout)] = stage.name
+
+            if len(status) == len(stages):
+                break
+            if not running:
+                raise ValueError(f"The stages {sorted(set(by_name) - set(status))} have circular dependencies")
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                stage = by_name[name]
+                try:
+                    returncode = future.result()
+                except Exception as error:
+                    logger.error(f"{name} raised {error!r}")
+                    returncode = 1
+                missing = [output for output in stage.outputs if not os.path.isfile(path(output))]
+                if returncode != 0 or missing:
+                    status[name] = "failed"
+                    logger.error(f"{name} failed (exit code {returncode}, missing outputs {missing})")
+                    continue
+                status[name] = "ran"
+                record = {"stage": name, "outputs": {output: hasher(path(output)) for output in stage.outputs}}
+                with open(record_file(keys[name]), "w") as f:
+                    json.dump(record, f, indent=1)
+    hasher.save()
+    return status
@@ -0,0 +1,137 @@
+"""
+Evaluate the tempo2 Chebyshev phase predictor (T2PREDICT table) stored in PSRFITS archives.
+
+The predicted phase is a 2-D Chebyshev series in time and frequency plus a dispersion term, evaluated in
+extended precision because the absolute phase is ~1e10 turns.
+"""
+
+import numpy as np
+from astropy.io import fits
+
+
+class ChebyModel:
+    """
+    One segment of a tempo2 Chebyshev predictor.
+
+    Parameters
+    ----------
+    mjd_range : tuple
+        The (start, end) MJD the segment is valid for.
+    freq_range : tuple
+        The (start, end) frequency in MHz the segment is valid for.
+    dispersion_constant : float
+        The coefficient of the 1/freq^2 phase term.
+    coeffs : `numpy.ndarray`
+        The (ncoeff_time, ncoeff_freq) Chebyshev coefficients.
+    """
+    def __init__(self, mjd_range, freq_range, dispersion_constant, coeffs):
+        self.mjd_range = tuple(np.longdouble(mjd) for mjd in mjd_range)
+        self.freq_range = tuple(np.longdouble(freq) for freq in freq_range)
+        self.dispersion_constant = np.longdouble(dispersion_constant)
+        # tempo2 uses the convention that the first coefficient of each series is halved
+        self.coeffs = np.array(coeffs, dtype=np.longdouble)
+        self.coeffs[0, :] /= 2
+        self.coeffs[:, 0] /= 2
+
+    def contains(self, mjd):
+        return self.mjd_range[0] <= mjd <= self.mjd_range[1]
+
+    @staticmethod
+    def _chebyshev(n, x):
+        terms = [np.ones_like(x), x]
+        for _ in range(2, n):
+            terms.append(2 * x * terms[-1] - terms[-2])
+        return np.stack(terms[:n])
+
+    def phase(self, mjd, freq):
+        """
+        The predicted absolute pulse phase in turns at MJD (a `numpy.longdouble`) and frequency in MHz.
+        """
+        mjd = np.asarray(mjd, dtype=np.longdouble)
+        freq = np.asarray(freq, dtype=np.longdouble)
+        x = -1 + 2 * (mjd - self.mjd_range[0]) / (self.mjd_range[1] - self.mjd_range[0])
+        y = -1 + 2 * (freq - self.freq_range[0]) / (self.freq_range[1] - self.freq_range[0])
+        x, y = np.broadcast_arrays(x, y)
+        time_terms = self._chebyshev(self.coeffs.shape[0], x)
+        freq_terms = self._chebyshev(self.coeffs.shape[1], y)
+        series = np.einsum("i...,ij,j...->...", time_terms, self.coeffs, freq_terms)
+        return series + self.dispersion_constant / (freq * freq)
+
+
+class ChebyPredictor:
+    """
+    A set of `ChebyModel` segments covering an observation.
+    """
+    def __init__(self, models):
+        self.models = models
+
+    @classmethod
+    def parse(cls, lines):
+        """
+        Parse the text of a tempo2 ``ChebyModelSet``.
+        """
+        models = []
+        model = None
+        for line in lines:
+            fields = line.split()
+            if len(fields) == 0:
+                continue
+            if fields[0] == "ChebyModel" and fields[1] == "BEGIN":
+                model = {"coeffs": []}
+            elif fields[0] == "ChebyModel" and fields[1] == "END":
+                coeffs = np.array(model["coeffs"], dtype=np.longdouble).reshape(model["ncoeff_time"], model["ncoeff_freq"])
+                models.append(ChebyModel(model["mjd_range"], model["freq_range"], model["dispersion_constant"], coeffs))
+                model = None
+            elif model is None:
+                continue
+            elif fields[0] == "TIME_RANGE":
+                model["mjd_range"] = (fields[1], fields[2])
+            elif fields[0] == "FREQ_RANGE":
+                model["freq_range"] = (fields[1], fields[2])
+            elif fields[0] == "DISPERSION_CONSTANT":
+                model["dispersion_constant"] = fields[1]
+            elif fields[0] == "NCOEFF_TIME":
+                model["ncoeff_time"] = int(fields[1])
+            elif fields[0] == "NCOEFF_FREQ":
+                model["ncoeff_freq"] = int(fields[1])
+            elif fields[0] == "COEFFS":
+                model["coeffs"].extend(np.longdouble(value) for value in fields[1:])
+            elif "ncoeff_freq" in model and len(model["coeffs"]):
+                # Long rows of coefficients continue on the following lines
+                model["coeffs"].extend(np.longdouble(value) for value in fields)
+        return cls(models)
+
+    @classmethod
+    def from_archive(cls, archive):
+        """
+        Load the predictor of a PSRFITS archive, returning None if it has no T2PREDICT table.
+        """
+        with fits.open(archive, memmap=True) as hdul:
+            if "T2PREDICT" not in hdul:
+                return None
+            lines = [str(row[0]) for row in hdul["T2PREDICT"].data]
+        predictor = cls.parse(lines)
+        return predictor if predictor.models else None
+
+    def _model(self, mjd):
+        for model in self.models:
+            if model.contains(mjd):
+                return model
+        # Extrapolate with the closest segment
+        return min(self.models, key=lambda model: abs(mjd - (model.mjd_range[0] + model.mjd_range[1]) / 2))
+
+    def phase(self, imjd, frac, freq):
+        """
+        The predicted phase in turns at the MJD imjd + frac.
+        """
+        mjd = np.longdouble(imjd) + np.longdouble(frac)
+        return self._model(mjd).phase(mjd, freq)
+
+    def frequency(self, imjd, frac, freq, step=1e-3):
+        """
+        The predicted spin frequency in Hz at the MJD imjd + frac, from the phase derivative over +-step seconds.
+        """
+        mjd = np.longdouble(imjd) + np.longdouble(frac)
+        model = self._model(mjd)
+        delta = np.longdouble(step) / 86400
+        return float((model.phase(mjd + delta, freq) - model.phase(mjd - delta, freq)) / (2 * step))
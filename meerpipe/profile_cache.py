@@ -0,0 +1,170 @@
+"""
+On-disk cache of the Stokes profiles extracted from archives so only new or changed archives need to be reloaded.
+
+Each pulsar has a single npz file containing the archive paths, their size and modification time
+(used to detect changes), the UTC, S/N and the (n_obs, 4, nbin) Stokes profiles.
+
+The cached profiles are unaligned, as extracted from each archive. Alignment (to a template or the
+iterative mean, see `meerpipe.profile_utils.align_profiles`) happens after loading, because the alignment
+of every epoch depends on the template and on the other epochs selected for the movie. So changing the
+template, adding an archive or changing the S/N cut never invalidates the cache.
+"""
+
+import os
+import numpy as np
+
+
+def profile_cache_file(cache_dir, pulsar):
+    """
+    The path of the profile cache of a pulsar.
+    """
+    return os.path.join(cache_dir, f"{pulsar}_stokes_profiles.npz")
+
+
+def empty_profile_cache(nbin=0):
+    return {
+        "paths":    np.empty(0, dtype=str),
+        "sizes":    np.empty(0, dtype=np.int64),
+        "mtimes":   np.empty(0, dtype=np.float64),
+        "utcs":     np.empty(0, dtype=str),
+        "sn":       np.empty(0, dtype=np.float64),
+        "profiles": np.empty((0, 4, nbin), dtype=np.float32),
+    }
+
+
+def load_profile_cache(cache_file):
+    """
+    Load a profile cache, returning an empty cache if the file does not exist.
+
+    Parameters
+    ----------
+    cache_file : str
+        Path to the npz cache file.
+
+    Returns
+    -------
+    cache : dict
+        Dictionary of the cached arrays (paths, sizes, mtimes, utcs, sn and profiles).
+    """
+    if not os.path.isfile(cache_file):
+        return empty_profile_cache()
+    with np.load(cache_file) as data:
+        return {key: data[key] for key in data.files}
+
+
+def save_profile_cache(cache_file, cache):
+    """
+    Write the profile cache, replacing the old file atomically so an interrupted run cannot corrupt it.
+    """
+    cache_dir = os.path.dirname(cache_file)
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    temp_file = f"{cache_file}.tmp.npz"
+    np.savez(temp_file, **cache)
+    os.replace(temp_file, cache_file)
+
+
+def archive_key(archive):
+    """
+    The (absolute path, size, mtime) key used to decide if an archive has changed.
+    """
+    stat = os.stat(archive)
+    return os.path.abspath(archive), stat.st_size, stat.st_mtime
+
+
+def stale_archives(cache, archives):
+    """
+    Find the archives that are not in the cache or have changed since they were cached.
+
+    Parameters
+    ----------
+    cache : dict
+        The profile cache.
+    archives : list of str
+        Paths to the archive files.
+
+    Returns
+    -------
+    stale : list of str
+        The archives that need to be (re)loaded.
+    """
+    cached = {
+        path: (size, mtime)
+        for path, size, mtime in zip(cache["paths"], cache["sizes"], cache["mtimes"])
+    }
+    stale = []
+    for archive in archives:
+        path, size, mtime = archive_key(archive)
+        if cached.get(path) != (size, mtime):
+            stale.append(archive)
+    return stale
+
+
+def update_profile_cache(cache, archives, profiles, sn, utcs):
+    """
+    Add newly extracted profiles to the cache, replacing any older entries of the same archives.
+
+    If the profiles have a different number of bins to the cached ones, the old entries are dropped, so the
+    caller should reload the archives that `stale_archives` then reports.
+
+    Parameters
+    ----------
+    cache : dict
+        The profile cache.
+    archives : list of str
+        Paths to the newly loaded archive files.
+    profiles : `numpy.ndarray`
+        The (n_obs, 4, nbin) Stokes profiles of the archives.
+    sn : array_like
+        The signal-to-noise ratio of each archive.
+    utcs : list of str
+        The UTC of each archive.
+
+    Returns
+    -------
+    cache : dict
+        The updated profile cache.
+    """
+    if len(archives) == 0:
+        return cache
+    keys = [archive_key(archive) for archive in archives]
+    paths = np.array([key[0] for key in keys])
+
+    # A change of nbin (e.g. a new template resolution) invalidates the old profiles
+    if len(cache["paths"]) and cache["profiles"].shape[2] != profiles.shape[2]:
+        cache = empty_profile_cache(profiles.shape[2])
+
+    keep = ~np.isin(cache["paths"], paths)
+    return {
+        "paths":    np.concatenate([cache["paths"][keep],  paths]),
+        "sizes":    np.concatenate([cache["sizes"][keep],  np.array([key[1] for key in keys], dtype=np.int64)]),
+        "mtimes":   np.concatenate([cache["mtimes"][keep], np.array([key[2] for key in keys], dtype=np.float64)]),
+        "utcs":     np.concatenate([cache["utcs"][keep],   np.array(utcs, dtype=str)]),
+        "sn":       np.concatenate([cache["sn"][keep],     np.asarray(sn, dtype=np.float64)]),
+        "profiles": np.concatenate([cache["profiles"][keep].reshape(-1, 4, profiles.shape[2]), profiles.astype(np.float32)]),
+    }
+
+
+def select_cached_profiles(cache, archives):
+    """
+    Get the cached profiles, S/N and UTCs of archives in the order they were given.
+
+    Parameters
+    ----------
+    cache : dict
+        The profile cache, which must contain all of the archives.
+    archives : list of str
+        Paths to the archive files.
+
+    Returns
+    -------
+    profiles : `numpy.ndarray`
+        The (n_obs, 4, nbin) Stokes profiles.
+    sn : `numpy.ndarray`
+        The signal-to-noise ratio of each archive.
+    utcs : list of str
+        The UTC of each archive.
+    """
+    index = {path: i for i, path in enumerate(cache["paths"])}
+    order = np.array([index[os.path.abspath(archive)] for archive in archives], dtype=int)
+    return cache["profiles"][order], cache["sn"][order], list(cache["utcs"][order])
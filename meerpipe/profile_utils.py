@@ -0,0 +1,186 @@
+"""
+Vectorised Fourier domain utilities for pulse profiles.
+
+All functions operate on the last axis of the input arrays (the phase bins) so they can be applied to
+a single profile, an (n_obs, nbin) array or an (n_obs, npol, nbin) array at once.
+"""
+
+import numpy as np
+
+# The dispersion constant used by psrchive in MHz^2 pc^-1 cm^3 s
+DISPERSION_CONSTANT = 1. / 2.41e-4
+
+
+def fft_shift_profiles(profiles, shifts):
+    """
+    Rotate profiles by a (sub-bin) number of phase bins by applying a phase ramp to their Fourier transforms.
+
+    Parameters
+    ----------
+    profiles : `numpy.ndarray`
+        Array of profiles with the phase bins along the last axis, e.g. (n_obs, nbin) or (n_obs, 4, nbin).
+    shifts : array_like
+        The shift of each profile in bins (positive shifts move the pulse to later phase).
+        Must broadcast against the leading axes of profiles, e.g. (n_obs,).
+
+    Returns
+    -------
+    shifted : `numpy.ndarray`
+        The rotated profiles with the same shape and dtype as the input.
+    """
+    nbin = profiles.shape[-1]
+    shifts = np.asarray(shifts, dtype=float)
+    # Add trailing axes so each shift applies to every polarisation of its profile
+    shifts = shifts.reshape(shifts.shape + (1,) * (profiles.ndim - shifts.ndim))
+    harmonics = np.arange(nbin // 2 + 1)
+    ramp = np.exp(-2j * np.pi * harmonics * shifts / nbin)
+    shifted = np.fft.irfft(np.fft.rfft(profiles, axis=-1) * ramp, n=nbin, axis=-1)
+    return shifted.astype(profiles.dtype, copy=False)
+
+
+def dispersion_shifts(freqs, dm, period, nbin, ref_freq):
+    """
+    The shifts in bins (for `fft_shift_profiles`) that remove the dispersion delays of channels relative to a reference frequency.
+
+    Parameters
+    ----------
+    freqs : array_like
+        The channel frequencies in MHz.
+    dm : float
+        The dispersion measure in pc cm^-3.
+    period : float or array_like
+        The folding period in seconds (e.g. an (nsub, 1) array of the period of each subint).
+    nbin : int
+        The number of phase bins.
+    ref_freq : float or array_like
+        The frequency in MHz to align the channels to.
+
+    Returns
+    -------
+    shifts : `numpy.ndarray`
+        The shift in bins of each channel, broadcast against period.
+    """
+    delay = DISPERSION_CONSTANT * dm * (np.asarray(freqs, dtype=float) ** -2 - np.asarray(ref_freq, dtype=float) ** -2)
+    return -delay / np.asarray(period, dtype=float) * nbin
+
+
+def resample_profile(profile, nbin):
+    """
+    Change the number of phase bins of a profile by truncating or zero padding its harmonics.
+    """
+    old_nbin = profile.shape[-1]
+    if old_nbin == nbin:
+        return profile
+    spectrum = np.fft.rfft(profile, axis=-1)
+    nharm = min(old_nbin, nbin) // 2 + 1
+    new_spectrum = np.zeros(profile.shape[:-1] + (nbin // 2 + 1,), dtype=complex)
+    new_spectrum[..., :nharm] = spectrum[..., :nharm]
+    return np.fft.irfft(new_spectrum, n=nbin, axis=-1) * nbin / old_nbin
+
+
+def cross_correlation_shifts(profiles, template, niter=5):
+    """
+    Measure the sub-bin shift of each profile relative to a template by FFT cross-correlation.
+
+    The integer bin shift is found from the peak of the circular cross-correlation which is then
+    refined with Newton iterations on the Fourier phase gradient (as in Taylor 1992).
+
+    Parameters
+    ----------
+    profiles : `numpy.ndarray`
+        The (n_obs, nbin) profiles.
+    template : `numpy.ndarray`
+        The (nbin,) template profile, or an (n_obs, nbin) array of templates.
+    niter : int
+        The number of Newton iterations used to refine the shifts (default: 5).
+
+    Returns
+    -------
+    shifts : `numpy.ndarray`
+        The shift in bins of each profile relative to the template, in the range [-nbin/2, nbin/2).
+    """
+    nbin = profiles.shape[-1]
+    cross_spectrum = np.fft.rfft(profiles, axis=-1) * np.conj(np.fft.rfft(template, axis=-1))
+    return phase_gradient_shifts(cross_spectrum, nbin, niter=niter)
+
+
+def phase_gradient_shifts(cross_spectrum, nbin, niter=5):
+    """
+    Find the shifts that maximise the cross-correlation of profiles given their cross spectra with a template.
+
+    Parameters
+    ----------
+    cross_spectrum : `numpy.ndarray`
+        The (..., nbin // 2 + 1) products of the profile spectra and the conjugate template spectrum.
+    nbin : int
+        The number of phase bins of the profiles.
+    niter : int
+        The number of Newton iterations used to refine the shifts (default: 5).
+
+    Returns
+    -------
+    shifts : `numpy.ndarray`
+        The shift in bins of each profile relative to the template, in the range [-nbin/2, nbin/2).
+    """
+    cross_spectrum = cross_spectrum.copy()
+    # The DC term only depends on the baselines
+    cross_spectrum[..., 0] = 0.
+
+    ccf = np.fft.irfft(cross_spectrum, n=nbin, axis=-1)
+    shifts = np.argmax(ccf, axis=-1).astype(float)
+
+    # Maximise Re(sum_k C_k exp(2 pi i k tau / nbin)) with Newton's method
+    phase_per_bin = 2 * np.pi * np.arange(nbin // 2 + 1) / nbin
+    for _ in range(niter):
+        rotated = cross_spectrum * np.exp(1j * phase_per_bin * shifts[..., np.newaxis])
+        first  = -np.sum(phase_per_bin      * rotated.imag, axis=-1)
+        second = -np.sum(phase_per_bin ** 2 * rotated.real, axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = np.where(second < 0., -first / second, 0.)
+        # Newton steps larger than a bin mean the coarse peak was wrong, so don't trust them
+        shifts = shifts + np.clip(step, -0.5, 0.5)
+
+    return (shifts + nbin / 2) % nbin - nbin / 2
+
+
+def align_profiles(profiles, template=None, niter=3):
+    """
+    Align the Stokes profiles of many observations with sub-bin precision.
+
+    Each observation is cross-correlated (using total intensity) against either the template or the
+    mean of the aligned profiles, which is iteratively refined. The profiles are then rotated with
+    Fourier phase ramps so the peak of the reference is at a phase of 0.5.
+
+    Parameters
+    ----------
+    profiles : `numpy.ndarray`
+        The (n_obs, 4, nbin) Stokes profiles.
+    template : `numpy.ndarray`
+        The total intensity template profile. If None, the iterative mean of the profiles is used.
+    niter : int
+        The number of iterations used to refine the mean reference profile (default: 3).
+
+    Returns
+    -------
+    aligned : `numpy.ndarray`
+        The aligned (n_obs, 4, nbin) Stokes profiles.
+    shifts : `numpy.ndarray`
+        The shift in bins that was applied to each observation.
+    """
+    n_obs, _, nbin = profiles.shape
+    if n_obs == 0:
+        return profiles, np.empty(0)
+
+    if template is not None:
+        reference = resample_profile(np.asarray(template, dtype=float), nbin)
+        shifts = -cross_correlation_shifts(profiles[:, 0], reference)
+    else:
+        # Start from the peak of each profile then refine against the mean
+        shifts = nbin // 2 - np.argmax(profiles[:, 0], axis=-1).astype(float)
+        for _ in range(niter):
+            reference = np.mean(fft_shift_profiles(profiles[:, 0], shifts), axis=0)
+            shifts = shifts - cross_correlation_shifts(fft_shift_profiles(profiles[:, 0], shifts), reference)
+
+    # Put the peak of the reference at a phase of 0.5
+    shifts = shifts + nbin // 2 - np.argmax(reference)
+    return fft_shift_profiles(profiles, shifts), shifts
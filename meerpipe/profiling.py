@@ -0,0 +1,111 @@
+"""
+Opt-in profiling of the meerpipe console scripts.
+
+When $MEERPIPE_PROFILE is set to a directory (or ``meerpipe run/call --profile <dir>`` is used), every
+console script runs its main function under cProfile and writes, per process:
+
+- ``<entry_point>.<pid>.prof``, the cProfile statistics (for pstats, snakeviz, etc.), and
+- ``<entry_point>.<pid>.collapsed``, the call stacks in the collapsed format ("a;b;c <microseconds>")
+  read by flamegraph.pl, speedscope and inferno.
+
+cProfile only records caller/callee pairs, which can't be turned back into call stacks cheaply, so the
+collapsed stacks come from a thread sampling the stack of the profiled thread at a fixed interval.
+When the variable isn't set this module isn't imported and main is called directly.
+"""
+
+import os
+import sys
+import time
+import cProfile
+import threading
+
+
+class StackSampler:
+    """
+    Sample the call stack of a thread at a fixed interval from a background thread.
+
+    Parameters
+    ----------
+    interval : float
+        The time between samples in seconds.
+    thread_id : int
+        The thread to sample (default: the thread creating the sampler).
+    """
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.times = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self, elapsed):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        if stack:
+            key = ";".join(reversed(stack))
+            self.times[key] = self.times.get(key, 0.) + elapsed
+
+    def _run(self):
+        # Each sample is weighted by the time since the last one, as a thread holding the GIL can
+        # delay the sampler by more than the interval
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self._sample(now - last)
+            last = now
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="meerpipe-stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def collapsed_stacks(self):
+        """
+        The sampled time in microseconds of each stack, keyed by the ";" separated function labels (outermost first).
+        """
+        return {stack: seconds * 1e6 for stack, seconds in self.times.items()}
+
+
+def write_profile(profiler, sampler, directory, name):
+    """
+    Write the cProfile statistics of a profiler and the collapsed stacks of a `StackSampler` to the directory.
+
+    Returns
+    -------
+    prof_file, collapsed_file : str
+        The paths written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.join(directory, f"{name}.{os.getpid()}")
+    profiler.dump_stats(f"{stem}.prof")
+    stacks = sampler.collapsed_stacks()
+    with open(f"{stem}.collapsed", "w") as f:
+        for stack, time in sorted(stacks.items()):
+            f.write(f"{stack} {int(round(time))}\n")
+    return f"{stem}.prof", f"{stem}.collapsed"
+
+
+def profile_call(function, name, directory, *args, **kwargs):
+    """
+    Call a function under cProfile and the stack sampler and write its profile to the directory, even if it raises.
+    """
+    profiler = cProfile.Profile()
+    sampler = StackSampler()
+    sampler.start()
+    profiler.enable()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        profiler.disable()
+        sampler.stop()
+        write_profile(profiler, sampler, directory, name)
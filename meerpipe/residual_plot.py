@@ -0,0 +1,250 @@
+"""
+Level-of-detail global residual plots whose cost doesn't grow with the number of ToAs.
+
+All but the newest observation are reduced to per-pixel-column statistics (count, min/max envelope, mean
+and error-weighted mean) in MJD bins. The statistics are sums, minima and maxima, so they are updated with
+each new observation and adjacent bins can be merged when the time span grows, without revisiting old
+ToAs. They are cached next to the pulsar's residual store. Only the newest observation is drawn at full
+detail, over the binned background.
+"""
+
+import os
+import json
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from meerpipe.utils import setup_logging
+from meerpipe.residuals import ResidualStore
+
+# The statistics kept for each bin and how to merge two bins
+SUM_STATS = ("count", "sum_y", "sum_w", "sum_wy")
+MIN_STATS = ("min",)
+MAX_STATS = ("max",)
+
+
+class BinnedResiduals:
+    """
+    Mergeable statistics of residuals in MJD bins of equal width.
+
+    Parameters
+    ----------
+    start : float
+        The MJD of the start of the first bin.
+    width : float
+        The width of the bins in days.
+    npix : int
+        The number of pixel columns the plot is drawn with. The bins are merged in pairs to keep fewer than
+        2 * npix of them.
+    sources : list of str
+        The observations already included.
+    shards : list of str
+        The residual store shard files already included, or None if they aren't known.
+    """
+    def __init__(self, start, width, npix=1000, sources=None, shards=()):
+        self.start = float(start)
+        self.width = float(width)
+        self.npix = int(npix)
+        self.sources = list(sources or [])
+        self.shards = None if shards is None else list(shards)
+        self.stats = {name: np.zeros(0) for name in SUM_STATS}
+        self.stats["min"] = np.zeros(0)
+        self.stats["max"] = np.zeros(0)
+
+    @property
+    def nbin(self):
+        return len(self.stats["count"])
+
+    @property
+    def edges(self):
+        return self.start + self.width * np.arange(self.nbin + 1)
+
+    def _grow(self, first, last):
+        """
+        Add empty bins so bins first to last (which may be negative) exist.
+        """
+        before = max(0, -first)
+        after = max(0, last + 1 - self.nbin)
+        if before or after:
+            for name in SUM_STATS:
+                self.stats[name] = np.pad(self.stats[name], (before, after))
+            self.stats["min"] = np.pad(self.stats["min"], (before, after), constant_values=np.inf)
+            self.stats["max"] = np.pad(self.stats["max"], (before, after), constant_values=-np.inf)
+            self.start -= before * self.width
+        return before
+
+    def _coarsen(self):
+        """
+        Merge adjacent pairs of bins until there are fewer than 2 * npix.
+        """
+        while self.nbin >= 2 * self.npix:
+            if self.nbin % 2:
+                self._grow(0, self.nbin)
+            for name in SUM_STATS:
+                self.stats[name] = self.stats[name].reshape(-1, 2).sum(axis=1)
+            self.stats["min"] = self.stats["min"].reshape(-1, 2).min(axis=1)
+            self.stats["max"] = self.stats["max"].reshape(-1, 2).max(axis=1)
+            self.width *= 2
+
+    def update(self, mjd, residual, err, source=None):
+        """
+        Add residuals (in any units, with uncertainties in the same units) to the statistics.
+        """
+        mjd = np.asarray(mjd, dtype=np.float64)
+        residual = np.asarray(residual, dtype=np.float64)
+        weight = 1. / np.asarray(err, dtype=np.float64) ** 2
+        if source is not None:
+            self.sources.append(source)
+        if len(mjd) == 0:
+            return
+        index = np.floor((mjd - self.start) / self.width).astype(np.int64)
+        index += self._grow(int(index.min()), int(index.max()))
+        nbin = self.nbin
+        self.stats["count"] += np.bincount(index, minlength=nbin)
+        self.stats["sum_y"] += np.bincount(index, residual, minlength=nbin)
+        self.stats["sum_w"] += np.bincount(index, weight, minlength=nbin)
+        self.stats["sum_wy"] += np.bincount(index, weight * residual, minlength=nbin)
+        np.minimum.at(self.stats["min"], index, residual)
+        np.maximum.at(self.stats["max"], index, residual)
+        self._coarsen()
+
+    def summary(self):
+        """
+        The statistics of the non-empty bins.
+
+        Returns
+        -------
+        summary : dict
+            The bin centre MJD ("mjd"), count, min, max, mean, error-weighted mean ("wmean") and its uncertainty ("wmean_err").
+        """
+        good = self.stats["count"] > 0
+        centres = self.start + self.width * (np.arange(self.nbin) + 0.5)
+        return {
+            "mjd":       centres[good],
+            "count":     self.stats["count"][good],
+            "min":       self.stats["min"][good],
+            "max":       self.stats["max"][good],
+            "mean":      self.stats["sum_y"][good] / self.stats["count"][good],
+            "wmean":     self.stats["sum_wy"][good] / self.stats["sum_w"][good],
+            "wmean_err": 1. / np.sqrt(self.stats["sum_w"][good]),
+        }
+
+    def save(self, cache_file):
+        np.savez(
+            cache_file,
+            meta=json.dumps({"start": self.start, "width": self.width, "npix": self.npix, "sources": self.sources, "shards": self.shards}),
+            **self.stats,
+        )
+
+    @classmethod
+    def load(cls, cache_file):
+        with np.load(cache_file) as data:
+            meta = json.loads(str(data["meta"]))
+            binned = cls(meta["start"], meta["width"], npix=meta["npix"], sources=meta["sources"], shards=meta.get("shards"))
+            binned.stats = {name: data[name] for name in binned.stats}
+        return binned
+
+
+def plot_residuals(binned, latest=None, ax=None, units="$\\mu$s"):
+    """
+    Draw the binned residuals of all previous observations and the newest observation at full detail.
+
+    Parameters
+    ----------
+    binned : `BinnedResiduals`
+        The statistics of the previous observations.
+    latest : dict
+        The "mjd", "residual" and "err" of each ToA of the newest observation (optional).
+    ax : `matplotlib.axes.Axes`
+        The axes to draw on (default: a new figure).
+
+    Returns
+    -------
+    ax : `matplotlib.axes.Axes`
+        The axes drawn on.
+    """
+    if ax is None:
+        _, ax = plt.subplots(figsize=(12, 5))
+    summary = binned.summary()
+    if len(summary["mjd"]):
+        # The envelope, mean and error weighted means are each one artist no matter how many ToAs there are
+        ax.vlines(summary["mjd"], summary["min"], summary["max"], color="0.75", linewidth=1, label="Range")
+        ax.plot(summary["mjd"], summary["mean"], ".", color="0.5", markersize=2, label="Mean")
+        ax.errorbar(summary["mjd"], summary["wmean"], yerr=summary["wmean_err"], fmt="o", color="tab:blue", markersize=2, elinewidth=0.5, label="Weighted mean")
+    if latest is not None and len(latest["mjd"]):
+        ax.errorbar(latest["mjd"], latest["residual"], yerr=latest["err"], fmt="o", color="tab:red", markersize=2, elinewidth=0.5, label="Latest observation")
+    ax.axhline(0., color="black", linewidth=0.5)
+    ax.set_xlabel("MJD")
+    ax.set_ylabel(f"Residual ({units})")
+    ax.legend(loc="upper left", fontsize="small")
+    return ax
+
+
+def _store_residuals(store, sources):
+    # general2 {post} is in seconds and {err} in microseconds
+    residuals = store.read(columns=["bat", "post", "err"], sources=sources)
+    return residuals["bat"], residuals["post"] * 1e6, residuals["err"]
+
+
+def update_global_residual_plot(store_dir, output_image, latest_source=None, npix=1000, cache_file=None, logger=None):
+    """
+    Plot every residual in a pulsar's `ResidualStore`, updating the cached binned statistics with the observations
+    they don't include yet.
+
+    Parameters
+    ----------
+    store_dir : str
+        The pulsar's residual store directory.
+    output_image : str
+        Path of the output image.
+    latest_source : str
+        The source of the observation to draw at full detail (default: the most recently appended).
+    npix : int
+        The number of pixel columns to bin the other observations into (default: 1000).
+    cache_file : str
+        The binned statistics cache (default: binned_residuals.npz in the store directory).
+    """
+    if logger is None:
+        logger = setup_logging(console=True)
+    store = ResidualStore(store_dir)
+    if cache_file is None:
+        cache_file = os.path.join(store_dir, "binned_residuals.npz")
+    sources = store.sources
+    if latest_source is None and sources:
+        latest_source = sources[-1]
+    # The cache is keyed on the shard files, so an observation whose residuals were replaced is picked up
+    background = [(source, shard) for source, shard in zip(sources, store.shard_files) if source != latest_source]
+    background_shards = {shard for _, shard in background}
+
+    binned = BinnedResiduals.load(cache_file) if os.path.isfile(cache_file) else None
+    if binned is not None and (binned.shards is None or not set(binned.shards) <= background_shards or binned.npix != npix):
+        # A cached observation was replaced or is now the latest, so the statistics have to be rebuilt
+        logger.info("Rebuilding the binned residual cache")
+        binned = None
+    new = [(source, shard) for source, shard in background if binned is None or shard not in binned.shards]
+    if new:
+        new_sources = [source for source, _ in new]
+        mjd, residual, err = _store_residuals(store, new_sources)
+        if binned is None:
+            span = np.ptp(mjd) if len(mjd) else 1.
+            binned = BinnedResiduals(mjd.min() if len(mjd) else 0., max(span, 1.) / npix, npix=npix)
+        binned.update(mjd, residual, err)
+        binned.sources.extend(new_sources)
+        binned.shards.extend(shard for _, shard in new)
+        binned.save(cache_file)
+        logger.info(f"Added {len(new_sources)} observations ({len(mjd)} ToAs) to the binned residual cache")
+    elif binned is None:
+        binned = BinnedResiduals(0., 1., npix=npix)
+
+    latest = None
+    if latest_source is not None:
+        mjd, residual, err = _store_residuals(store, [latest_source])
+        latest = {"mjd": mjd, "residual": residual, "err": err}
+
+    ax = plot_residuals(binned, latest)
+    ax.set_title(os.path.basename(os.path.normpath(store_dir)))
+    ax.figure.tight_layout()
+    ax.figure.savefig(output_image)
+    plt.close(ax.figure)
+    return binned
@@ -0,0 +1,242 @@
+"""
+Parse tempo2 general2 residual files into typed columns and keep them in a per-pulsar columnar store.
+
+``tempo2_wrapper.sh`` writes residuals formatted as ``{bat} {post} {err} {freq} {post_phase} {flags}``. Each
+observation's residuals are parsed once and appended to the pulsar's store as an NPZ shard, one array per
+column. A JSON manifest records the columns and MJD range of every shard, so global residual plots only
+load the shards and columns they need.
+"""
+
+import os
+import json
+import numpy as np
+
+# The columns of the general2 format used by tempo2_wrapper.sh
+GENERAL2_COLUMNS = ("bat", "post", "err", "freq", "post_phase")
+
+
+def _flag_column(values):
+    """
+    Convert the string values of a flag to float64 if they are all numeric (NaN where missing), otherwise a unicode array.
+    """
+    try:
+        return np.array([float(value) if value != "" else np.nan for value in values], dtype=np.float64)
+    except ValueError:
+        return np.array(values, dtype=str)
+
+
+def parse_general2(lines, columns=GENERAL2_COLUMNS):
+    """
+    Parse general2 output lines into columns.
+
+    Lines which don't start with the numeric columns (e.g. tempo2's banner) are skipped. The trailing
+    ``-flag value`` pairs can differ between ToAs and become one column per flag (named without the dash).
+
+    Parameters
+    ----------
+    lines : iterable of str
+        The lines of general2 output.
+    columns : tuple of str
+        The names of the leading numeric columns (default: the tempo2_wrapper.sh format).
+
+    Returns
+    -------
+    residuals : dict
+        A float64 array for each numeric column and a float64 or unicode array for each flag.
+    """
+    ncol = len(columns)
+    values = []
+    flags = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) < ncol:
+            continue
+        try:
+            values.append([float(field) for field in fields[:ncol]])
+        except ValueError:
+            continue
+        flags.append(dict(zip(fields[ncol::2], fields[ncol + 1::2])))
+
+    values = np.array(values, dtype=np.float64).reshape(-1, ncol)
+    residuals = {name: values[:, i].copy() for i, name in enumerate(columns)}
+    flag_names = sorted(set().union(*flags)) if flags else []
+    for flag in flag_names:
+        residuals[flag.lstrip("-")] = _flag_column([row.get(flag, "") for row in flags])
+    return residuals
+
+
+def read_general2(residual_file, columns=GENERAL2_COLUMNS):
+    """
+    Parse a general2 residual file (see `parse_general2`).
+    """
+    with open(residual_file, "r") as f:
+        return parse_general2(f, columns=columns)
+
+
+def _empty_like(array, n):
+    if array.dtype.kind == "U":
+        return np.full(n, "", dtype=array.dtype)
+    return np.full(n, np.nan, dtype=np.float64)
+
+
+class ResidualStore:
+    """
+    A directory of NPZ residual shards for one pulsar, indexed by ``manifest.json``.
+
+    Parameters
+    ----------
+    directory : str
+        The pulsar's store directory, which is created if it doesn't exist.
+    """
+    MANIFEST = "manifest.json"
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        manifest_file = os.path.join(directory, self.MANIFEST)
+        if os.path.isfile(manifest_file):
+            with open(manifest_file, "r") as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"shards": [], "next_shard": 0}
+
+    def _write_manifest(self):
+        # Write then rename so readers never see a partial manifest
+        manifest_file = os.path.join(self.directory, self.MANIFEST)
+        with open(manifest_file + ".tmp", "w") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(manifest_file + ".tmp", manifest_file)
+
+    def __len__(self):
+        return sum(shard["nrow"] for shard in self.manifest["shards"])
+
+    @property
+    def columns(self):
+        """
+        The names of every column in the store.
+        """
+        names = []
+        for shard in self.manifest["shards"]:
+            names.extend(name for name in shard["columns"] if name not in names)
+        return names
+
+    def append(self, residuals, source=None):
+        """
+        Add residuals as a new shard.
+
+        Parameters
+        ----------
+        residuals : dict
+            The columns of the residuals (see `parse_general2`).
+        source : str
+            An identifier of where the residuals came from (e.g. the observation). Appending the same source
+            again replaces its previous shard.
+        """
+        if source is not None:
+            self.remove(source, write_manifest=False)
+        nrow = len(residuals["bat"]) if "bat" in residuals else len(next(iter(residuals.values()), []))
+        shard_file = f"shard_{self.manifest['next_shard']:06d}.npz"
+        np.savez(os.path.join(self.directory, shard_file), **residuals)
+        self.manifest["next_shard"] += 1
+        self.manifest["shards"].append({
+            "file":    shard_file,
+            "source":  source,
+            "nrow":    int(nrow),
+            "columns": list(residuals),
+            "mjd_min": float(np.min(residuals["bat"])) if nrow and "bat" in residuals else None,
+            "mjd_max": float(np.max(residuals["bat"])) if nrow and "bat" in residuals else None,
+        })
+        self._write_manifest()
+
+    def append_file(self, residual_file, source=None):
+        """
+        Parse a general2 residual file and append it, using the file name as the default source.
+        """
+        self.append(read_general2(residual_file), source=os.path.basename(residual_file) if source is None else source)
+
+    def remove(self, source, write_manifest=True):
+        """
+        Remove the shards of a source.
+        """
+        keep = []
+        for shard in self.manifest["shards"]:
+            if shard["source"] == source:
+                os.remove(os.path.join(self.directory, shard["file"]))
+            else:
+                keep.append(shard)
+        self.manifest["shards"] = keep
+        if write_manifest:
+            self._write_manifest()
+
+    @property
+    def sources(self):
+        """
+        The sources of every shard, in the order they were appended.
+        """
+        return [shard["source"] for shard in self.manifest["shards"]]
+
+    @property
+    def shard_files(self):
+        """
+        The file of every shard, in the same order as `sources`. Shard files are never reused, so a source
+        that is appended again gets a new one.
+        """
+        return [shard["file"] for shard in self.manifest["shards"]]
+
+    def _shards(self, mjd_range=None, sources=None):
+        """
+        The manifest entries of the shards from the given sources that overlap an MJD range (default: all of them).
+        """
+        shards = self.manifest["shards"]
+        if sources is not None:
+            shards = [shard for shard in shards if shard["source"] in sources]
+        if mjd_range is None:
+            return list(shards)
+        return [
+            shard for shard in shards
+            if shard["mjd_min"] is None or (shard["mjd_max"] >= mjd_range[0] and shard["mjd_min"] <= mjd_range[1])
+        ]
+
+    def read(self, columns=None, mjd_range=None, sources=None):
+        """
+        Read columns from every shard, only loading the requested columns of the shards that overlap the MJD range.
+
+        Parameters
+        ----------
+        columns : list of str
+            The columns to read (default: all of them). Shards without a column are filled with NaN or "".
+        mjd_range : tuple
+            Only read residuals with barycentric arrival times in this (start, end) range (default: all).
+        sources : list of str
+            Only read the shards of these sources (default: all).
+
+        Returns
+        -------
+        residuals : dict
+            The concatenated columns.
+        """
+        columns = self.columns if columns is None else list(columns)
+        shards = self._shards(mjd_range, sources)
+        # The arrival times are needed to cut the shards at the edges of the range
+        parts = {name: [] for name in columns + (["bat"] if mjd_range is not None and "bat" not in columns else [])}
+        for shard in shards:
+            # NpzFile only reads the members that are accessed
+            with np.load(os.path.join(self.directory, shard["file"])) as data:
+                for name in parts:
+                    parts[name].append(data[name] if name in shard["columns"] else None)
+
+        residuals = {}
+        for name, arrays in parts.items():
+            present = [array for array in arrays if array is not None]
+            if any(array.dtype.kind == "U" for array in present):
+                # A flag that is only numeric in some shards is read as strings
+                present = [np.where(np.isnan(array), "", array.astype(str)) if array.dtype.kind == "f" else array for array in present]
+            template = present[0] if present else np.empty(0)
+            filled = iter(present)
+            residuals[name] = np.concatenate(
+                [_empty_like(template, shard["nrow"]) if array is None else next(filled) for array, shard in zip(arrays, shards)]
+            ) if shards else np.empty(0)
+        if mjd_range is not None and "bat" in residuals:
+            in_range = (residuals["bat"] >= mjd_range[0]) & (residuals["bat"] <= mjd_range[1])
+            residuals = {name: residuals[name][in_range] for name in columns}
+        return residuals
@@ -0,0 +1,202 @@
+"""
+Scintillation bandwidth and timescale measurements from the 2-D autocorrelation function of dynamic spectra.
+
+The ACF is computed with zero padded FFTs and the scintillation bandwidth (half width at half maximum of the
+frequency cut, as in scintools) and timescale (1/e width of the time cut with a 5/3 Kolmogorov exponent) are
+fitted to cuts through its centre, excluding the white noise spike at zero lag.
+"""
+
+import os
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import curve_fit
+
+
+def refill(dyn):
+    """
+    Replace zapped (zero or NaN) pixels of a dynamic spectrum with the mean of the remaining pixels (like scintools' ``refill(linear=False)``).
+    """
+    dyn = np.array(dyn, dtype=np.float64)
+    bad = ~np.isfinite(dyn) | (dyn == 0.)
+    dyn[bad] = np.mean(dyn[~bad]) if np.any(~bad) else 0.
+    return dyn
+
+
+def acf_2d(dyn):
+    """
+    The 2-D autocorrelation function of a (nchan, nsub) dynamic spectrum, normalised to 1 at zero lag.
+
+    Returns
+    -------
+    acf : `numpy.ndarray`
+        The (2 * nchan - 1, 2 * nsub - 1) ACF with zero lag at the centre.
+    """
+    nchan, nsub = dyn.shape
+    dyn = dyn - np.mean(dyn)
+    # Zero pad to avoid the circular wrap of the correlation
+    spectrum = np.fft.rfft2(dyn, s=(2 * nchan, 2 * nsub))
+    acf = np.fft.irfft2(np.abs(spectrum) ** 2, s=(2 * nchan, 2 * nsub))
+    acf = np.fft.fftshift(acf)[1:, 1:]
+    if acf[nchan - 1, nsub - 1] != 0.:
+        acf /= acf[nchan - 1, nsub - 1]
+    return acf
+
+
+def _freq_model(lag, amp, dnu):
+    return amp * np.exp(-np.log(2.) * np.abs(lag) / dnu)
+
+
+def _time_model(lag, amp, tau):
+    return amp * np.exp(-np.abs(lag / tau) ** (5. / 3.))
+
+
+def _fit_cut(model, lags, cut, scale):
+    """
+    Fit a model to one side of an ACF cut, excluding the zero lag noise spike. Returns (width, error) or (None, None).
+    """
+    lags, cut = lags[1:], cut[1:]
+    if len(lags) < 2:
+        return None, None
+    # Start from the first crossing of half the first non-zero lag value
+    below = np.flatnonzero(cut < cut[0] / 2.)
+    guess = lags[below[0]] if len(below) else lags[-1]
+    try:
+        popt, pcov = curve_fit(model, lags, cut, p0=[cut[0], guess], bounds=([0., scale * 1e-3], [np.inf, lags[-1] * 10.]))
+    except (RuntimeError, ValueError):
+        return None, None
+    return float(popt[1]), float(np.sqrt(pcov[1, 1])) if np.isfinite(pcov[1, 1]) else None
+
+
+def fit_scint_params(dyn, df, dt, refilled=False):
+    """
+    Measure the scintillation bandwidth and timescale of a dynamic spectrum.
+
+    Parameters
+    ----------
+    dyn : `numpy.ndarray`
+        The (nchan, nsub) dynamic spectrum.
+    df : float
+        The channel bandwidth in MHz.
+    dt : float
+        The subint length in seconds.
+    refilled : bool
+        Whether zapped pixels have already been refilled (see `refill`).
+
+    Returns
+    -------
+    params : dict
+        The scintillation bandwidth in MHz (dnu, dnu_err) and timescale in seconds (tau, tau_err), None if they could not be fitted.
+    """
+    if not refilled:
+        dyn = refill(dyn)
+    nchan, nsub = dyn.shape
+    acf = acf_2d(dyn)
+    # Use lags up to half the span where the ACF is well measured
+    freq_lags = np.arange(nchan) * abs(df)
+    time_lags = np.arange(nsub) * dt
+    max_freq, max_time = max(nchan // 2, 2), max(nsub // 2, 2)
+    freq_cut = acf[nchan - 1:nchan - 1 + max_freq, nsub - 1]
+    time_cut = acf[nchan - 1, nsub - 1:nsub - 1 + max_time]
+    dnu, dnu_err = _fit_cut(_freq_model, freq_lags[:max_freq], freq_cut, abs(df))
+    tau, tau_err = _fit_cut(_time_model, time_lags[:max_time], time_cut, dt)
+    return {"dnu": dnu, "dnu_err": dnu_err, "tau": tau, "tau_err": tau_err}
+
+
+def save_refilled(npz_file, dyn, df, dt, freqs=None, times=None):
+    """
+    Save a refilled dynamic spectrum so the scintillation analysis can reuse it without recomputing it.
+    """
+    np.savez(
+        npz_file,
+        dyn=dyn,
+        df=df,
+        dt=dt,
+        freqs=np.empty(0) if freqs is None else freqs,
+        times=np.empty(0) if times is None else times,
+    )
+
+
+def load_dynspec(dynspec_file):
+    """
+    Load a dynamic spectrum from a refilled NPZ (from `save_refilled`) or a psrflux format text file.
+
+    Returns
+    -------
+    dyn : `numpy.ndarray`
+        The (nchan, nsub) dynamic spectrum.
+    df : float
+        The channel bandwidth in MHz.
+    dt : float
+        The subint length in seconds.
+    refilled : bool
+        Whether the dynamic spectrum has already been refilled.
+    """
+    if dynspec_file.endswith(".npz"):
+        with np.load(dynspec_file) as data:
+            return data["dyn"], float(data["df"]), float(data["dt"]), True
+    rows = np.loadtxt(dynspec_file, comments="#", ndmin=2)
+    nsub = int(rows[:, 0].max()) + 1
+    nchan = int(rows[:, 1].max()) + 1
+    dyn = rows[:, 4].reshape(nsub, nchan).T
+    freqs = rows[:nchan, 3]
+    times = rows[::nchan, 2] * 60.
+    df = (freqs[-1] - freqs[0]) / (nchan - 1) if nchan > 1 else 0.
+    dt = (times[-1] - times[0]) / (nsub - 1) if nsub > 1 else 0.
+    return dyn, df, dt, False
+
+
+def scintillation_from_file(dynspec_file):
+    """
+    Measure the scintillation parameters of a dynamic spectrum file (see `load_dynspec` and `fit_scint_params`).
+    """
+    dyn, df, dt, refilled = load_dynspec(dynspec_file)
+    params = fit_scint_params(dyn, df, dt, refilled=refilled)
+    params["file"] = dynspec_file
+    return params
+
+
+def batch_scintillation(dynspec_files, nproc=None):
+    """
+    Measure the scintillation parameters of many dynamic spectra in parallel.
+
+    Parameters
+    ----------
+    dynspec_files : list of str
+        Paths to refilled NPZ or psrflux text dynamic spectra.
+    nproc : int
+        The number of worker processes (default: the number of CPUs).
+
+    Returns
+    -------
+    params : list of dict
+        The scintillation parameters of each file, in order.
+    """
+    if nproc == 1 or len(dynspec_files) <= 1:
+        return [scintillation_from_file(dynspec_file) for dynspec_file in dynspec_files]
+    with ProcessPoolExecutor(max_workers=nproc) as executor:
+        return list(executor.map(scintillation_from_file, dynspec_files, chunksize=max(1, len(dynspec_files) // (4 * (nproc or os.cpu_count() or 1)))))
+
+
+def scint_results(params):
+    """
+    The results.json entries of the scintillation parameters.
+    """
+    params = params or {}
+    return {
+        "scint_bandwidth":     params.get("dnu"),
+        "scint_bandwidth_err": params.get("dnu_err"),
+        "scint_timescale":     params.get("tau"),
+        "scint_timescale_err": params.get("tau_err"),
+    }
+
+
+def update_results_json(results_file, params):
+    """
+    Add the scintillation parameters to an existing results.json.
+    """
+    with open(results_file, "r") as f:
+        results = json.load(f)
+    results.update(scint_results(params))
+    with open(results_file, "w") as f:
+        json.dump(results, f, indent=1)
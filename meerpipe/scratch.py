@@ -0,0 +1,116 @@
+"""
+Private scratch directories for the temporary files of a stage.
+
+Each stage gets its own uniquely named directory, so concurrent observations processed in the same
+working directory can't overwrite each other's temporary archives. The directory is made on the fastest
+location with room for it: $MEERPIPE_SCRATCH if set, then tmpfs (/dev/shm), then node-local disk
+($JOBFS on the HPC nodes, $TMPDIR) and finally the system temporary directory. It is removed when the
+stage finishes, whether or not it succeeded.
+"""
+
+import os
+import atexit
+import shutil
+import tempfile
+import contextlib
+
+SCRATCH_ENV = "MEERPIPE_SCRATCH"
+
+# Only use a location if it will have at least this fraction of its space free after the files are written,
+# as filling tmpfs uses up the node's memory
+FREE_FRACTION = 0.1
+
+# The directories made by make_scratch_dir that are removed when the process exits, with the process
+# that made them (so a forked child doesn't remove its parent's directories)
+_EXIT_CLEANUP = {}
+
+
+def scratch_roots():
+    """
+    The candidate scratch locations, fastest first.
+    """
+    roots = [os.environ.get(SCRATCH_ENV), "/dev/shm", os.environ.get("JOBFS"), os.environ.get("TMPDIR"), tempfile.gettempdir()]
+    unique = []
+    for root in roots:
+        if root and root not in unique:
+            unique.append(root)
+    return unique
+
+
+def choose_scratch_root(required_bytes=0):
+    """
+    The first writable scratch location with room for required_bytes (keeping `FREE_FRACTION` of it free).
+    """
+    for root in scratch_roots():
+        if not os.path.isdir(root) or not os.access(root, os.W_OK | os.X_OK):
+            continue
+        usage = shutil.disk_usage(root)
+        if usage.free - required_bytes >= FREE_FRACTION * usage.total:
+            return root
+    # Fall back to the working directory rather than failing
+    return os.getcwd()
+
+
+def make_scratch_dir(name="meerpipe", required_bytes=0, cleanup_at_exit=True):
+    """
+    Make a unique scratch directory.
+
+    Parameters
+    ----------
+    name : str
+        Prefix of the directory name, e.g. the stage.
+    required_bytes : int
+        The size of the files that will be written, to choose a location with enough room.
+    cleanup_at_exit : bool
+        Remove the directory when the process exits (default: True).
+
+    Returns
+    -------
+    path : str
+        The path of the new directory.
+    """
+    path = tempfile.mkdtemp(prefix=f"{name}-", dir=choose_scratch_root(required_bytes))
+    if cleanup_at_exit:
+        _EXIT_CLEANUP[path] = os.getpid()
+    return path
+
+
+def remove_scratch_dir(path):
+    """
+    Remove a scratch directory and its contents.
+    """
+    _EXIT_CLEANUP.pop(path, None)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+@atexit.register
+def _remove_at_exit():
+    for path, pid in list(_EXIT_CLEANUP.items()):
+        if pid == os.getpid():
+            remove_scratch_dir(path)
+
+
+@contextlib.contextmanager
+def scratch_dir(name="meerpipe", required_bytes=0, logger=None):
+    """
+    A unique scratch directory for a block of code, removed when the block exits or raises.
+
+    Parameters
+    ----------
+    name : str
+        Prefix of the directory name, e.g. the stage.
+    required_bytes : int
+        The size of the files that will be written, to choose a location with enough room.
+
+    Yields
+    ------
+    path : str
+        The path of the directory.
+    """
+    path = make_scratch_dir(name, required_bytes)
+    if logger is not None:
+        logger.debug(f"Using the scratch directory {path}")
+    try:
+        yield path
+    finally:
+        remove_scratch_dir(path)
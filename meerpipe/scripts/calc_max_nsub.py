@@ -1,13 +1,19 @@
 import argparse
 
+from meerpipe.utils import instrumented_entry_point
 from meerpipe.calc_max_nsub import calc_max_nsub
 
+@instrumented_entry_point
 def main():
     parser = argparse.ArgumentParser(description="Calculate maximum number of time subintegratons of sensitive ToAs for an archive")
+    parser.add_argument(
+        "--stats",
+        type=str,
+        help="Observation statistics sidecar (from obs_stats) to take the S/N, duration and nsub from",
+    )
     parser.add_argument(
         "--sn",
         type=float,
-        required=True,
         help="The signal-to-noise ratio of the archive",
     )
     parser.add_argument(
@@ -19,13 +25,11 @@ def main():
     parser.add_argument(
         "--duration",
         type=float,
-        required=True,
         help="The duration of the archive in seconds",
     )
     parser.add_argument(
         "--input_nsub",
         type=float,
-        required=True,
         help="The number of subintegrations of the input archive",
     )
     parser.add_argument(
@@ -42,11 +46,23 @@ def main():
     )
     args = parser.parse_args()
 
+    # Values given on the command line override the sidecar
+    sn, duration, input_nsub = args.sn, args.duration, args.input_nsub
+    if args.stats:
+        # obs_stats imports astropy (through archive_cube), so it is only imported when it is needed
+        from meerpipe.obs_stats import load_obs_stats
+        stats = load_obs_stats(args.stats)
+        sn         = stats["sn"]     if sn         is None else sn
+        duration   = stats["length"] if duration   is None else duration
+        input_nsub = stats["nsub"]   if input_nsub is None else input_nsub
+    if sn is None or duration is None or input_nsub is None:
+        parser.error("--sn, --duration and --input_nsub are required without --stats")
+
     nsub = calc_max_nsub(
-        args.sn,
+        sn,
         args.nchan,
-        args.duration,
-        args.input_nsub,
+        duration,
+        input_nsub,
         sn_desired=args.sn_desired,
         minimum_duration=args.minimum_duration,
     )
@@ -2,9 +2,11 @@
 
 import argparse
 
+from meerpipe.utils import instrumented_entry_point
 from meerpipe.archive_utils import chopping_utility
 
 
+@instrumented_entry_point
 def main():
     parser = argparse.ArgumentParser(description="Chop the edge frequency channels of a meertime archive")
     parser.add_argument("archive_path", help="Cleaned (psradded) archive.")
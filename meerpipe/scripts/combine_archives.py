@@ -0,0 +1,34 @@
+import argparse
+
+from meerpipe.utils import instrumented_entry_point
+from meerpipe.combine import combine_archives
+
+
+@instrumented_entry_point
+def main():
+    parser = argparse.ArgumentParser(description="Combine the sub-archives of an observation in time order by streaming their subints into one archive (replaces psradd)")
+    parser.add_argument(
+        "archives",
+        type=str,
+        nargs="+",
+        help="The sub-archives to combine",
+    )
+    parser.add_argument(
+        "-o", "--output",
+        type=str,
+        required=True,
+        help="Output combined archive",
+    )
+    parser.add_argument(
+        "-j", "--nthreads",
+        type=int,
+        default=4,
+        help="Number of threads reading the sub-archives ahead (default: 4)",
+    )
+    args = parser.parse_args()
+
+    combine_archives(args.archives, args.output, nthreads=args.nthreads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import argparse
+
+from meerpipe.utils import instrumented_entry_point
+from meerpipe.data_load import RM_CAT
+from meerpipe.corrections import correct_archive
+
+
+@instrumented_entry_point
+def main():
+    parser = argparse.ArgumentParser(description="Dedisperse and Faraday de-rotate an archive in one pass (replaces pam -R <rm> -D)")
+    parser.add_argument(
+        "archive",
+        type=str,
+        help="The archive to correct",
+    )
+    parser.add_argument(
+        "-o", "--output",
+        type=str,
+        required=True,
+        help="Output corrected archive",
+    )
+    parser.add_argument(
+        "-r", "--rm",
+        type=float,
+        help="Rotation measure in rad m^-2 (default: from the RM catalogue)",
+    )
+    parser.add_argument(
+        "--rm_cat",
+        type=str,
+        default=RM_CAT,
+        help="Rotation measure catalogue (default: the bundled rm_catalogue.txt)",
+    )
+    parser.add_argument(
+        "--no_dedisperse",
+        action="store_true",
+        help="Only apply the Faraday correction",
+    )
+    args = parser.parse_args()
+
+    correct_archive(args.archive, args.output, rm=args.rm, rm_cat=args.rm_cat, dedisperse=not args.no_dedisperse)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import argparse
+
+from meerpipe.utils import setup_logging, instrumented_entry_point
+from meerpipe.decimate import read_config, decimate_archive
+
+
+@instrumented_entry_point
+def main():
+    parser = argparse.ArgumentParser(description="Make all the decimated products of a cleaned archive from a single read of the archive")
+    parser.add_argument(
+        "archive",
+        type=str,
+        help="The cleaned archive to decimate",
+    )
+    parser.add_argument(
+        "-c", "--config",
+        type=str,
+        help="Project config file with a decimation_products entry",
+    )
+    parser.add_argument(
+        "-p", "--products",
+        type=str,
+        nargs="*",
+        help="Decimation products as '<nsub> <nchan> [<stokes_op>]' strings (overrides the config)",
+    )
+    parser.add_argument(
+        "-o", "--output_dir",
+        type=str,
+        default="./",
+        help="Directory to write the decimated archives to (default: ./)",
+    )
+    parser.add_argument(
+        "--sn",
+        type=float,
+        help="The signal-to-noise ratio of the archive, required for 'max' nsub products",
+    )
+    parser.add_argument(
+        "--sn_desired",
+        type=float,
+        default=12.,
+        help="The desired signal-to-noise ratio of 'max' nsub products (default: 12.)",
+    )
+    parser.add_argument(
+        "--minimum_duration",
+        type=float,
+        default=480.,
+        help="The minimum duration of the subints of 'max' nsub products in seconds (default: 480.)",
+    )
+    args = parser.parse_args()
+
+    if args.products:
+        products = args.products
+    elif args.config:
+        config = read_config(args.config)
+        if "decimation_products" not in config:
+            parser.error(f"No decimation_products in {args.config}")
+        products = config["decimation_products"]
+    else:
+        parser.error("Either --config or --products must be given")
+
+    logger = setup_logging(console=True)
+    for output in decimate_archive(
+            args.archive,
+            products,
+            output_dir=args.output_dir,
+            sn=args.sn,
+            sn_desired=args.sn_desired,
+            minimum_duration=args.minimum_duration,
+            logger=logger,
+        ):
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
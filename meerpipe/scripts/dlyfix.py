@@ -5,6 +5,7 @@ import copy
 import datetime
 import argparse
 
+from meerpipe.utils import instrumented_entry_point
 from meerpipe.dlyfix_fits import readfitsheader, binarytable, history_class
 from meerpipe.data_load import DELAY_CONFIG
 
@@ -159,6 +160,7 @@ def getcorrection(mainhdr,freq,history,correctionfiles,verbose=0):
 
 
 
+@instrumented_entry_point
 def main():
     parser = argparse.ArgumentParser(description="Corrects the psrfits header start time using the latest correction files.")
     parser.add_argument("-e", "--extension", type=str, help="Output with this extention")
@@ -1,17 +1,16 @@
 #!/usr/bin/env python
 
 import os
-import shlex
-import subprocess
 import argparse
 import os.path
 import numpy as np
 
 from astropy.io import fits
-from astropy.coordinates import (SkyCoord, Longitude, Latitude)
 
+from meerpipe.utils import run_command, instrumented_entry_point
 from meerpipe.data_load import UHF_TSKY_FILE, CHIPASS_EQU_CSV
 from meerpipe.archive_utils import get_band
+from meerpipe.obs_stats import load_obs_stats
 
 #=============================================================================
 
@@ -36,9 +35,7 @@ def get_info(archive):
     """
     #print ("Obtaining info for {0}".format(archive))
     info = 'psrstat -c length,nbin,bw,nchan {0} -jpD -Q'.format(archive)
-    arg = shlex.split(info)
-    proc = subprocess.Popen(arg,stdout=subprocess.PIPE)
-    info = str(proc.stdout.readline().decode("utf-8")).split()
+    info = run_command(info, cache=True).stdout.split("\n")[0].split()
     return info
 
 
@@ -48,9 +45,7 @@ def get_freqlist(archive):
     """
     print ("Getting frequency list..")
     info = 'psrstat -c int:freq,nchan {0} -jTD -Q'.format(archive)
-    arg = shlex.split(info)
-    proc = subprocess.Popen(arg,stdout=subprocess.PIPE)
-    info = str(proc.stdout.readline().decode("utf-8")).split()
+    info = run_command(info, cache=True).stdout.split("\n")[0].split()
     return info
 
 
@@ -62,9 +57,7 @@ def get_glgb(psrname):
     "Get GL and GB from psrname"
 
     info = 'psrcat -c "GL GB" {0} -all -X'.format(psrname)
-    arg = shlex.split(info)
-    proc = subprocess.Popen(arg,stdout=subprocess.PIPE)
-    info = proc.stdout.readline().split()
+    info = run_command(info, cache=True).stdout.split("\n")[0].split()
     gl = float(info[0])
     gb = float(info[1])
 
@@ -75,41 +68,35 @@ def get_radec(psrname):
     "Get RAJD and DECJD (in degrees) from psrname"
 
     info = 'psrcat -c "rajd decjd" {0} -all -X -x -o short'.format(psrname)
-    arg = shlex.split(info)
-    proc = subprocess.Popen(arg,stdout=subprocess.PIPE)
-    info = proc.stdout.readline().rstrip().split()
+    info = run_command(info, cache=True).stdout.split("\n")[0].rstrip().split()
     try:
         rajd = float(info[0])
         decjd = float(info[1])
-        print ("RAJD:{0}, DECJD:{1}".format(str(info[0].decode("utf-8")), str(info[1].decode("utf-8"))))
+        print ("RAJD:{0}, DECJD:{1}".format(info[0], info[1]))
     except ValueError:
-        raise(RuntimeError("Cannot convert values {} and {} to floats".format(str(info[0].decode("utf-8")), str(info[1].decode("utf-8")))))
+        raise(RuntimeError("Cannot convert values {} and {} to floats".format(info[0], info[1])))
 
     return rajd, decjd
 
 
 def get_radec_new(parfile):
     "Get RAJD and DECJD (in degrees) from the par file"
+    from astropy.coordinates import (SkyCoord, Longitude, Latitude)
+
     all_args = "grep {{}} {}".format(parfile)
 
     # try grabbing RAJ and DECJ directly first
-    ra_args = shlex.split(all_args.format("RAJ"))
-    proc1 = subprocess.Popen(ra_args, stdout=subprocess.PIPE)
-    inb_str = str(proc1.communicate()[0].decode("utf-8")).strip()
+    inb_str = run_command(all_args.format("RAJ")).stdout.strip()
     if inb_str != "":
         ra_str = inb_str.split()[1]
-        dec_args = shlex.split(all_args.format("DECJ"))
-        proc2 = subprocess.Popen(dec_args, stdout=subprocess.PIPE)
-        dec_str = str(proc2.communicate()[0].decode("utf-8")).strip().split()[1]
+        dec_str = run_command(all_args.format("DECJ")).stdout.strip().split()[1]
         pos = SkyCoord(Longitude(ra_str, unit='hourangle'),
                        Latitude(dec_str, unit='deg'))
         rajd = pos.ra.to('deg').value
         decjd = pos.dec.to('deg').value
 
     else: # coords in par file are not RA and Dec
-        elong_args = shlex.split(all_args.format("ELONG"))
-        proc1 = subprocess.Popen(elong_args, stdout=subprocess.PIPE)
-        info = proc1.communicate()[0].decode("utf-8")
+        info = run_command(all_args.format("ELONG")).stdout
         if len(info.split('\n')) > 1:
             for line in info.split('\n'):
                 if line.split()[0] == "ELONG":
@@ -121,9 +108,7 @@ def get_radec_new(parfile):
             print("Par file contains neither RAJ nor ELONG")
             return(None, None)
 
-        elat_args = shlex.split(all_args.format("ELAT"))
-        proc2 = subprocess.Popen(elat_args, stdout=subprocess.PIPE)
-        info = proc2.communicate()[0].decode("utf-8")
+        info = run_command(all_args.format("ELAT")).stdout
         if len(info.split('\n')) > 1:
             for line in info.split('\n'):
                 if line.split()[0] == "ELAT":
@@ -296,13 +281,10 @@ def get_offrms(archive):
     """
     print ("Computing off-pulse rms..")
     info = 'psrstat -c off:rms -l chan=0: -jTDp -Q {0}'.format(archive)
-    arg = shlex.split(info)
-    proc = subprocess.Popen(arg,stdout=subprocess.PIPE)
-
-    lines = proc.stdout.readlines()
+    lines = run_command(info, cache=True).stdout.splitlines()
     offpulse_rms_list = []
     for line in lines:
-        sline = str(line.decode("utf-8")).split(" ")
+        sline = line.split(" ")
         offpulse_rms_list.append(float(sline[-1].rstrip()))
 
     return offpulse_rms_list
@@ -329,7 +311,8 @@ def get_median_offrms(offrms_freq_dictionary, band):
     #for item in offrms_freq_dictionary.keys(): - 2TO3
     for item in list(offrms_freq_dictionary.keys()):
         #if float(item) >=1383.0 and float(item) < 1400.0:
-        if float(item) >=lo_freq and float(item) < hi_freq:
+        # Zapped channels have no off-pulse rms (NaN)
+        if float(item) >=lo_freq and float(item) < hi_freq and np.isfinite(float(offrms_freq_dictionary[item])):
             selected_offrms.append(offrms_freq_dictionary[item])
             selected_freqs.append(item)
 
@@ -341,18 +324,21 @@ def get_median_offrms(offrms_freq_dictionary, band):
     print ("Median off-pulse rms: {0}".format(median))
     return median
 
-def fluxcalibrate(archive,multiplier):
-    "Applying the multiplier to all the decimated data products"
+def fluxcalibrate(archive,multiplier,extension=None):
+    "Applying the multiplier to all the decimated data products (in place, or to a copy with the extension)"
 
 
     print ("Flux calibrating {0}".format(os.path.split(archive)[-1]))
-    info = "pam --mult {0} {1} -m".format(multiplier,archive)
-    arg = shlex.split(info)
-    proc = subprocess.call(arg)
+    if extension is None:
+        info = "pam --mult {0} {1} -m".format(multiplier,archive)
+    else:
+        info = "pam --mult {0} -e {1} {2}".format(multiplier,extension,archive)
+    run_command(info, capture=False)
 
 
 
 #=============================================================================
+@instrumented_entry_point
 def main():
     parser = argparse.ArgumentParser(description="Flux calibrate MTime data")
     parser.add_argument(
@@ -383,7 +369,11 @@ def main():
         "--tp_file",
         help="Time and polariation scruched clenaed archive",
         type=str,
-        required=True,
+    )
+    parser.add_argument(
+        "--stats",
+        help="Observation statistics sidecar (from obs_stats) of --archive_file used instead of psrstat",
+        type=str,
     )
     parser.add_argument(
         "--par_file",
@@ -391,7 +381,19 @@ def main():
         type=str,
         required=True,
     )
+    parser.add_argument(
+        "-e", "--extension",
+        help="Write the calibrated archive with this extension instead of modifying --archive_file in place",
+        type=str,
+    )
     args = parser.parse_args()
+    if args.tp_file is None and args.stats is None:
+        parser.error("Either --tp_file or --stats must be given")
+    if args.stats:
+        # The off-pulse rms must come from the archive being calibrated
+        stats = load_obs_stats(args.stats)
+        if not (os.path.exists(stats["archive"]) and os.path.samefile(stats["archive"], args.archive_file)):
+            parser.error(f"--stats is of {stats['archive']}, not the --archive_file {args.archive_file}")
 
     # extract the header parameters
     params = get_listinfo(args.obs_header)
@@ -421,16 +423,23 @@ def main():
         ssys = get_Ssys(tsky_jy, nant, band)
 
         #Get expected RMS in a single channel at 1390 MHz / 800 MHz
-        info_TP = get_info(args.tp_file)
+        if args.stats:
+            # Same order as the psrstat output of get_info
+            info_TP = [args.archive_file, stats["length"], stats["nbin"], stats["bw"], stats["nchan"]]
+        else:
+            info_TP = get_info(args.tp_file)
         expected_rms = get_expectedRMS(info_TP, ssys)
 
         print ("============")
         #Get centre-frequencies and off-pulse rms for the .add file - and creating a dictonary
-        freqinfo = get_freqlist(args.archive_file)
-        freq_list = freqinfo[-2].split(",")
-        offrms_list = get_offrms(args.archive_file)
-        #offrms_freq = dict(zip(freq_list,offrms_list)) - 2TO3
-        offrms_freq = dict(list(zip(freq_list, offrms_list)))
+        if args.stats:
+            offrms_freq = dict(zip(stats["freqs"], stats["offrms"]))
+        else:
+            freqinfo = get_freqlist(args.archive_file)
+            freq_list = freqinfo[-2].split(",")
+            offrms_list = get_offrms(args.archive_file)
+            #offrms_freq = dict(zip(freq_list,offrms_list)) - 2TO3
+            offrms_freq = dict(list(zip(freq_list, offrms_list)))
 
         #Getting median rms of off-pulse rms values for ~20 channels centered at 1390 MHz
         observed_rms = get_median_offrms(offrms_freq, band)
@@ -443,7 +452,7 @@ def main():
     print ("============")
 
     #Flux calibrate the archive file
-    fluxcalibrate(args.archive_file, multiplier)
+    fluxcalibrate(args.archive_file, multiplier, extension=args.extension)
 
     print ("============")
     print (f"Flux calibrated {args.psr_name}:{args.archive_file}")
@@ -1,25 +1,17 @@
 import os
 import json
-import shlex
-import subprocess
 import numpy as np
 import argparse
-from PIL import Image
 
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-
-#psrchive imports
-import psrchive as ps
-
-from coast_guard import clean_utils
-
-#Importing scintools (@dreardon)
-from scintools.dynspec import Dynspec
-
-from meerpipe.utils import setup_logging
-from meerpipe.archive_utils import template_adjuster, calc_dynspec_zap_fraction
+# matplotlib, PIL, psrchive, coast_guard and scintools are imported by the functions that use them
+# so each mode only pays for the libraries it needs
+from meerpipe.utils import setup_logging, stage_timer, run_command, instrumented_entry_point
+from meerpipe.scratch import scratch_dir
+from meerpipe.archive_utils import calc_dynspec_zap_fraction
+from meerpipe.dynspec import dynamic_spectrum, write_psrflux_dynspec
+from meerpipe.scintillation import fit_scint_params, save_refilled, scint_results
+from meerpipe.obs_stats import load_obs_stats
+from meerpipe.zap_stats import archive_zap_stats
 
 
 def return_none_or_float(value):
@@ -39,6 +31,11 @@ def generate_SNR_images(
     # Load logger if no provided
     if logger is None:
         logger = setup_logging(console=True)
+    import psrchive as ps
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from coast_guard import clean_utils
 
     logger.info("----------------------------------------------")
     logger.info(f"Creating {label} S/N images...")
@@ -53,42 +50,40 @@ def generate_SNR_images(
 
     # collect and write snr data
     snr_data = []
-    for x in range(0, nsub):
-        # step 1. work backward through the file zapping out one subint at a time
-        asub = nsub - x - 1
-        if (x > 0):
-            # don't need to zap anything - analysing the complete archive
-            clean_utils.zero_weight_subint(zapped_arch, asub + 1)
-
-        # step 2. scrunch and write to disk
-        tscr_arch = zapped_arch.clone()
-        tscr_arch.tscrunch()
-        temp_file = "zaptemp.ar"
-        tscr_arch.unload(temp_file)
-
-        # step 3. extract the cumulative snr via psrstat
-        comm = f"psrstat -j Fp -c snr=pdmp -c snr {temp_file}"
-        args = shlex.split(comm)
-        proc = subprocess.Popen(args,stdout=subprocess.PIPE)
-        proc.wait()
-        snr_cumulative = float(proc.stdout.read().decode("utf-8").rstrip().split("=")[1])
-
-        # step 4. extract the single snr via psrstat
-        comm = f"psrstat -j Fp -c snr=pdmp -c subint={asub} -c snr {scrunched_file}"
-        args = shlex.split(comm)
-        proc = subprocess.Popen(args,stdout=subprocess.PIPE)
-        proc.wait()
-        snr_single = float(proc.stdout.read().decode("utf-8").rstrip().split("=")[1])
-
-        # step 5. write to file
-        #snr_data.append([length*x/nsub, snr_single, snr_cumulative])
-        snr_data.append([length*asub/nsub, snr_single, snr_cumulative])
-
-        # cleanup
-        os.remove(temp_file)
-        del(tscr_arch)
-
-        #logger.info("Loop {} ending...".format(x))
+    # the temporary archives go in a private scratch directory (tmpfs if there is room) so runs in the
+    # same directory don't collide
+    with scratch_dir(f"snr_{label}", required_bytes=os.path.getsize(scrunched_file), logger=logger) as scratch:
+        for x in range(0, nsub):
+            # step 1. work backward through the file zapping out one subint at a time
+            asub = nsub - x - 1
+            if (x > 0):
+                # don't need to zap anything - analysing the complete archive
+                clean_utils.zero_weight_subint(zapped_arch, asub + 1)
+
+            # step 2. scrunch and write to disk
+            tscr_arch = zapped_arch.clone()
+            tscr_arch.tscrunch()
+            temp_file = os.path.join(scratch, "zaptemp.ar")
+            tscr_arch.unload(temp_file)
+
+            # step 3. extract the cumulative snr via psrstat
+            comm = f"psrstat -j Fp -c snr=pdmp -c snr {temp_file}"
+            snr_cumulative = float(run_command(comm, logger=logger).stdout.rstrip().split("=")[1])
+
+            # step 4. extract the single snr via psrstat
+            comm = f"psrstat -j Fp -c snr=pdmp -c subint={asub} -c snr {scrunched_file}"
+            snr_single = float(run_command(comm, cache=True, logger=logger).stdout.rstrip().split("=")[1])
+
+            # step 5. write to file
+            #snr_data.append([length*x/nsub, snr_single, snr_cumulative])
+            snr_data.append([length*asub/nsub, snr_single, snr_cumulative])
+            logger.debug(f"Subint {asub}: S/N {snr_single:.2f}, cumulative S/N {snr_cumulative:.2f}")
+
+            # cleanup
+            os.remove(temp_file)
+            del(tscr_arch)
+
+            #logger.info("Loop {} ending...".format(x))
 
     np.savetxt(f"{label}_snr.dat", snr_data, header=" Time (seconds) | snr (single) | snr (cumulative)", comments="#")
 
@@ -142,38 +137,75 @@ def generate_dynamicspec_images(
         archive_file,
         template,
         label,
+        write_dynspec_file=True,
+        fit=False,
         logger=None,
     ):
     # Load logger if no provided
     if logger is None:
         logger = setup_logging(console=True)
+    from scintools.dynspec import BasicDyn
 
-    ar = ps.Archive_load(archive_file)
-
-    # account for phase bin differences
-    temporary_template = template_adjuster(template, archive_file, "./", logger)
+    # Template matched flux of every subint and channel, computed in-process instead of with psrflux
+    flux, flux_err, cube = dynamic_spectrum(archive_file, template, logger=logger)
 
     # Work out what name of output psrflux file is
     dynspec_file = f"{archive_file}.dynspec"
-
-    dynamic_spectra(dynspec_file, label, logger=logger)
+    if write_dynspec_file:
+        write_psrflux_dynspec(dynspec_file, cube, flux, flux_err, archive_name=archive_file, template_name=template)
+
+    imjd, frac = cube.start_mjd
+    times = cube.offs_sub - (cube.offs_sub[0] - cube.tsubint[0] / 2)
+    bw = cube.freqs[-1] - cube.freqs[0]
+    dyn = BasicDyn(
+        flux.T,
+        name=os.path.basename(dynspec_file),
+        header=[f"Data file: {archive_file}", f"Template: {template}", f"MJD0: {imjd + frac}"],
+        times=times,
+        freqs=cube.freqs,
+        nchan=cube.nchan,
+        nsub=cube.nsub,
+        bw=bw,
+        df=bw / max(cube.nchan - 1, 1),
+        freq=np.mean(cube.freqs),
+        tobs=cube.length,
+        dt=cube.length / cube.nsub,
+        mjd=imjd + frac,
+    )
+    return dynamic_spectra(dynspec_file, label, dyn=dyn, fit=fit, logger=logger)
 
 
 def dynamic_spectra(
         dynspec_file,
         label,
+        dyn=None,
+        fit=False,
         logger=None,
     ):
     # Load logger if no provided
     if logger is None:
         logger = setup_logging(console=True)
+    from PIL import Image
+    from scintools.dynspec import Dynspec
 
-    dyn = Dynspec(dynspec_file, process=False, verbose=False)
+    if dyn is None:
+        dyn = Dynspec(dynspec_file, process=False, verbose=False)
+    else:
+        # Use the in-memory dynamic spectrum rather than parsing the text file
+        dyn = Dynspec(dyn=dyn, process=False, verbose=False)
     dynspec_image = f"{dynspec_file}.png"
     dyn.plot_dyn(filename=dynspec_image, display=False, title=f"Dynamic Spectrum ({label})", dpi=150)
-    logger.info("Refilling")
-    dyn.trim_edges()
-    dyn.refill(linear=False)
+    scint_params = None
+    if fit:
+        logger.info("Refilling")
+        dyn.trim_edges()
+        dyn.refill(linear=False)
+
+        # Keep the refilled array for batch reprocessing and measure the scintillation parameters from it
+        save_refilled(f"{dynspec_file}.refilled.npz", dyn.dyn, dyn.df, dyn.dt, freqs=dyn.freqs, times=dyn.times)
+        logger.info("Fitting the scintillation bandwidth and timescale")
+        scint_params = fit_scint_params(dyn.dyn, dyn.df, dyn.dt, refilled=True)
+        logger.info(f"Scintillation bandwidth: {scint_params['dnu']} MHz  timescale: {scint_params['tau']} s")
 
     image_size = os.path.getsize(dynspec_image)
     while image_size > 1e6:
@@ -190,6 +222,8 @@ def dynamic_spectra(
         resized_img.save(dynspec_image, quality=85)  # Adjust the quality as needed
         image_size = os.path.getsize(dynspec_image)
 
+    return scint_params
+
 
 def generate_images(
         pid,
@@ -202,6 +236,8 @@ def generate_images(
         raw_only=False,
         cleaned_only=False,
         rcvr="LBAND",
+        stats_file=None,
+        write_dynspec_file=True,
         logger=None,
     ):
     # Load logger if no provided
@@ -213,44 +249,53 @@ def generate_images(
 
 
     # get parameters
-    if not cleaned_only:
-        comm = f"vap -c nsub,length {raw_scrunched}"
+    if stats_file is not None:
+        stats = load_obs_stats(stats_file)
+        nsub = stats["nsub"]
+        length = stats["length"]
     else:
-        comm = f"vap -c nsub,length {clean_scrunched}"
-    args = shlex.split(comm)
-    proc = subprocess.Popen(args,stdout=subprocess.PIPE)
-    proc.wait()
-    info = proc.stdout.read().decode("utf-8").rstrip().split("\n")
-    nsub = int(info[1].split()[1])
-    length = float(info[1].split()[2])
+        if not cleaned_only:
+            comm = f"vap -c nsub,length {raw_scrunched}"
+        else:
+            comm = f"vap -c nsub,length {clean_scrunched}"
+        info = run_command(comm, cache=True, logger=logger).stdout.rstrip().split("\n")
+        nsub = int(info[1].split()[1])
+        length = float(info[1].split()[2])
 
     logger.info("Generating pipeline images")
     if not cleaned_only:
-        generate_SNR_images(
-            raw_scrunched,
-            'raw',
-            nsub,
-            length,
-            logger=logger
-        )
+        with stage_timer("snr_images_raw"):
+            generate_SNR_images(
+                raw_scrunched,
+                'raw',
+                nsub,
+                length,
+                logger=logger
+            )
     if not raw_only:
-        generate_SNR_images(
-            clean_scrunched,
-            'cleaned',
-            nsub,
-            length,
-            logger=logger
-        )
+        with stage_timer("snr_images_cleaned"):
+            generate_SNR_images(
+                clean_scrunched,
+                'cleaned',
+                nsub,
+                length,
+                logger=logger
+            )
 
 
 
+    scint_params = None
     if not raw_only and nsub > 1:
         logger.info("----------------------------------------------")
-        logger.info("Generating dynamic spectra using psrflux")
+        logger.info("Generating dynamic spectra")
         logger.info("----------------------------------------------")
         if not cleaned_only:
-            generate_dynamicspec_images(raw_file,   template, 'raw',     logger=logger)
-        generate_dynamicspec_images(clean_file, template, 'cleaned', logger=logger)
+            with stage_timer("dynamic_spectra_raw"):
+                generate_dynamicspec_images(raw_file,   template, 'raw',     write_dynspec_file=write_dynspec_file, logger=logger)
+        with stage_timer("dynamic_spectra_cleaned"):
+            scint_params = generate_dynamicspec_images(clean_file, template, 'cleaned', write_dynspec_file=write_dynspec_file, fit=True, logger=logger)
+
+    return scint_params
 
 
 def generate_results(
@@ -259,6 +304,9 @@ def generate_results(
         dm_file,
         cleaned_FTp_file,
         dynspec_file,
+        stats_file=None,
+        archive_file=None,
+        scint_params=None,
         logger=None,
     ):
     # Load logger if no provided
@@ -273,8 +321,17 @@ def generate_results(
     results = {}
 
     # Calculate the RFI fraction
-    logger.info("Calculating RFI fraction")
-    rfi_frac = float(calc_dynspec_zap_fraction(dynspec_file))
+    stats = None if stats_file is None else load_obs_stats(stats_file)
+    if stats is not None:
+        logger.info("Reading RFI fraction from the observation statistics")
+        rfi_frac = float(stats["zap_fraction"])
+    elif archive_file is not None:
+        # Zero weights are what the dynspec zapped lines come from, and they exist without a dynspec (e.g. nsub == 1)
+        logger.info(f"Calculating RFI fraction from the weights of {archive_file}")
+        rfi_frac = archive_zap_stats(archive_file)["zap_fraction"]
+    else:
+        logger.info("Calculating RFI fraction")
+        rfi_frac = float(calc_dynspec_zap_fraction(dynspec_file))
     results["percent_rfi_zapped"] = rfi_frac
 
     # Read in DM values
@@ -290,15 +347,21 @@ def generate_results(
     results["rm_err"]   = return_none_or_float(dm_results["RM_ERR"])
 
     # Add input SNR and flux value
+    if snr is None and stats is not None:
+        snr = stats["sn"]
     results["sn"] = float(snr)
     results["flux"] = float(flux)
 
+    # Scintillation parameters of the cleaned dynamic spectrum (None without one)
+    results.update(scint_results(scint_params))
+
     # Dump results to json
     with open("results.json", "w") as f:
         json.dump(results, f, indent=1)
 
     return
 
+@instrumented_entry_point
 def main():
     parser = argparse.ArgumentParser(description="Flux calibrate MTime data")
     parser.add_argument("--pid", help="Project id (e.g. PTA)", required=True)
@@ -313,13 +376,15 @@ def main():
     parser.add_argument("--snr", help="Signal to noise ratio of the cleaned profile")
     parser.add_argument("--flux", help="Flux density of the cleaned profile")
     parser.add_argument("--dm_file", help="The text file with the SM results")
+    parser.add_argument("--stats", help="Observation statistics sidecar of the cleaned archive (from obs_stats) used instead of vap and the dynspec")
     parser.add_argument("--raw_only", help="Generate only raw data plots", action='store_true')
     parser.add_argument("--cleaned_only", help="Generate only cleaned data plots", action='store_true')
+    parser.add_argument("--no_dynspec_file", help="Don't write the psrflux format .dynspec text files", action='store_true')
     args = parser.parse_args()
 
     logger = setup_logging(console=True)
 
-    generate_images(
+    scint_params = generate_images(
         args.pid,
         args.raw_file,
         args.cleaned_file,
@@ -330,6 +395,8 @@ def main():
         raw_only=args.raw_only,
         cleaned_only=args.cleaned_only,
         rcvr="LBAND",
+        stats_file=args.stats,
+        write_dynspec_file=not args.no_dynspec_file,
         logger=logger,
     )
 
@@ -351,6 +418,11 @@ def main():
             "sn": None,
             "flux": None,
         }
+        results.update(scint_results(None))
+        if args.stats:
+            results["percent_rfi_zapped"] = float(load_obs_stats(args.stats)["zap_fraction"])
+        elif args.cleaned_file:
+            results["percent_rfi_zapped"] = archive_zap_stats(args.cleaned_file)["zap_fraction"]
         with open("results.json", "w") as f:
             json.dump(results, f, indent=1)
     else:
@@ -363,6 +435,9 @@ def main():
             args.dm_file,
             args.clean_FTp,
             dynspec_file,
+            stats_file=args.stats,
+            archive_file=args.cleaned_file,
+            scint_params=scint_params,
             logger=logger,
         )
 
@@ -0,0 +1,47 @@
+import argparse
+
+from meerpipe.utils import instrumented_entry_point
+from meerpipe.toa import Template, batch_toas, write_tim
+
+
+@instrumented_entry_point
+def main():
+    parser = argparse.ArgumentParser(description="Calculate the ToAs of every subint and channel of archives by Fourier domain template matching (replaces pat)")
+    parser.add_argument(
+        "archives",
+        type=str,
+        nargs="+",
+        help="The (decimated) archives to calculate ToAs for",
+    )
+    parser.add_argument(
+        "-t", "--template",
+        type=str,
+        required=True,
+        help="Template (standard) archive",
+    )
+    parser.add_argument(
+        "-o", "--output",
+        type=str,
+        default="toas.tim",
+        help="Output tempo2 .tim file (default: toas.tim)",
+    )
+    parser.add_argument(
+        "-s", "--site",
+        type=str,
+        default="meerkat",
+        help="tempo2 observatory code (default: meerkat)",
+    )
+    parser.add_argument(
+        "-n", "--nproc",
+        type=int,
+        help="Number of processes used to fit the archives (default: number of CPUs)",
+    )
+    args = parser.parse_args()
+
+    toas_list = batch_toas(args.archives, Template.load(args.template), site=args.site, nproc=args.nproc)
+    write_tim(args.output, toas_list)
+    print(f"Wrote {sum(len(toas['imjd']) for toas in toas_list)} ToAs to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
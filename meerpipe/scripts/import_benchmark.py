@@ -0,0 +1,78 @@
+import sys
+import json
+import argparse
+
+from meerpipe.utils import instrumented_entry_point
+from meerpipe.entry_points import CONSOLE_SCRIPTS
+from meerpipe.import_benchmark import benchmark_entry_points, DEFAULT_THRESHOLD
+
+
+@instrumented_entry_point
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the start up (import) time of the meerpipe console scripts")
+    parser.add_argument(
+        "scripts",
+        type=str,
+        nargs="*",
+        help="The console scripts to benchmark (default: all of them)",
+    )
+    parser.add_argument(
+        "-t", "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help=f"The maximum import time in seconds of the scripts without their own budget (default: {DEFAULT_THRESHOLD})",
+    )
+    parser.add_argument(
+        "--thresholds",
+        type=str,
+        default=None,
+        help="A JSON file of the maximum import time in seconds of individual scripts, e.g. {\"make_stokes_movie\": 2.0}, overriding the built in budgets",
+    )
+    parser.add_argument(
+        "-r", "--repeat",
+        type=int,
+        default=3,
+        help="The number of times each script is imported, the fastest is reported (default: 3)",
+    )
+    parser.add_argument(
+        "-o", "--output",
+        type=str,
+        default=None,
+        help="Write the report to this JSON file",
+    )
+    args = parser.parse_args()
+
+    unknown = [script for script in args.scripts if script not in CONSOLE_SCRIPTS]
+    if unknown:
+        parser.error(f"Unknown console scripts {unknown}, choose from {list(CONSOLE_SCRIPTS)}")
+
+    thresholds = None
+    if args.thresholds:
+        with open(args.thresholds, "r") as f:
+            thresholds = json.load(f)
+
+    report = benchmark_entry_points(
+        scripts=args.scripts or None,
+        thresholds=thresholds,
+        default_threshold=args.threshold,
+        repeat=args.repeat,
+    )
+    for script, result in report.items():
+        status = "ok  " if result["passed"] else "FAIL"
+        if result["error"] is not None:
+            print(f"{status} {script:<24} import failed: {result['error']}")
+            continue
+        slowest = ", ".join(f"{name} {seconds * 1e3:.0f} ms" for name, seconds in result["slowest"][:3])
+        print(f"{status} {script:<24} {result['seconds']:6.3f} s (threshold {result['threshold']:g} s)  slowest: {slowest}")
+        if result["lazy_violations"]:
+            print(f"     imports {', '.join(result['lazy_violations'])} at start up")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    if not all(result["passed"] for result in report.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,184 @@
+import os
+import shlex
+import shutil
 import argparse
+import subprocess
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
-import psrchive as ps
+# psrchive, matplotlib and PIL are imported where they are used, so e.g. a movie made entirely from
+# cached profiles never loads psrchive
+from meerpipe.utils import setup_logging, stage_timer, instrumented_entry_point
+from meerpipe.profile_utils import align_profiles
+from meerpipe.profile_cache import (
+    profile_cache_file,
+    load_profile_cache,
+    save_profile_cache,
+    stale_archives,
+    update_profile_cache,
+    select_cached_profiles,
+)
 
-def grab_profile_data(archives, sn_min=20):
-    profiles = []
-    utcs = []
-    for archive in archives:
-        arch = ps.Archive_load(archive)
-        arch.remove_baseline()
-        arch.convert_state(state="Stokes")
-        prof = arch.get_Profile(0,0,0)
 
-        sn = prof.snr()
-        if sn > sn_min:
-            # Rotate to a phase of 0.5 profile max
-            rotate_by = prof.find_max_phase() - 0.5
-            arch.rotate_phase(rotate_by)
-            profiles.append(arch.get_data())
-            utcs.append(archive.split("/")[-1].split("_")[1])
-    return profiles, utcs
+def extract_stokes_profile(archive):
+    """
+    Extract the Stokes profiles of an archive without holding the full data cube in memory.
+
+    Parameters
+    ----------
+    archive : str
+        Path to the archive file.
+
+    Returns
+    -------
+    stokes : `numpy.ndarray`
+        A float32 array of shape (4, nbin) of the I, Q, U and V profiles.
+    sn : float
+        The signal-to-noise ratio of the total intensity profile.
+    """
+    import psrchive as ps
+    arch = ps.Archive_load(archive)
+    # Scrunch first so the baseline removal and state conversion only touch one profile per polarisation
+    arch.dedisperse()
+    arch.tscrunch()
+    arch.fscrunch()
+    arch.remove_baseline()
+    arch.convert_state(state="Stokes")
+    prof = arch.get_Profile(0,0,0)
+
+    sn = prof.snr()
+    stokes = arch.get_data()[0, :, 0, :].astype(np.float32)
+    return stokes, sn
+
+
+def archive_utc(archive):
+    return archive.split("/")[-1].split("_")[1]
+
+
+def check_common_nbin(archives, nbins):
+    """
+    Raise a ValueError naming the archives of each number of phase bins if they don't all have the same nbin,
+    as their profiles can't be stacked or compared.
+    """
+    by_nbin = OrderedDict()
+    for archive, nbin in zip(archives, nbins):
+        by_nbin.setdefault(int(nbin), []).append(archive)
+    if len(by_nbin) > 1:
+        raise ValueError(
+            "The archives have different numbers of phase bins, bscrunch them to the same nbin first:\n"
+            + "\n".join(f"{nbin} bins: {' '.join(files)}" for nbin, files in by_nbin.items())
+        )
+
+
+def extract_profiles(archives, nproc=None):
+    """
+    Extract the Stokes profiles of archives in parallel.
+
+    Parameters
+    ----------
+    archives : list of str
+        Paths to the archive files.
+    nproc : int
+        Number of processes to use (default: all cores).
+
+    Returns
+    -------
+    profiles : `numpy.ndarray`
+        A float32 array of shape (n_obs, 4, nbin) of the Stokes profiles of each archive.
+    sn : `numpy.ndarray`
+        The signal-to-noise ratio of each archive.
+    """
+    if len(archives) == 0:
+        return np.empty((0, 4, 0), dtype=np.float32), np.empty(0)
+    with ProcessPoolExecutor(max_workers=nproc) as executor:
+        results = list(executor.map(extract_stokes_profile, archives, chunksize=4))
+    check_common_nbin(archives, [stokes.shape[-1] for stokes, _ in results])
+    profiles = np.stack([stokes for stokes, _ in results])
+    sn = np.array([sn for _, sn in results])
+    return profiles, sn
+
+
+def grab_profile_data(archives, sn_min=20, nproc=None, cache_dir=None, logger=None):
+    """
+    Get the Stokes profiles of all archives, only loading the archives that are not already in the profile cache.
+
+    Parameters
+    ----------
+    archives : list of str
+        Paths to the archive files.
+    sn_min : float
+        Minimum signal-to-noise ratio of an archive to be included (default: 20).
+    nproc : int
+        Number of processes to use (default: all cores).
+    cache_dir : str
+        Directory of the per pulsar profile caches. If None, no cache is used and all archives are loaded.
+
+    Returns
+    -------
+    profiles : `numpy.ndarray`
+        A float32 array of shape (n_obs, 4, nbin) of the Stokes profiles of each included archive.
+    utcs : list of str
+        The UTC of each included archive.
+    """
+    if logger is None:
+        logger = setup_logging(console=True)
+    if cache_dir is None:
+        profiles, sn = extract_profiles(archives, nproc=nproc)
+        utcs = [archive_utc(archive) for archive in archives]
+    else:
+        # One cache per pulsar
+        pulsars = OrderedDict()
+        for archive in archives:
+            pulsars.setdefault(os.path.basename(archive).split("_")[0], []).append(archive)
+        profiles = []
+        sn = []
+        utcs = []
+        for pulsar, pulsar_archives in pulsars.items():
+            cache_file = profile_cache_file(cache_dir, pulsar)
+            cache = load_profile_cache(cache_file)
+            stale = stale_archives(cache, pulsar_archives)
+            if stale:
+                logger.info(f"Loading {len(stale)} new or changed archives of {pulsar} ({len(pulsar_archives) - len(stale)} cached)")
+                new_profiles, new_sn = extract_profiles(stale, nproc=nproc)
+                cache = update_profile_cache(cache, stale, new_profiles, new_sn, [archive_utc(archive) for archive in stale])
+                # A change of nbin empties the cache, so the rest of the archives are reloaded at the new nbin
+                reloaded = stale_archives(cache, pulsar_archives)
+                if reloaded:
+                    logger.info(f"The number of bins of {pulsar} changed, reloading the other {len(reloaded)} archives")
+                    nbin = new_profiles.shape[-1]
+                    new_profiles, new_sn = extract_profiles(reloaded, nproc=nproc)
+                    # Reloading would otherwise drop the first batch again if the archives don't share one nbin
+                    check_common_nbin(stale + reloaded, [nbin] * len(stale) + [new_profiles.shape[-1]] * len(reloaded))
+                    cache = update_profile_cache(cache, reloaded, new_profiles, new_sn, [archive_utc(archive) for archive in reloaded])
+                save_profile_cache(cache_file, cache)
+            pulsar_profiles, pulsar_sn, pulsar_utcs = select_cached_profiles(cache, pulsar_archives)
+            profiles.append(pulsar_profiles)
+            sn.append(pulsar_sn)
+            utcs += pulsar_utcs
+        check_common_nbin(
+            [archive for pulsar_archives in pulsars.values() for archive in pulsar_archives],
+            [pulsar_profiles.shape[-1] for pulsar_profiles, pulsar_archives in zip(profiles, pulsars.values()) for _ in pulsar_archives],
+        )
+        profiles = np.concatenate(profiles)
+        sn = np.concatenate(sn)
+
+    keep = sn > sn_min
+    return profiles[keep], [utc for utc, kept in zip(utcs, keep) if kept]
+
+
+def load_template_profile(template):
+    """
+    Load the total intensity profile of a template (standard) archive.
+    """
+    import psrchive as ps
+    arch = ps.Archive_load(template)
+    arch.dedisperse()
+    arch.tscrunch()
+    arch.fscrunch()
+    arch.pscrunch()
+    arch.remove_baseline()
+    return arch.get_data()[0, 0, 0, :]
 
 
 def normalise_profile(profile):
@@ -30,7 +186,13 @@ def normalise_profile(profile):
     return profile / max(profile)
 
 
-def make_profile_plot(profile_data, utcs):
+def make_profile_plot(profile_data, utcs, writer="pillow", fps=2, logger=None):
+    # Load logger if no provided
+    if logger is None:
+        logger = setup_logging(console=True)
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+
     fig, (ax, axt, axl, axc) = plt.subplots(
         4, 1,
         gridspec_kw={'height_ratios': [6, 1, 1, 1]},
@@ -38,76 +200,136 @@ def make_profile_plot(profile_data, utcs):
         sharex=True,
     )
     plt.subplots_adjust(wspace=0, hspace=0)
-    totals  = []
-    linears = []
-    circles = []
-    total_profiles  = []
-    linear_profiles = []
-    circle_profiles = []
-    for profile in profile_data:
-        phase = list(range(profile.shape[3]))
-        noramlise_by = max(profile[0][0][0][:])
-        total_profile    = profile[0][0][0][:] / noramlise_by
-        linear_profile   = np.sqrt(profile[0][1][0][:]**2 + profile[0][2][0][:]**2) / noramlise_by
-        circular_profile = profile[0][3][0][:] / noramlise_by
-        total_profiles.append(total_profile)
-        linear_profiles.append(linear_profile)
-        circle_profiles.append(circular_profile)
-        totals.append( ax.plot(phase, total_profile,    alpha=0.2, label='Total',    c="black")[0])
-        linears.append(ax.plot(phase, linear_profile,   alpha=0.2, label='Linear',   c="red")[0])
-        circles.append(ax.plot(phase, circular_profile, alpha=0.2, label='Circular', c="blue")[0])
-
-    # Only plot the unique labels https://stackoverflow.com/questions/13588920/stop-matplotlib-repeating-labels-in-legend
-    handles, labels = plt.gca().get_legend_handles_labels()
-    by_label = OrderedDict(zip(labels, handles))
-    ax.legend(by_label.values(), by_label.keys())
+
+    # Normalise all the profiles and calculate their residuals once instead of every frame
+    nbin = profile_data.shape[2]
+    phase = np.arange(nbin)
+    noramlise_by = profile_data[:, 0].max(axis=1)[:, np.newaxis]
+    total_profiles  = profile_data[:, 0] / noramlise_by
+    linear_profiles = np.hypot(profile_data[:, 1], profile_data[:, 2]) / noramlise_by
+    circle_profiles = profile_data[:, 3] / noramlise_by
+    total_residuals  = total_profiles  - np.mean(total_profiles,  axis=0)
+    linear_residuals = linear_profiles - np.mean(linear_profiles, axis=0)
+    circle_residuals = circle_profiles - np.mean(circle_profiles, axis=0)
+
+    # All epochs are drawn as one collection per Stokes type rather than an artist per profile
+    for profiles, label, colour in (
+            (total_profiles,  'Total',    "black"),
+            (linear_profiles, 'Linear',   "red"),
+            (circle_profiles, 'Circular', "blue"),
+        ):
+        segments = np.stack([np.broadcast_to(phase, profiles.shape), profiles], axis=-1)
+        ax.add_collection(LineCollection(segments, alpha=0.2, label=label, colors=colour))
+    ax.autoscale_view()
+    ax.legend()
 
     axt.set_ylim([-0.5, 0.5])
     axl.set_ylim([-0.5, 0.5])
     axc.set_ylim([-0.5, 0.5])
 
-    total_mean  = np.mean(np.array(total_profiles),  axis=0)
-    linear_mean = np.mean(np.array(linear_profiles), axis=0)
-    circle_mean = np.mean(np.array(circle_profiles), axis=0)
-    total_residual  = axt.plot(phase, np.zeros(len(total_mean)), label='Total',    c="black")[0]
-    linear_residual = axl.plot(phase, np.zeros(len(total_mean)), label='Linear',   c="red")[0]
-    circle_residual = axc.plot(phase, np.zeros(len(total_mean)), label='Circular', c="blue")[0]
-
+    total_residual  = axt.plot(phase, np.zeros(nbin), label='Total',    c="black")[0]
+    linear_residual = axl.plot(phase, np.zeros(nbin), label='Linear',   c="red")[0]
+    circle_residual = axc.plot(phase, np.zeros(nbin), label='Circular', c="blue")[0]
 
     plt.savefig("profile.png")
 
-    # Make animation
-    # https://matplotlib.org/stable/users/explain/animations/animations.html
-    def update_profile_alpha(frame):
-        # Make sure everything is the same alpha
-        for total, linear, circle in zip(totals, linears, circles):
-            total.set_alpha(0.2)
-            linear.set_alpha(0.2)
-            circle.set_alpha(0.2)
-        # Put current frame alpha to 1
-        totals[frame].set_alpha(1)
-        linears[frame].set_alpha(1)
-        circles[frame].set_alpha(1)
+    # Make animation by blitting only the highlighted profile, residuals and title over a cached background
+    total_highlight  = ax.plot(phase, np.zeros(nbin), c="black", animated=True)[0]
+    linear_highlight = ax.plot(phase, np.zeros(nbin), c="red",   animated=True)[0]
+    circle_highlight = ax.plot(phase, np.zeros(nbin), c="blue",  animated=True)[0]
+    title = ax.text(0.5, 1.01, "", transform=ax.transAxes, ha="center", va="bottom", fontsize="large", animated=True)
+    for residual in (total_residual, linear_residual, circle_residual):
+        residual.set_animated(True)
+    animated_artists = (
+        total_highlight, linear_highlight, circle_highlight,
+        total_residual, linear_residual, circle_residual,
+        title,
+    )
+
+    fig.canvas.draw()
+    background = fig.canvas.copy_from_bbox(fig.bbox)
 
-        # Update the residuals
-        total_residual.set_ydata(np.array(total_profiles)[frame]   - total_mean)
-        linear_residual.set_ydata(np.array(linear_profiles)[frame] - linear_mean)
-        circle_residual.set_ydata(np.array(circle_profiles)[frame] - circle_mean)
+    def render_frame(frame):
+        total_highlight.set_ydata(total_profiles[frame])
+        linear_highlight.set_ydata(linear_profiles[frame])
+        circle_highlight.set_ydata(circle_profiles[frame])
+        total_residual.set_ydata(total_residuals[frame])
+        linear_residual.set_ydata(linear_residuals[frame])
+        circle_residual.set_ydata(circle_residuals[frame])
+        title.set_text(utcs[frame])
 
-        # Update title
-        ax.set_title(utcs[frame])
+        fig.canvas.restore_region(background)
+        for artist in animated_artists:
+            artist.axes.draw_artist(artist)
+        return np.asarray(fig.canvas.buffer_rgba())
 
-        return tuple(totals + linears + circles + [total_residual, linear_residual, circle_residual])
-    ani = animation.FuncAnimation(fig=fig, func=update_profile_alpha, frames=len(profile_data), interval=500)
-    ani.save(filename="profile.gif", writer="pillow")
+    if writer == "ffmpeg" and shutil.which("ffmpeg") is None:
+        logger.warning("ffmpeg not found so falling back to the pillow GIF writer")
+        writer = "pillow"
+    if writer == "ffmpeg":
+        write_mp4(render_frame, len(profile_data), "profile.mp4", fps)
+    else:
+        write_gif(render_frame, len(profile_data), "profile.gif", fps)
+    plt.close(fig)
 
 
+def write_gif(render_frame, nframes, filename, fps):
+    """
+    Write the frames as a looping GIF with pillow. Frames are mapped onto the palette of the
+    first frame, which is much faster than quantising every frame. pillow needs every frame to save
+    the GIF, so they are all held in memory as 8-bit palette images (a quarter of the size of the
+    rendered RGBA frames); use the ffmpeg writer for long movies.
+    """
+    from PIL import Image
+    first = Image.fromarray(render_frame(0)).convert("RGB").quantize(colors=256, method=Image.Quantize.MEDIANCUT)
+    frames = [first] + [
+        Image.fromarray(render_frame(frame)).convert("RGB").quantize(palette=first, dither=Image.Dither.NONE)
+        for frame in range(1, nframes)
+    ]
+    frames[0].save(filename, save_all=True, append_images=frames[1:], duration=int(1000 / fps), loop=0, optimize=False)
 
+
+def write_mp4(render_frame, nframes, filename, fps):
+    """
+    Stream the raw frames to ffmpeg to write an H.264 MP4 without holding the frames in memory.
+    """
+    height, width, _ = render_frame(0).shape
+    command = (
+        f"ffmpeg -y -loglevel error -f rawvideo -vcodec rawvideo -pix_fmt rgba -s {width}x{height} -r {fps} -i - "
+        f"-vf scale=trunc(iw/2)*2:trunc(ih/2)*2 -vcodec libx264 -pix_fmt yuv420p {filename}"
+    )
+    # The frames are streamed to stdin as they are rendered, so this isn't run with run_command
+    with stage_timer(command, kind="subprocess"):
+        proc = subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE)
+        for frame in range(nframes):
+            proc.stdin.write(render_frame(frame).tobytes())
+        proc.stdin.close()
+        returncode = proc.wait()
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to write {filename}")
+
+
+
+@instrumented_entry_point
 def main():
     parser = argparse.ArgumentParser(description="Make a movie of all the polarisation profiles.")
     parser.add_argument("-a", "--archives", nargs="+", help="All of the archive files that you want to create a movie of.")
-    parser.add_argument("-s", "--sn_min", help="Minium signal to noise ratio of archive to include in the movie.", default=20)
+    parser.add_argument("-s", "--sn_min", help="Minium signal to noise ratio of archive to include in the movie.", type=float, default=20)
+    parser.add_argument("-n", "--nproc", help="Number of processes used to read the archives (default: all cores).", type=int)
+    parser.add_argument("-c", "--cache_dir", help="Directory of the per pulsar profile caches. Only new or changed archives are loaded when set.")
+    parser.add_argument("-t", "--template", help="Template used to align the profiles. If not given, the profiles are aligned to their iterative mean.")
+    parser.add_argument("-w", "--writer", help="Movie writer, either pillow (profile.gif) or ffmpeg (profile.mp4).", choices=["pillow", "ffmpeg"], default="pillow")
+    parser.add_argument("--fps", help="Frames per second of the movie.", type=float, default=2)
     args = parser.parse_args()
 
-    profile_data, utcs = grab_profile_data(args.archives, sn_min=args.sn_min)
-    make_profile_plot(profile_data, utcs)
\ No newline at end of file
+    # The movie is rendered off screen, so use the non-interactive backend for the whole run
+    import matplotlib
+    matplotlib.use('Agg')
+
+    logger = setup_logging(console=True)
+    profile_data, utcs = grab_profile_data(args.archives, sn_min=args.sn_min, nproc=args.nproc, cache_dir=args.cache_dir, logger=logger)
+
+    # The profiles (including the cached ones) are unaligned, so align all epochs at once with sub-bin precision
+    template = None if args.template is None else load_template_profile(args.template)
+    profile_data, _ = align_profiles(profile_data, template=template)
+    make_profile_plot(profile_data, utcs, writer=args.writer, fps=args.fps, logger=logger)
\ No newline at end of file
@@ -0,0 +1,29 @@
+import argparse
+
+from meerpipe.utils import setup_logging, instrumented_entry_point
+from meerpipe.obs_stats import compute_obs_stats, write_obs_stats
+
+
+@instrumented_entry_point
+def main():
+    parser = argparse.ArgumentParser(description="Compute the S/N, off-pulse rms, nsub, length and zap fractions of an archive in one pass and write them to a sidecar")
+    parser.add_argument(
+        "archive",
+        type=str,
+        help="The cleaned archive",
+    )
+    parser.add_argument(
+        "-o", "--output_prefix",
+        type=str,
+        help="Prefix of the <prefix>.stats.json and <prefix>.stats.npz sidecar files (default: the archive path)",
+    )
+    args = parser.parse_args()
+
+    logger = setup_logging(console=True)
+    stats, arrays = compute_obs_stats(args.archive, logger=logger)
+    json_file = write_obs_stats(args.output_prefix or args.archive, stats, arrays)
+    print(json_file)
+
+
+if __name__ == '__main__':
+    main()
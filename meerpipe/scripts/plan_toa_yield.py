@@ -0,0 +1,125 @@
+import argparse
+import numpy as np
+
+from meerpipe.utils import instrumented_entry_point
+from meerpipe.calc_max_nsub import plan_toa_yield
+
+
+def read_observation_csv(csv_file):
+    """
+    Read a CSV of observations with the columns sn, duration, input_nsub and (optionally) nchan, nbin and npol.
+
+    Parameters
+    ----------
+    csv_file : str
+        Path to the CSV file with a header line naming the columns.
+
+    Returns
+    -------
+    observations : dict
+        A dictionary of column name to `numpy.ndarray`.
+    """
+    data = np.genfromtxt(csv_file, delimiter=",", names=True, dtype=None, encoding="utf-8")
+    data = np.atleast_1d(data)
+    return {name: data[name] for name in data.dtype.names}
+
+
+@instrumented_entry_point
+def main():
+    parser = argparse.ArgumentParser(description="Plan the number of subintegrations, ToAs, product sizes and timing cost of many observations")
+    parser.add_argument(
+        "--csv",
+        type=str,
+        required=True,
+        help="CSV file with the columns sn, duration, input_nsub and optionally nchan, nbin and npol",
+    )
+    parser.add_argument(
+        "--nchan",
+        type=int,
+        nargs="*",
+        help="Decimated nchan configurations to plan for each observation (overrides the nchan column)",
+    )
+    parser.add_argument(
+        "--nbin",
+        type=int,
+        default=1024,
+        help="The number of phase bins if there is no nbin column (default: 1024)",
+    )
+    parser.add_argument(
+        "--npol",
+        type=int,
+        default=4,
+        help="The number of polarisations in the decimated products if there is no npol column (default: 4)",
+    )
+    parser.add_argument(
+        "--sn_desired",
+        type=float,
+        default=12.,
+        help="The desired signal-to-noise ratio (default: 12.)",
+    )
+    parser.add_argument(
+        "--minimum_duration",
+        type=float,
+        default=480.,
+        help="The minimum duration of the archive in seconds (default: 480.)",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="toa_yield_plan.csv",
+        help="Output CSV of the per observation plan (default: toa_yield_plan.csv)",
+    )
+    args = parser.parse_args()
+
+    obs = read_observation_csv(args.csv)
+    nobs = len(obs["sn"])
+
+    if args.nchan:
+        nchan_configs = args.nchan
+    elif "nchan" in obs:
+        nchan_configs = [None]
+    else:
+        parser.error("No nchan column in the CSV so --nchan must be given")
+
+    rows = []
+    print(f"{'nchan':>6} {'nobs':>8} {'ntoa':>12} {'size (GB)':>12} {'timing cost':>14}")
+    for nchan in nchan_configs:
+        if nchan is None:
+            nchan = obs["nchan"]
+        plan = plan_toa_yield(
+            obs["sn"],
+            nchan,
+            obs["duration"],
+            obs["input_nsub"],
+            nbin=obs.get("nbin", args.nbin),
+            npol=obs.get("npol", args.npol),
+            sn_desired=args.sn_desired,
+            minimum_duration=args.minimum_duration,
+        )
+        nchan = np.broadcast_to(nchan, (nobs,))
+        rows.append(np.column_stack([
+            np.arange(nobs),
+            nchan,
+            plan["nsub"],
+            plan["ntoa"],
+            plan["size_bytes"],
+            plan["timing_cost"],
+        ]))
+        for config in np.unique(nchan):
+            mask = nchan == config
+            # A CSV nchan column written as e.g. 16.0 is read as floats
+            print(f"{int(config):>6d} {mask.sum():>8d} {int(plan['ntoa'][mask].sum()):>12d} "
+                  f"{plan['size_bytes'][mask].sum() / 1e9:>12.3f} {plan['timing_cost'][mask].sum():>14.1f}")
+
+    np.savetxt(
+        args.output,
+        np.concatenate(rows),
+        delimiter=",",
+        fmt=["%d", "%d", "%d", "%d", "%d", "%.3f"],
+        header="obs_index,nchan,nsub,ntoa,size_bytes,timing_cost",
+        comments="",
+    )
+
+
+if __name__ == '__main__':
+    main()
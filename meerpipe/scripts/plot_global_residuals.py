@@ -0,0 +1,43 @@
+import argparse
+
+from meerpipe.utils import instrumented_entry_point
+from meerpipe.residual_plot import update_global_residual_plot
+
+
+@instrumented_entry_point
+def main():
+    parser = argparse.ArgumentParser(description="Plot a pulsar's global residuals with the newest observation at full detail over binned older observations")
+    parser.add_argument(
+        "store",
+        type=str,
+        help="The pulsar's residual store directory (see residual_store)",
+    )
+    parser.add_argument(
+        "-o", "--output",
+        type=str,
+        default="global_residuals.png",
+        help="Output image (default: global_residuals.png)",
+    )
+    parser.add_argument(
+        "-l", "--latest",
+        type=str,
+        help="Source of the observation to draw at full detail (default: the most recently appended)",
+    )
+    parser.add_argument(
+        "--npix",
+        type=int,
+        default=1000,
+        help="Number of pixel columns the older observations are binned into (default: 1000)",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        help="Binned residual cache (default: binned_residuals.npz in the store directory)",
+    )
+    args = parser.parse_args()
+
+    update_global_residual_plot(args.store, args.output, latest_source=args.latest, npix=args.npix, cache_file=args.cache)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+import argparse
+
+from meerpipe.utils import instrumented_entry_point
+from meerpipe.residuals import ResidualStore
+
+
+@instrumented_entry_point
+def main():
+    parser = argparse.ArgumentParser(description="Append tempo2 general2 residual files (from tempo2_wrapper.sh) to a pulsar's columnar residual store")
+    parser.add_argument(
+        "residual_files",
+        type=str,
+        nargs="+",
+        help="general2 residual files formatted as \"{bat} {post} {err} {freq} {post_phase} {flags}\"",
+    )
+    parser.add_argument(
+        "-s", "--store",
+        type=str,
+        required=True,
+        help="The pulsar's store directory (created if it doesn't exist)",
+    )
+    parser.add_argument(
+        "--source",
+        type=str,
+        help="Identifier of the residuals when appending a single file (default: the file name). Existing residuals from the same source are replaced",
+    )
+    args = parser.parse_args()
+
+    if args.source and len(args.residual_files) != 1:
+        parser.error("--source can only be used with a single residual file")
+
+    store = ResidualStore(args.store)
+    for residual_file in args.residual_files:
+        store.append_file(residual_file, source=args.source)
+    print(f"{args.store} has {len(store)} residuals in {len(store.manifest['shards'])} shards")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+import argparse
+
+from meerpipe.utils import setup_logging, instrumented_entry_point, PROFILE_ENV
+from meerpipe.worker import serve, call
+from meerpipe.pipeline import load_pipeline, run_pipeline
+
+
+@instrumented_entry_point
+def main():
+    parser = argparse.ArgumentParser(prog="meerpipe", description="Run meerpipe pipelines")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the stages of a pipeline JSON file, skipping stages whose inputs and parameters are unchanged")
+    run_parser.add_argument(
+        "pipeline",
+        type=str,
+        help="Pipeline JSON file describing the stages, or \"observation\" for the stages run on each observation",
+    )
+    run_parser.add_argument(
+        "-v", "--variables",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Pipeline variables as name=value pairs (override the pipeline's variables)",
+    )
+    run_parser.add_argument(
+        "-n", "--nproc",
+        type=int,
+        help="Number of stages to run at once (default: number of CPUs)",
+    )
+    run_parser.add_argument(
+        "--cache_dir",
+        type=str,
+        help="Directory of the stage cache records (default: .meerpipe_cache in the pipeline's workdir)",
+    )
+    run_parser.add_argument(
+        "-f", "--force",
+        action="store_true",
+        help="Rerun every stage even if it is cached",
+    )
+    run_parser.add_argument(
+        "--profile",
+        type=str,
+        help="Profile every stage with cProfile, writing .prof and collapsed stack files to this directory (like setting $MEERPIPE_PROFILE)",
+    )
+    worker_parser = subparsers.add_parser("worker", help="Start a worker that preloads the meerpipe libraries and runs entry points sent to it by \"meerpipe call\"")
+    worker_parser.add_argument(
+        "-s", "--socket",
+        type=str,
+        help="Unix socket to listen on (default: $MEERPIPE_WORKER_SOCKET or /tmp/meerpipe-worker-<uid>.sock)",
+    )
+
+    call_parser = subparsers.add_parser("call", help="Run an entry point (e.g. calc_max_nsub) on the worker, or in this process if no worker is running")
+    call_parser.add_argument(
+        "-s", "--socket",
+        type=str,
+        help="The worker's Unix socket (default: $MEERPIPE_WORKER_SOCKET or /tmp/meerpipe-worker-<uid>.sock)",
+    )
+    call_parser.add_argument(
+        "--profile",
+        type=str,
+        help="Profile the entry point with cProfile, writing .prof and collapsed stack files to this directory (like setting $MEERPIPE_PROFILE)",
+    )
+    call_parser.add_argument(
+        "entry_point",
+        type=str,
+        help="The entry point to run",
+    )
+    call_parser.add_argument(
+        "args",
+        nargs=argparse.REMAINDER,
+        help="The entry point's command line arguments",
+    )
+    args = parser.parse_args()
+
+    if getattr(args, "profile", None):
+        # The stages (and the worker's tasks) inherit the environment
+        os.environ[PROFILE_ENV] = os.path.abspath(args.profile)
+
+    if args.command == "worker":
+        serve(args.socket, logger=setup_logging(console=True))
+        return
+    if args.command == "call":
+        sys.exit(call(args.entry_point, args.args, socket_path=args.socket))
+
+    variables = {}
+    for variable in args.variables:
+        if "=" not in variable:
+            parser.error(f"Variables must be name=value pairs, not {variable}")
+        name, value = variable.split("=", 1)
+        variables[name] = value
+
+    logger = setup_logging(console=True)
+    stages, workdir = load_pipeline(args.pipeline, variables=variables)
+    status = run_pipeline(stages, workdir=workdir, cache_dir=args.cache_dir, nproc=args.nproc, force=args.force, logger=logger)
+    print(json.dumps(status, indent=1))
+    if any(state in ("failed", "skipped") for state in status.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
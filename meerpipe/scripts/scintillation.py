@@ -0,0 +1,49 @@
+import json
+import argparse
+
+from meerpipe.utils import instrumented_entry_point
+from meerpipe.scintillation import batch_scintillation, update_results_json
+
+
+@instrumented_entry_point
+def main():
+    parser = argparse.ArgumentParser(description="Measure the scintillation bandwidth and timescale of many dynamic spectra from their 2-D ACFs")
+    parser.add_argument(
+        "dynspec_files",
+        type=str,
+        nargs="+",
+        help="Refilled dynamic spectra (<archive>.dynspec.refilled.npz) or psrflux format .dynspec files",
+    )
+    parser.add_argument(
+        "-n", "--nproc",
+        type=int,
+        help="Number of processes used to fit the dynamic spectra (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "-o", "--output",
+        type=str,
+        default="scintillation.json",
+        help="Output JSON of the parameters of every file (default: scintillation.json)",
+    )
+    parser.add_argument(
+        "-r", "--results",
+        type=str,
+        help="A results.json to add the parameters to (only with a single dynamic spectrum)",
+    )
+    args = parser.parse_args()
+
+    if args.results and len(args.dynspec_files) != 1:
+        parser.error("--results can only be used with a single dynamic spectrum")
+
+    params = batch_scintillation(args.dynspec_files, nproc=args.nproc)
+    with open(args.output, "w") as f:
+        json.dump(params, f, indent=1)
+    for param in params:
+        print(f"{param['file']} dnu: {param['dnu']} +/- {param['dnu_err']} MHz  tau: {param['tau']} +/- {param['tau_err']} s")
+
+    if args.results:
+        update_results_json(args.results, params[0])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import os
+import argparse
+import numpy as np
+
+from meerpipe.utils import instrumented_entry_point
+from meerpipe.toa_select import TimFile, parse_select, select_mask, snr_cut_masks
+
+
+@instrumented_entry_point
+def main():
+    parser = argparse.ArgumentParser(description="Apply tempo2 select logic (and/or S/N cuts) to a .tim file without rerunning tempo2")
+    parser.add_argument(
+        "tim_file",
+        type=str,
+        help="The .tim file to select ToAs from",
+    )
+    parser.add_argument(
+        "-s", "--select",
+        type=str,
+        nargs="+",
+        default=[],
+        help="tempo2 select files (e.g. default_toa_logic.select) or quoted logic such as \"LOGIC -snr < 10 REJECT\"",
+    )
+    parser.add_argument(
+        "--snr_cuts",
+        type=float,
+        nargs="+",
+        default=[],
+        help="S/N cuts to apply as \"LOGIC -snr < <cut> REJECT\"",
+    )
+    parser.add_argument(
+        "-o", "--output_dir",
+        type=str,
+        default=None,
+        help="Directory to write a filtered .tim file for each variant (default: the directory of the tim file)",
+    )
+    parser.add_argument(
+        "-m", "--masks",
+        type=str,
+        default=None,
+        help="Save the masks of every variant to this NPZ instead of writing filtered .tim files",
+    )
+    args = parser.parse_args()
+
+    if not args.select and not args.snr_cuts:
+        parser.error("At least one of --select or --snr_cuts is required")
+
+    tim = TimFile.read(args.tim_file)
+    stem = os.path.splitext(os.path.basename(args.tim_file))[0]
+    masks = {}
+    for i, select in enumerate(args.select):
+        label = os.path.splitext(os.path.basename(select))[0] if os.path.isfile(select) else f"select{i}"
+        masks[label] = select_mask(tim, parse_select(select))
+    for cut, mask in snr_cut_masks(tim, args.snr_cuts).items():
+        masks[f"snr{cut:g}"] = mask
+
+    for label, mask in masks.items():
+        print(f"{label}: {np.count_nonzero(mask)}/{len(tim)} ToAs pass")
+    if args.masks:
+        np.savez(args.masks, **masks)
+    else:
+        output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.tim_file))
+        for label, mask in masks.items():
+            tim.write(os.path.join(output_dir, f"{stem}.{label}.tim"), mask)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""
+In-process times of arrival from Fourier domain template matching, replacing ``pat`` for decimated products.
+
+Every (subint, channel) profile of an archive is fitted at once with the FFTFIT method of Taylor (1992) (pat's
+default ``-A PGS`` phase gradient algorithm): the shift maximising the cross-correlation with the template is
+found by Newton iterations on the phase gradient of the cross spectrum, and its uncertainty comes from the
+curvature of chi^2 at the best fit. The arrival times are referenced to the folding predictor in the same way
+as pat, and for dedispersed archives the dispersion delay of each channel relative to the centre frequency is
+added back, as pat does, so each ToA is the arrival time at its channel's frequency. For S/N > 10 the ToAs agree
+with ``pat -A PGS`` to within 0.1 sigma and 25 us and the uncertainties to within 10% (checked against pat by
+tests/test_toa.py::test_toas_match_pat).
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from meerpipe.utils import setup_logging
+from meerpipe.archive_cube import ArchiveCube
+from meerpipe.predictor import ChebyPredictor
+from meerpipe.profile_utils import resample_profile, phase_gradient_shifts, DISPERSION_CONSTANT
+
+
+class Template:
+    """
+    A total intensity template profile whose Fourier transform is cached for each number of phase bins.
+
+    Parameters
+    ----------
+    profile : `numpy.ndarray`
+        The (nbin,) template profile.
+    name : str
+        The name of the template written to the ``-tmplt`` flag of the ToAs.
+    """
+    def __init__(self, profile, name=""):
+        self.profile = np.asarray(profile, dtype=np.float64)
+        self.name = name
+        self._spectra = {}
+
+    @classmethod
+    def load(cls, template):
+        """
+        Load a template (standard) archive.
+        """
+        cube = ArchiveCube.load(template).pscrunch().scrunch(nsub=1, nchan=1)
+        return cls(cube.data[0, 0, 0], name=os.path.basename(template))
+
+    def spectrum(self, nbin):
+        """
+        The Fourier transform of the template resampled to nbin phase bins.
+        """
+        if nbin not in self._spectra:
+            self._spectra[nbin] = np.fft.rfft(resample_profile(self.profile, nbin))
+        return self._spectra[nbin]
+
+
+def harmonic_weights(nbin):
+    """
+    The number of times each rfft harmonic appears in a real profile, excluding the DC term which only holds the baseline.
+    """
+    weights = np.full(nbin // 2 + 1, 2.)
+    weights[0] = 0.
+    if nbin % 2 == 0:
+        weights[-1] = 1.
+    return weights
+
+
+def fftfit(profiles, template_spectrum, niter=5):
+    """
+    Fit every profile as a shifted and scaled copy of the template plus a baseline.
+
+    Parameters
+    ----------
+    profiles : `numpy.ndarray`
+        The (..., nbin) profiles.
+    template_spectrum : `numpy.ndarray`
+        The (nbin // 2 + 1,) Fourier transform of the template (see `Template.spectrum`).
+    niter : int
+        The number of Newton iterations used to refine the shifts (default: 5).
+
+    Returns
+    -------
+    shift : `numpy.ndarray`
+        The shift in bins of each profile relative to the template, in the range [-nbin/2, nbin/2).
+    shift_err : `numpy.ndarray`
+        The uncertainty of each shift in bins.
+    scale : `numpy.ndarray`
+        The template scale factor of each profile.
+    snr : `numpy.ndarray`
+        The template matched signal-to-noise ratio of each profile.
+    """
+    nbin = profiles.shape[-1]
+    spectra = np.fft.rfft(profiles, axis=-1)
+    cross_spectrum = spectra * np.conj(template_spectrum)
+    shift = phase_gradient_shifts(cross_spectrum, nbin, niter=niter)
+
+    weights = harmonic_weights(nbin)
+    phase_per_bin = 2 * np.pi * np.arange(nbin // 2 + 1) / nbin
+    ramp = np.exp(-1j * phase_per_bin * shift[..., np.newaxis])
+    template_power = np.sum(weights * np.abs(template_spectrum) ** 2)
+    scale = np.sum(weights * (cross_spectrum * np.conj(ramp)).real, axis=-1) / template_power
+
+    # Per-bin noise variance from the residual power (Parseval), less the shift, scale and baseline fitted
+    residual = spectra - scale[..., np.newaxis] * template_spectrum * ramp
+    noise_var = np.sum(weights * np.abs(residual) ** 2, axis=-1) / nbin / max(nbin - 3, 1)
+    # The curvature of chi^2 with shift is set by the power of the template's derivative
+    derivative_power = np.sum(weights * phase_per_bin ** 2 * np.abs(template_spectrum) ** 2) / nbin
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shift_err = np.sqrt(noise_var / derivative_power) / np.abs(scale)
+        snr = scale * np.sqrt(template_power / nbin / noise_var)
+    return shift, shift_err, scale, snr
+
+
+def _normalise_mjd(imjd, frac):
+    carry = np.floor(frac)
+    return imjd + carry.astype(np.int64), frac - carry
+
+
+def archive_toas(archive, template, site="meerkat", logger=None):
+    """
+    Calculate a ToA for every unzapped (subint, channel) profile of an archive like ``pat -A PGS -f tempo2``.
+
+    Parameters
+    ----------
+    archive : str
+        Path to the (decimated) archive.
+    template : str or `Template`
+        Path to the template archive or an already loaded template.
+    site : str
+        The tempo2 observatory code (default: meerkat).
+
+    Returns
+    -------
+    toas : dict
+        Arrays of the ToA MJD split into an integer ("imjd") and fractional day ("frac"), the uncertainty in
+        microseconds ("err"), the frequency ("freq"), subint ("subint"), channel ("chan") and S/N ("snr") of
+        each ToA, plus the flags shared by all of them ("flags") and the "archive" and "site".
+    """
+    if logger is None:
+        logger = setup_logging(console=True)
+    if isinstance(template, str):
+        template = Template.load(template)
+
+    cube = ArchiveCube.load(archive).pscrunch()
+    logger.info(f"Fitting {cube.nsub * cube.nchan} profiles of {archive} with {cube.nbin} bins")
+    shift, shift_err, _, snr = fftfit(cube.data[:, 0].astype(np.float64), template.spectrum(cube.nbin))
+
+    # The epoch of each subint, which the predictor's phase at the reference frequency is relative to
+    start_imjd, start_frac = cube.start_mjd
+    epoch_imjd, epoch_frac = _normalise_mjd(np.full(cube.nsub, start_imjd, dtype=np.int64), start_frac + cube.offs_sub / 86400.)
+    ref_freq = cube.centre_frequency
+    predictor = ChebyPredictor.from_archive(archive)
+    if predictor is not None:
+        # Only the offset from the nearest whole turn matters (bin 0 is at a whole turn at the epoch)
+        epoch_phase = np.array([predictor.phase(imjd, frac, ref_freq) for imjd, frac in zip(epoch_imjd, epoch_frac)])
+        epoch_phase = (epoch_phase - np.round(epoch_phase)).astype(np.float64)
+        period = np.array([1. / predictor.frequency(imjd, frac, ref_freq) for imjd, frac in zip(epoch_imjd, epoch_frac)])
+    else:
+        logger.warning(f"{archive} has no predictor so its ToAs are referenced to the subint epochs")
+        epoch_phase = np.zeros(cube.nsub)
+        period = cube.period if cube.period is not None else np.full(cube.nsub, np.nan)
+
+    good = (cube.weights > 0.) & np.isfinite(shift_err) & (shift_err > 0.)
+    isub, ichan = np.nonzero(good)
+    offset = (shift[isub, ichan] / cube.nbin - epoch_phase[isub]) * period[isub]
+    if cube.dedispersed and cube.dm != 0.:
+        # The channels were aligned to the centre frequency, so add back their dispersion delays
+        offset += DISPERSION_CONSTANT * cube.dm * (cube.freqs[ichan] ** -2 - ref_freq ** -2)
+    imjd, frac = _normalise_mjd(epoch_imjd[isub], epoch_frac[isub] + offset / 86400.)
+    logger.info(f"Measured {len(isub)} ToAs ({np.count_nonzero(~good)} profiles zapped or unfittable)")
+
+    header = cube.primary_header
+    frontend = str(header.get("FRONTEND", "")).strip()
+    backend = str(header.get("BACKEND", "")).strip()
+    bandwidth = abs(cube._chan_bw) * cube.nchan if cube.nchan else 0.
+    return {
+        "archive": os.path.basename(archive),
+        "site":    site,
+        "imjd":    imjd,
+        "frac":    frac,
+        "err":     shift_err[isub, ichan] / cube.nbin * period[isub] * 1e6,
+        "freq":    cube.freqs[ichan],
+        "subint":  isub,
+        "chan":    ichan,
+        "snr":     snr[isub, ichan],
+        "flags": {
+            "fe":    frontend,
+            "be":    backend,
+            "f":     f"{frontend}_{backend}",
+            "bw":    f"{bandwidth:.3f}",
+            "tmplt": template.name,
+            "nbin":  cube.nbin,
+            "nch":   cube.nchan,
+        },
+        "tobs":    cube.tsubint[isub],
+        "length":  cube.length,
+    }
+
+
+def format_tim_lines(toas):
+    """
+    Format ToAs from `archive_toas` as tempo2 (FORMAT 1) ``.tim`` lines with pat's flags.
+    """
+    lines = []
+    flags = toas["flags"]
+    for i in range(len(toas["imjd"])):
+        # Write the MJD from its integer and fractional parts to keep sub-nanosecond precision
+        frac = f"{toas['frac'][i]:.15f}"
+        imjd = toas["imjd"][i]
+        if frac.startswith("1"):
+            imjd, frac = imjd + 1, f"{0.:.15f}"
+        lines.append(
+            f"{toas['archive']} {toas['freq'][i]:.6f} {imjd}{frac[1:]} {toas['err'][i]:.3f} {toas['site']} "
+            f"-fe {flags['fe']} -be {flags['be']} -f {flags['f']} -bw {flags['bw']} -tobs {toas['tobs'][i]:.3f} "
+            f"-tmplt {flags['tmplt']} -nbin {flags['nbin']} -nch {flags['nch']} "
+            f"-chan {toas['chan'][i]} -subint {toas['subint'][i]} -snr {toas['snr'][i]:.3f} -length {toas['length']:.3f}"
+        )
+    return lines
+
+
+def write_tim(tim_file, toas_list):
+    """
+    Write the ToAs of one or more archives (from `archive_toas`) to a tempo2 ``.tim`` file.
+    """
+    with open(tim_file, "w") as f:
+        f.write("FORMAT 1\n")
+        for toas in toas_list:
+            for line in format_tim_lines(toas):
+                f.write(line + "\n")
+
+
+def _archive_toas(args):
+    archive, template, site = args
+    return archive_toas(archive, template, site=site)
+
+
+def batch_toas(archives, template, site="meerkat", nproc=None):
+    """
+    Calculate the ToAs of many archives in parallel, loading the template once.
+
+    Parameters
+    ----------
+    archives : list of str
+        Paths to the archives.
+    template : str or `Template`
+        Path to the template archive or an already loaded template.
+    nproc : int
+        The number of worker processes (default: the number of CPUs).
+
+    Returns
+    -------
+    toas_list : list of dict
+        The ToAs of each archive (see `archive_toas`), in order.
+    """
+    if isinstance(template, str):
+        template = Template.load(template)
+    jobs = [(archive, template, site) for archive in archives]
+    if nproc == 1 or len(archives) <= 1:
+        return [_archive_toas(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=nproc) as executor:
+        return list(executor.map(_archive_toas, jobs))
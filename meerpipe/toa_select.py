@@ -0,0 +1,197 @@
+"""
+Apply tempo2 select-file logic (e.g. ``LOGIC -snr < 10 REJECT``) to ``.tim`` files without running tempo2.
+
+The ToAs are parsed once into columnar arrays so any number of selection variants (such as a range of S/N
+cuts) can be evaluated as vectorised masks and written as filtered ``.tim`` files or saved as masks.
+"""
+
+import os
+import numpy as np
+
+# Comparison operators supported in LOGIC lines
+OPERATORS = {
+    "<":  np.less,
+    ">":  np.greater,
+    "<=": np.less_equal,
+    ">=": np.greater_equal,
+    "=":  np.equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+
+# Columns of a FORMAT 1 ToA line that can be used in LOGIC lines as well as flags
+TIM_COLUMNS = ("freq", "mjd", "err")
+
+# tim file commands which are not ToAs
+TIM_COMMANDS = ("FORMAT", "MODE", "TIME", "JUMP", "EFAC", "EQUAD", "INCLUDE", "SKIP", "NOSKIP", "PHASE", "TRACK", "END")
+
+
+def is_toa_line(line):
+    """
+    Whether a line of a ``.tim`` file is a ToA rather than a command, comment or blank line.
+    """
+    stripped = line.strip()
+    if not stripped or stripped.startswith(("#", "C ")):
+        return False
+    return stripped.split()[0] not in TIM_COMMANDS
+
+
+class TimFile:
+    """
+    The ToAs of a tempo2 FORMAT 1 ``.tim`` file as columns.
+
+    Parameters
+    ----------
+    lines : list of str
+        Every line of the file. The commands (e.g. ``FORMAT 1``, ``JUMP``, ``EFAC``), comments and blank
+        lines are kept in place and written back unchanged around the selected ToAs.
+    """
+    def __init__(self, lines):
+        self.all_lines = lines
+        # The index in all_lines of each ToA line
+        self.toa_index = np.array([i for i, line in enumerate(lines) if is_toa_line(line)], dtype=int)
+        self.lines = [lines[i] for i in self.toa_index]
+        fields = [line.split() for line in self.lines]
+        self.names = np.array([field[0] for field in fields], dtype=object)
+        self.freq = np.array([float(field[1]) for field in fields])
+        self.mjd = np.array([float(field[2]) for field in fields])
+        self.err = np.array([float(field[3]) for field in fields])
+        self.site = np.array([field[4] for field in fields], dtype=object)
+
+        # Every flag becomes a column with an empty string where a ToA doesn't have it
+        self.flags = {}
+        for i, field in enumerate(fields):
+            for flag, value in zip(field[5::2], field[6::2]):
+                if flag not in self.flags:
+                    self.flags[flag] = np.full(len(self.lines), "", dtype=object)
+                self.flags[flag][i] = value
+        self._numeric = {}
+
+    @classmethod
+    def read(cls, tim_file):
+        with open(tim_file, "r") as f:
+            return cls([line.rstrip("\n") for line in f])
+
+    @property
+    def header(self):
+        """
+        The lines before the first ToA (e.g. ``FORMAT 1``).
+        """
+        return self.all_lines[:self.toa_index[0] if len(self.toa_index) else len(self.all_lines)]
+
+    def __len__(self):
+        return len(self.lines)
+
+    def column(self, name):
+        """
+        The numeric values of a column (freq, mjd or err) or flag (e.g. -snr), NaN where a ToA doesn't have the flag.
+        """
+        if name in TIM_COLUMNS:
+            return getattr(self, name)
+        if name not in self._numeric:
+            values = np.full(len(self), np.nan)
+            if name in self.flags:
+                for i, value in enumerate(self.flags[name]):
+                    try:
+                        values[i] = float(value)
+                    except ValueError:
+                        pass
+            self._numeric[name] = values
+        return self._numeric[name]
+
+    def write(self, tim_file, mask=None):
+        """
+        Write the ToAs selected by a boolean mask (default: all of them) to a new ``.tim`` file.
+        """
+        keep = np.ones(len(self.all_lines), dtype=bool)
+        if mask is not None:
+            keep[self.toa_index] = mask
+        with open(tim_file, "w") as f:
+            if not self.header:
+                f.write("FORMAT 1\n")
+            for line, keep_line in zip(self.all_lines, keep):
+                if keep_line:
+                    f.write(line + "\n")
+
+
+def parse_select(select):
+    """
+    Parse tempo2 select logic.
+
+    Supported lines are ``LOGIC <column or -flag> <operator> <value> PASS|REJECT`` and
+    ``PASS|REJECT <-flag> <value>`` (which match a flag value exactly).
+
+    Parameters
+    ----------
+    select : str or list of str
+        Path to a select file, or the lines of select logic.
+
+    Returns
+    -------
+    rules : list of tuple
+        The (action, field, operator, value) of each rule.
+    """
+    if isinstance(select, str):
+        if os.path.isfile(select):
+            with open(select, "r") as f:
+                select = f.read().splitlines()
+        else:
+            select = select.splitlines()
+
+    rules = []
+    for line in select:
+        fields = line.split()
+        if len(fields) == 0 or fields[0].startswith("#"):
+            continue
+        keyword = fields[0].upper()
+        if keyword == "LOGIC" and len(fields) == 5 and fields[2] in OPERATORS and fields[4].upper() in ("PASS", "REJECT"):
+            rules.append((fields[4].upper(), fields[1], fields[2], fields[3]))
+        elif keyword in ("PASS", "REJECT") and len(fields) == 3:
+            rules.append((keyword, fields[1], "==", fields[2]))
+        else:
+            raise ValueError(f"Unsupported select logic: {line}")
+    return rules
+
+
+def select_mask(tim, rules):
+    """
+    Evaluate select logic rules on the ToAs of a tim file.
+
+    Each REJECT rule removes the ToAs that satisfy it and each PASS rule removes the ToAs that don't.
+    Comparisons with a flag a ToA doesn't have are False.
+
+    Parameters
+    ----------
+    tim : `TimFile`
+        The ToAs.
+    rules : list of tuple or str
+        Rules from `parse_select`, or select logic to parse.
+
+    Returns
+    -------
+    mask : `numpy.ndarray`
+        Boolean mask which is True for the ToAs that are kept.
+    """
+    if isinstance(rules, str) or any(isinstance(rule, str) for rule in rules):
+        rules = parse_select(rules)
+    mask = np.ones(len(tim), dtype=bool)
+    for action, field, operator, value in rules:
+        try:
+            values = tim.column(field)
+            satisfied = OPERATORS[operator](values, float(value)) & ~np.isnan(values)
+        except ValueError:
+            # Non-numeric values can only be compared for (in)equality with the flag's strings
+            if operator not in ("=", "==", "!="):
+                raise ValueError(f"Can't compare {field} {operator} {value}")
+            values = tim.flags.get(field, np.full(len(tim), "", dtype=object))
+            satisfied = (values == value) if operator != "!=" else (values != value) & (values != "")
+        mask &= ~satisfied if action == "REJECT" else satisfied
+    return mask
+
+
+def snr_cut_masks(tim, snr_cuts):
+    """
+    The masks of ``LOGIC -snr < <cut> REJECT`` for each S/N cut.
+    """
+    snr = tim.column("-snr")
+    return {float(cut): ~(snr < cut) for cut in snr_cuts}
@@ -1,5 +1,96 @@
 import os
+import sys
+import json
+import queue
+import atexit
+import time
+import fcntl
+import shlex
+import hashlib
+import datetime
+import subprocess
+import resource
+import functools
+import contextlib
 import logging
+import logging.handlers
+
+# Environment variable of the timings file the entry points append to ("0" to disable)
+TIMINGS_ENV = "MEERPIPE_TIMINGS"
+DEFAULT_TIMINGS_FILE = "timings.json"
+
+# Environment variable of the directory the entry points write their profiles to (see meerpipe.profiling)
+PROFILE_ENV = "MEERPIPE_PROFILE"
+
+# Environment variable of the directory run_command keeps memoised command outputs in
+COMMAND_CACHE_ENV = "MEERPIPE_COMMAND_CACHE"
+
+# Memoised outputs of the commands run in this process, keyed by `command_key`
+COMMAND_MEMO = {}
+
+# The stage records of the running entry point
+TIMINGS = []
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Format log records as one JSON object per line.
+    """
+    def format(self, record):
+        entry = {
+            "time":    datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level":   record.levelname,
+            "name":    record.name,
+            "module":  record.module,
+            "lineno":  record.lineno,
+            "process": record.process,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+# The queue handler on the root logger, its background listener and the sinks it writes to (keyed by
+# "console" or the log file path), shared by every setup_logging call in the process
+_LOGGING = {"queue_handler": None, "listener": None, "sinks": {}}
+
+
+def _stop_listener():
+    """
+    Stop the background listener, emitting any records still queued.
+    """
+    if _LOGGING["listener"] is not None:
+        _LOGGING["listener"].stop()
+        _LOGGING["listener"] = None
+
+
+def _before_fork():
+    # Hold the sinks' locks so the listener thread isn't part way through writing to a stream
+    # (whose buffer lock the child would inherit locked) when the process forks
+    for sink in _LOGGING["sinks"].values():
+        sink.acquire()
+
+
+def _after_fork_in_parent():
+    for sink in reversed(list(_LOGGING["sinks"].values())):
+        sink.release()
+
+
+def _after_fork_in_child():
+    # logging has already reinitialised the sinks' locks. The listener thread doesn't exist in a
+    # forked child, so log to the sinks directly until setup_logging is called again
+    root = logging.getLogger()
+    if _LOGGING["queue_handler"] in root.handlers:
+        root.removeHandler(_LOGGING["queue_handler"])
+        for sink in _LOGGING["sinks"].values():
+            root.addHandler(sink)
+    _LOGGING["queue_handler"] = None
+    _LOGGING["listener"] = None
+
+
+atexit.register(_stop_listener)
+os.register_at_fork(before=_before_fork, after_in_parent=_after_fork_in_parent, after_in_child=_after_fork_in_child)
 
 
 def setup_logging(
@@ -8,11 +99,16 @@ def setup_logging(
         filedir="./",
         filename='meerpipe.log',
         level=logging.INFO,
+        jsonfile=None,
     ):
     """
     Setup log handler - this logs in the terminal (if not run with --slurm).
     For slurm based runs - the logging is done by the job queue system
 
+    Records are put on a queue by the root logger's only handler and written to the console, log file and
+    JSON-lines sinks by a background thread, so logging doesn't wait on the terminal or disk. Calling this
+    again only adds the sinks that aren't set up yet, so the output is never duplicated.
+
     Parameters
     ----------
     console : `boolean`
@@ -23,6 +119,10 @@ def setup_logging(
         Directory to output logger file to
     filename : `str`
         Name of the output logger file
+    level : `int`
+        The logging level (the console only shows INFO and above)
+    jsonfile : `str`
+        Path of a file to also write the records to as JSON lines
 
     Returns
     -------
@@ -35,29 +135,287 @@ def setup_logging(
     logger = logging.getLogger()
     logger.setLevel(level)
 
-    # Create a console handler and set the logging level if console is True
-    if console:
+    sinks = _LOGGING["sinks"]
+    added = []
+    # Create a console handler if console is True
+    if console and "console" not in sinks:
         console_handler = logging.StreamHandler()
-        console_handler.setLevel(level)
         console_handler.setLevel(logging.INFO)
         console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
-        logger.info("Console logger enabled")
+        sinks["console"] = console_handler
+        added.append("Console logger enabled")
 
     # Create a file handler and set the logging level if logfile is True
     if logfile:
         if not os.path.exists(filedir):
             os.makedirs(filedir)
-        file_handler = logging.FileHandler(os.path.join(filedir, filename))
-        file_handler.setLevel(level)
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-        logger.info("File logging enabled")
-
-        #Check if file already exists, if so, add a demarcator to differentiate among runs
-        if os.path.exists(os.path.join(filedir, filename)):
-            with open(os.path.join(filedir, filename), 'a') as f:
-                f.write(20*"#")
-                f.write("\n")
-
-    return logger
\ No newline at end of file
+        path = os.path.abspath(os.path.join(filedir, filename))
+        if path not in sinks:
+            #Check if file already exists, if so, add a demarcator to differentiate among runs
+            if os.path.exists(path) and os.path.getsize(path):
+                with open(path, 'a') as f:
+                    f.write(20*"#")
+                    f.write("\n")
+            file_handler = logging.FileHandler(path)
+            file_handler.setFormatter(formatter)
+            sinks[path] = file_handler
+            added.append("File logging enabled")
+
+    # Create a JSON lines handler if jsonfile is given
+    if jsonfile is not None:
+        path = os.path.abspath(jsonfile)
+        if path not in sinks:
+            json_handler = logging.FileHandler(path)
+            json_handler.setFormatter(JsonLinesFormatter())
+            sinks[path] = json_handler
+            added.append("JSON lines logging enabled")
+
+    for path, sink in sinks.items():
+        if path != "console":
+            sink.setLevel(level)
+
+    # Route the root logger through the queue, replacing any sinks attached directly after a fork
+    queue_handler = _LOGGING["queue_handler"]
+    if queue_handler is None or queue_handler not in logger.handlers or added:
+        _stop_listener()
+        for handler in list(logger.handlers):
+            if handler is queue_handler or handler in sinks.values():
+                logger.removeHandler(handler)
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        listener = logging.handlers.QueueListener(log_queue, *sinks.values(), respect_handler_level=True)
+        listener.start()
+        logger.addHandler(queue_handler)
+        _LOGGING["queue_handler"] = queue_handler
+        _LOGGING["listener"] = listener
+
+    for message in added:
+        logger.info(message)
+
+    return logger
+
+def _proc_io():
+    """
+    The I/O counters of this process (and its reaped children) from /proc/self/io, or None if unavailable.
+    """
+    try:
+        with open("/proc/self/io", "r") as f:
+            return {key: int(value) for key, value in (line.split(":") for line in f if ":" in line)}
+    except (OSError, ValueError):
+        return None
+
+
+def resource_snapshot():
+    """
+    The current wall clock, CPU time, peak RSS and I/O counters of this process.
+
+    Returns
+    -------
+    snapshot : dict
+        "wall" and "cpu" (user + system) seconds, "children_cpu" seconds of the waited for subprocesses,
+        "peak_rss" and "children_peak_rss" in bytes, and the bytes read and written through system calls
+        ("read_bytes", "write_bytes") and from/to storage ("storage_read_bytes", "storage_write_bytes").
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    io = _proc_io() or {}
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "wall":                time.perf_counter(),
+        "cpu":                 usage.ru_utime + usage.ru_stime,
+        "children_cpu":        children.ru_utime + children.ru_stime,
+        "peak_rss":            usage.ru_maxrss * rss_scale,
+        "children_peak_rss":   children.ru_maxrss * rss_scale,
+        "read_bytes":          io.get("rchar"),
+        "write_bytes":         io.get("wchar"),
+        "storage_read_bytes":  io.get("read_bytes"),
+        "storage_write_bytes": io.get("write_bytes"),
+    }
+
+
+def _usage_between(start, stop):
+    usage = {}
+    for key in ("wall", "cpu", "children_cpu", "read_bytes", "write_bytes", "storage_read_bytes", "storage_write_bytes"):
+        usage[key] = None if start[key] is None or stop[key] is None else stop[key] - start[key]
+    # The peaks can't be reset, so they are the high water marks at the end of the stage
+    usage["peak_rss"] = stop["peak_rss"]
+    usage["children_peak_rss"] = stop["children_peak_rss"]
+    return usage
+
+
+@contextlib.contextmanager
+def stage_timer(name, kind="stage", timings=None, logger=None):
+    """
+    Record the wall time, CPU time, peak RSS and bytes read and written of a block of code.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage (or the command of a subprocess call).
+    kind : str
+        What is being timed, e.g. "stage" or "subprocess".
+    timings : list
+        The list the record is appended to (default: `TIMINGS`, written by `instrumented_entry_point`).
+    logger : logger object
+        If given, the wall and CPU time are logged at debug level.
+
+    Yields
+    ------
+    record : dict
+        The record of the stage, which is filled in when the block exits ("status" is "failed" if it raised).
+    """
+    record = {"name": name, "kind": kind, "start": datetime.datetime.now().isoformat(timespec="milliseconds")}
+    start = resource_snapshot()
+    try:
+        yield record
+        record["status"] = "ok"
+    except BaseException:
+        record["status"] = "failed"
+        raise
+    finally:
+        record.update(_usage_between(start, resource_snapshot()))
+        (TIMINGS if timings is None else timings).append(record)
+        if logger is not None:
+            logger.debug(f"{kind} {name} took {record['wall']:.3f} s wall, {record['cpu'] + record['children_cpu']:.3f} s CPU")
+
+
+def timings_file():
+    """
+    The timings file of the entry points: $MEERPIPE_TIMINGS or timings.json in the working directory,
+    or None if $MEERPIPE_TIMINGS is "0".
+    """
+    path = os.environ.get(TIMINGS_ENV, DEFAULT_TIMINGS_FILE)
+    return None if path in ("", "0") else path
+
+
+def append_timings(run, path):
+    """
+    Append the record of an entry point run to a timings file, which holds a list of runs.
+
+    The file is locked while it is updated so concurrent entry points in the same directory don't lose runs.
+    """
+    with open(path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        content = f.read()
+        runs = json.loads(content) if content.strip() else []
+        runs.append(run)
+        f.seek(0)
+        f.truncate()
+        json.dump(runs, f, indent=1)
+
+
+def instrumented_entry_point(main):
+    """
+    Decorate the main function of a console script to time it (and the stages timed with `stage_timer`
+    while it runs) and append the record to the timings file (see `timings_file`).
+
+    Runs that exit through SystemExit (e.g. --help or an argument error) are not recorded. If $MEERPIPE_PROFILE
+    is set, main is also profiled (see `meerpipe.profiling.profile_call`).
+    """
+    name = main.__module__.rsplit(".", 1)[-1]
+
+    @functools.wraps(main)
+    def wrapper(*args, **kwargs):
+        global TIMINGS
+        saved, TIMINGS = TIMINGS, []
+        run = None
+        try:
+            with stage_timer(name, kind="entry_point", timings=[]) as run:
+                profile_dir = os.environ.get(PROFILE_ENV)
+                if profile_dir:
+                    from meerpipe.profiling import profile_call
+                    return profile_call(main, name, profile_dir, *args, **kwargs)
+                return main(*args, **kwargs)
+        except SystemExit:
+            run = None
+            raise
+        finally:
+            stages, TIMINGS = TIMINGS, saved
+            path = timings_file()
+            if run is not None and path is not None:
+                run.update({"args": sys.argv[1:], "pid": os.getpid(), "cwd": os.getcwd(), "stages": stages})
+                try:
+                    append_timings(run, path)
+                except OSError as error:
+                    print(f"Could not write the timings to {path}: {error!r}", file=sys.stderr)
+    return wrapper
+
+
+def command_key(argv, inputs=()):
+    """
+    The memoisation key of a command: its arguments and the size and modification time of its input
+    files (any argument that is an existing file, plus the given inputs).
+    """
+    files = []
+    for path in list(argv[1:]) + list(inputs):
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            files.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+    return hashlib.sha256(json.dumps([list(argv), files]).encode()).hexdigest()
+
+
+def run_command(command, cache=False, inputs=(), capture=True, check=False, cache_dir=None, logger=None):
+    """
+    Run an external tool, timing it with `stage_timer` so it is recorded in the entry point's timings.
+
+    The output is read with ``communicate``, so large outputs can't deadlock the pipe.
+
+    Parameters
+    ----------
+    command : str or list of str
+        The command line (split with shlex if a string).
+    cache : bool
+        Memoise the result of a read-only tool (e.g. psrstat, vap or psrcat), keyed on the arguments and the
+        size and modification time of the input files. Results are kept in memory and, if cache_dir or
+        $MEERPIPE_COMMAND_CACHE is set, on disk so later processes can reuse them.
+    inputs : list of str
+        Files the command reads that aren't in its arguments.
+    capture : bool
+        Capture stdout (otherwise it goes to this process's stdout).
+    check : bool
+        Raise a `subprocess.CalledProcessError` if the command fails.
+    cache_dir : str
+        Directory of the on-disk cache (default: $MEERPIPE_COMMAND_CACHE).
+
+    Returns
+    -------
+    result : `subprocess.CompletedProcess`
+        The arguments, return code and decoded stdout (None if not captured) of the command.
+    """
+    argv = shlex.split(command) if isinstance(command, str) else [str(arg) for arg in command]
+    label = " ".join(shlex.quote(arg) for arg in argv)
+    key = cache_file = None
+    if cache:
+        key = command_key(argv, inputs)
+        cache_dir = cache_dir or os.environ.get(COMMAND_CACHE_ENV)
+        cache_file = None if not cache_dir else os.path.join(cache_dir, f"{key}.json")
+        if key not in COMMAND_MEMO and cache_file is not None and os.path.isfile(cache_file):
+            with open(cache_file, "r") as f:
+                COMMAND_MEMO[key] = json.load(f)
+        if key in COMMAND_MEMO:
+            if logger is not None:
+                logger.debug(f"Using the cached output of {label}")
+            with stage_timer(label, kind="subprocess") as record:
+                record["cached"] = True
+            return subprocess.CompletedProcess(argv, 0, COMMAND_MEMO[key])
+
+    if logger is not None:
+        logger.debug(f"Running {label}")
+    with stage_timer(label, kind="subprocess", logger=logger) as record:
+        proc = subprocess.Popen(argv, stdout=subprocess.PIPE if capture else None)
+        stdout, _ = proc.communicate()
+        record["returncode"] = proc.returncode
+    stdout = None if stdout is None else stdout.decode("utf-8")
+    if check and proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, argv, output=stdout)
+
+    if cache and proc.returncode == 0:
+        COMMAND_MEMO[key] = stdout
+        if cache_file is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_file + f".{os.getpid()}", "w") as f:
+                json.dump(stdout, f)
+            os.replace(cache_file + f".{os.getpid()}", cache_file)
+    return subprocess.CompletedProcess(argv, proc.returncode, stdout)
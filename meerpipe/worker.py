@@ -0,0 +1,236 @@
+"""
+A long-lived worker that runs meerpipe entry points without paying the interpreter and import start up each time.
+
+The server imports the heavy libraries (psrchive, scintools, astropy, matplotlib, ...) and every entry point
+module once, then listens on a Unix socket. For each request it forks, so every task starts from the same
+preloaded state and can't affect the next one. The client passes its stdin, stdout and stderr file descriptors
+over the socket with the request, so the task's output goes straight to the client's terminal or files.
+The task runs in the client's working directory and environment, and its exit code is sent back for the
+client to exit with, so ``meerpipe call <entry_point> <args>`` behaves like running the console script.
+The socket is only accessible to the user that started the worker, and only the entry points in
+`meerpipe.entry_points.ENTRY_POINTS` can be run.
+"""
+
+import os
+import sys
+import json
+import struct
+import signal
+import socket
+import logging
+import importlib
+
+from meerpipe.utils import _stop_listener
+from meerpipe.scratch import _remove_at_exit
+from meerpipe.entry_points import ENTRY_POINTS, run_entry_point
+
+# Imported once by the server so each task starts with them loaded (missing optional ones are skipped)
+PRELOAD_MODULES = (
+    "numpy",
+    "scipy.optimize",
+    "astropy.io.fits",
+    "matplotlib.pyplot",
+    "psrchive",
+    "scintools.dynspec",
+)
+
+HEADER = struct.Struct("!I")
+
+
+def default_socket_path():
+    """
+    The worker socket, $MEERPIPE_WORKER_SOCKET or a per-user path in the temporary directory.
+    """
+    return os.environ.get("MEERPIPE_WORKER_SOCKET", os.path.join("/tmp", f"meerpipe-worker-{os.getuid()}.sock"))
+
+
+def preload(logger=None):
+    """
+    Import the heavy libraries and every entry point module, returning the names of those that imported.
+    """
+    loaded = []
+    modules = list(PRELOAD_MODULES) + [target.split(":")[0] for target in ENTRY_POINTS.values()]
+    for module in modules:
+        try:
+            importlib.import_module(module)
+            loaded.append(module)
+        except Exception as error:
+            if logger is not None:
+                logger.warning(f"Could not preload {module}: {error!r}")
+    return loaded
+
+
+def _send_message(conn, message, fds=()):
+    payload = json.dumps(message).encode()
+    data = HEADER.pack(len(payload)) + payload
+    if fds:
+        socket.send_fds(conn, [data], list(fds))
+    else:
+        conn.sendall(data)
+
+
+def _receive_message(conn, maxfds=0):
+    if maxfds:
+        data, fds, _, _ = socket.recv_fds(conn, 65536, maxfds)
+    else:
+        data, fds = conn.recv(65536), []
+    if len(data) < HEADER.size:
+        raise ConnectionError("Incomplete message")
+    (length,) = HEADER.unpack(data[:HEADER.size])
+    payload = data[HEADER.size:]
+    while len(payload) < length:
+        chunk = conn.recv(length - len(payload))
+        if not chunk:
+            raise ConnectionError("Incomplete message")
+        payload += chunk
+    return json.loads(payload.decode()), fds
+
+
+def _finish_task():
+    """
+    Do the exit clean up of a forked task, which os._exit skips: emit the queued log records, flush and
+    close the log handlers and remove the task's scratch directories.
+    """
+    _stop_listener()
+    logging.shutdown()
+    _remove_at_exit()
+
+
+def _handle_request(conn):
+    """
+    Run one request in a forked child: adopt the client's file descriptors, directory and environment.
+    """
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    returncode = 1
+    try:
+        request, fds = _receive_message(conn, maxfds=3)
+        for fd, target in zip(fds, (0, 1, 2)):
+            os.dup2(fd, target)
+            os.close(fd)
+        # run_entry_point also accepts "module:function" paths, which would let a client run any importable function
+        if request["entry_point"] not in ENTRY_POINTS:
+            raise KeyError(f"Unknown entry point {request['entry_point']}")
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        # Loggers set up by the server would otherwise still point at its streams
+        logging.getLogger().handlers.clear()
+        returncode = run_entry_point(request["entry_point"], request["args"])
+    except Exception as error:
+        print(f"meerpipe worker: {error!r}", file=sys.stderr)
+    finally:
+        try:
+            _finish_task()
+        except Exception as error:
+            print(f"meerpipe worker: {error!r}", file=sys.stderr)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            _send_message(conn, {"returncode": returncode})
+        finally:
+            conn.close()
+            os._exit(0)
+
+
+def serve(socket_path=None, logger=None):
+    """
+    Preload the libraries and serve requests on a Unix socket until interrupted.
+
+    Parameters
+    ----------
+    socket_path : str
+        The socket to listen on (default: `default_socket_path`).
+    """
+    socket_path = socket_path or default_socket_path()
+    loaded = preload(logger)
+    if logger is not None:
+        logger.info(f"Preloaded {len(loaded)} modules, listening on {socket_path}")
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    # Finished children are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Create the socket owner-only from the start, rather than opening it up to other users until a chmod
+    umask = os.umask(0o177)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(umask)
+    server.listen()
+    try:
+        while True:
+            conn, _ = server.accept()
+            if os.fork() == 0:
+                server.close()
+                _handle_request(conn)
+            conn.close()
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def _stdio_fds():
+    """
+    The file descriptors of stdin, stdout and stderr, using /dev/null for any that aren't real files.
+
+    Returns
+    -------
+    fds : list of int
+        The three file descriptors.
+    opened : list of int
+        Those opened on /dev/null, which the caller closes.
+    """
+    fds = []
+    opened = []
+    for stream, mode in ((sys.stdin, os.O_RDONLY), (sys.stdout, os.O_WRONLY), (sys.stderr, os.O_WRONLY)):
+        try:
+            fds.append(stream.fileno())
+        except (AttributeError, ValueError, OSError):
+            opened.append(os.open(os.devnull, mode))
+            fds.append(opened[-1])
+    return fds, opened
+
+
+def call(entry_point, args=(), socket_path=None, fallback=True):
+    """
+    Run an entry point on the worker, as if the console script was run in this process.
+
+    Parameters
+    ----------
+    entry_point : str
+        The entry point name (e.g. "calc_max_nsub").
+    args : list of str
+        The command line arguments.
+    socket_path : str
+        The worker socket (default: `default_socket_path`).
+    fallback : bool
+        Run the entry point in this process if the worker isn't running (default: True).
+
+    Returns
+    -------
+    returncode : int
+        The exit code of the entry point.
+    """
+    socket_path = socket_path or default_socket_path()
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        conn.close()
+        if not fallback:
+            raise
+        return run_entry_point(entry_point, args)
+
+    with conn:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        request = {"entry_point": entry_point, "args": list(args), "cwd": os.getcwd(), "env": dict(os.environ)}
+        fds, opened = _stdio_fds()
+        try:
+            _send_message(conn, request, fds=fds)
+        finally:
+            for fd in opened:
+                os.close(fd)
+        response, _ = _receive_message(conn)
+    return response["returncode"]
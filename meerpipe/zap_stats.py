@@ -0,0 +1,96 @@
+"""
+RFI zapping statistics read straight from the archive weights (DAT_WTS), so no psrflux dynamic spectrum is needed.
+"""
+
+import numpy as np
+from astropy.io import fits
+
+
+def archive_weights(archive):
+    """
+    Read the (nsub, nchan) weights of an archive.
+
+    The DAT_WTS column is read directly from PSRFITS files, otherwise psrchive is used to load the archive.
+
+    Parameters
+    ----------
+    archive : str
+        Path to the archive.
+
+    Returns
+    -------
+    weights : `numpy.ndarray`
+        The (nsub, nchan) weights.
+    """
+    try:
+        with fits.open(archive, memmap=True) as hdul:
+            subint = hdul["SUBINT"]
+            return np.asarray(subint.data["DAT_WTS"], dtype=np.float32).reshape(subint.header["NAXIS2"], subint.header["NCHAN"])
+    except (OSError, KeyError):
+        import psrchive as ps
+        return np.asarray(ps.Archive_load(archive).get_weights(), dtype=np.float32)
+
+
+def run_length_encode(mask):
+    """
+    Compress a zap mask into the runs of zapped elements of its flattened (subint major) form.
+
+    Parameters
+    ----------
+    mask : `numpy.ndarray`
+        Boolean (nsub, nchan) mask which is True for zapped channels.
+
+    Returns
+    -------
+    runs : `numpy.ndarray`
+        (nrun, 2) array of the start index and length of each run of zapped elements.
+    """
+    flat = np.concatenate([[False], np.ravel(mask), [False]])
+    changes = np.flatnonzero(flat[1:] != flat[:-1])
+    starts, stops = changes[::2], changes[1::2]
+    return np.column_stack([starts, stops - starts]).astype(np.int64)
+
+
+def run_length_decode(runs, shape):
+    """
+    Expand the zap mask runs from `run_length_encode` back into a boolean mask of the given shape.
+    """
+    size = int(np.prod(shape))
+    runs = np.asarray(runs, dtype=np.int64).reshape(-1, 2)
+    # +1 at the start and -1 after the end of each run, with a spare element for runs that reach the end
+    changes = np.zeros(size + 1, dtype=np.int64)
+    np.add.at(changes, runs[:, 0], 1)
+    np.add.at(changes, runs[:, 0] + runs[:, 1], -1)
+    return np.cumsum(changes[:size]).astype(bool).reshape(shape)
+
+
+def zap_stats(weights):
+    """
+    Calculate the zapped fractions of an observation from its weights.
+
+    Parameters
+    ----------
+    weights : `numpy.ndarray`
+        The (nsub, nchan) weights, where zero weights are zapped.
+
+    Returns
+    -------
+    stats : dict
+        The overall zap fraction ("zap_fraction"), the per-channel ("chan_zap_fraction") and per-subint
+        ("subint_zap_fraction") fractions, the mask shape and the run-length encoded mask ("zap_runs").
+    """
+    mask = np.asarray(weights) == 0.
+    return {
+        "zap_fraction":        float(mask.mean()) if mask.size else 0.,
+        "chan_zap_fraction":   mask.mean(axis=0),
+        "subint_zap_fraction": mask.mean(axis=1),
+        "zap_shape":           np.array(mask.shape),
+        "zap_runs":            run_length_encode(mask),
+    }
+
+
+def archive_zap_stats(archive):
+    """
+    Calculate the zap statistics of an archive (see `zap_stats`) from its weights.
+    """
+    return zap_stats(archive_weights(archive))
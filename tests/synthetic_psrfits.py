@@ -0,0 +1,86 @@
+"""
+Writes small synthetic PSRFITS archives so the numpy-native archive code can be tested without psrchive.
+"""
+
+import numpy as np
+from astropy.io import fits
+
+
+def gaussian_pulse(nbin, centre=0.5, width=0.02):
+    phase = np.arange(nbin) / nbin
+    return np.exp(-0.5 * ((phase - centre) / width) ** 2)
+
+
+def write_psrfits(
+        filename,
+        data,
+        weights=None,
+        freqs=None,
+        tsubint=8.,
+        period=0.005,
+        pol_type="AABBCRCI",
+        dm=10.,
+        rm=0.,
+        start_mjd=(60000, 43200, 0.),
+        source="J0000+0000",
+    ):
+    """
+    Write a PSRFITS fold-mode archive of the (nsub, npol, nchan, nbin) data quantised to 16 bits.
+    """
+    nsub, npol, nchan, nbin = data.shape
+    if weights is None:
+        weights = np.ones((nsub, nchan))
+    if freqs is None:
+        freqs = np.linspace(856., 1712., nchan, endpoint=False) + 856. / nchan / 2
+
+    # Quantise each (subint, pol, chan) profile to 16 bit integers
+    minimum = data.min(axis=-1)
+    maximum = data.max(axis=-1)
+    scales = np.where(maximum > minimum, (maximum - minimum) / 65534., 1.)
+    offsets = (maximum + minimum) / 2.
+    quantised = np.round((data - offsets[..., np.newaxis]) / scales[..., np.newaxis]).astype(">i2")
+
+    primary = fits.PrimaryHDU()
+    primary.header["TELESCOP"] = "MeerKAT"
+    primary.header["FD_POLN"] = "LIN"
+    primary.header["OBSFREQ"] = float(np.mean(freqs))
+    primary.header["OBSBW"] = float(freqs[-1] - freqs[0] + (freqs[1] - freqs[0] if nchan > 1 else 856.))
+    primary.header["OBSNCHAN"] = nchan
+    primary.header["SRC_NAME"] = source
+    primary.header["STT_IMJD"] = start_mjd[0]
+    primary.header["STT_SMJD"] = start_mjd[1]
+    primary.header["STT_OFFS"] = start_mjd[2]
+
+    offs_sub = (np.arange(nsub) + 0.5) * tsubint
+    columns = [
+        fits.Column(name="TSUBINT",  format="D", unit="s", array=np.full(nsub, tsubint)),
+        fits.Column(name="OFFS_SUB", format="D", unit="s", array=offs_sub),
+        fits.Column(name="PERIOD",   format="D", unit="s", array=np.full(nsub, period)),
+        fits.Column(name="DAT_FREQ", format=f"{nchan}D", array=np.tile(freqs, (nsub, 1))),
+        fits.Column(name="DAT_WTS",  format=f"{nchan}E", array=weights),
+        fits.Column(name="DAT_OFFS", format=f"{nchan * npol}E", array=offsets.reshape(nsub, -1)),
+        fits.Column(name="DAT_SCL",  format=f"{nchan * npol}E", array=scales.reshape(nsub, -1)),
+        fits.Column(name="DATA",     format=f"{nbin * nchan * npol}I", dim=f"({nbin},{nchan},{npol})", array=quantised),
+    ]
+    subint = fits.BinTableHDU.from_columns(columns, name="SUBINT")
+    subint.header["NPOL"] = npol
+    subint.header["POL_TYPE"] = pol_type
+    subint.header["NBIN"] = nbin
+    subint.header["NCHAN"] = nchan
+    subint.header["CHAN_BW"] = float(freqs[1] - freqs[0]) if nchan > 1 else 856.
+    subint.header["DM"] = dm
+    subint.header["RM"] = rm
+    subint.header["NBITS"] = 1
+
+    history = fits.BinTableHDU.from_columns([
+        fits.Column(name="DATE_PRO", format="24A", array=["2023-01-01T00:00:00"]),
+        fits.Column(name="PROC_CMD", format="256A", array=["unknown"]),
+        fits.Column(name="NBIN",     format="1J", array=[nbin]),
+        fits.Column(name="NCHAN",    format="1J", array=[nchan]),
+        fits.Column(name="NPOL",     format="1J", array=[npol]),
+        fits.Column(name="DEDISP",   format="1I", array=[0]),
+        fits.Column(name="RM_CORR",  format="1I", array=[0]),
+    ], name="HISTORY")
+
+    fits.HDUList([primary, history, subint]).writeto(filename, overwrite=True)
+    return filename
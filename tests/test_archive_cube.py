@@ -0,0 +1,123 @@
+import os
+import tracemalloc
+import numpy as np
+
+from meerpipe.archive_cube import ArchiveCube
+from meerpipe.profile_utils import DISPERSION_CONSTANT
+from tests.synthetic_psrfits import gaussian_pulse, write_psrfits
+
+
+def make_test_archive(tmp_path, nsub=10, npol=4, nchan=16, nbin=64, dm=0.):
+    rng = np.random.default_rng(0)
+    data = rng.normal(0., 1., (nsub, npol, nchan, nbin)) + 10. * gaussian_pulse(nbin)
+    weights = rng.uniform(0.5, 1., (nsub, nchan))
+    weights[:, 3] = 0.
+    filename = write_psrfits(os.path.join(tmp_path, "test.ar"), data, weights=weights, dm=dm)
+    return filename, data, weights
+
+
+def test_archive_cube_load(tmp_path):
+    filename, data, weights = make_test_archive(tmp_path)
+    cube = ArchiveCube.load(filename)
+    assert cube.shape == data.shape
+    assert np.allclose(cube.data, data, atol=1e-3)
+    assert np.allclose(cube.weights, weights)
+    assert cube.length == 80.
+    assert cube.pol_type == "AABBCRCI"
+
+
+def test_archive_cube_scrunch(tmp_path):
+    filename, data, weights = make_test_archive(tmp_path)
+    cube = ArchiveCube.load(filename)
+
+    tscrunched = cube.tscrunch()
+    with np.errstate(invalid='ignore'):
+        expected = np.sum(data * weights[:, np.newaxis, :, np.newaxis], axis=0) / weights.sum(axis=0)[np.newaxis, :, np.newaxis]
+    expected[:, 3] = 0.
+    assert tscrunched.shape == (1, 4, 16, 64)
+    assert np.allclose(tscrunched.data[0], expected, atol=1e-3)
+    assert np.allclose(tscrunched.weights, weights.sum(axis=0))
+
+    fscrunched = cube.fscrunch(4)
+    assert fscrunched.shape == (10, 4, 4, 64)
+    assert np.allclose(fscrunched.weights.sum(axis=1), weights.sum(axis=1))
+
+    pscrunched = cube.pscrunch()
+    assert pscrunched.shape == (10, 1, 16, 64)
+    assert np.allclose(pscrunched.data[:, 0], data[:, 0] + data[:, 1], atol=1e-3)
+
+    bscrunched = cube.bscrunch(16)
+    assert bscrunched.shape == (10, 4, 16, 16)
+
+    # Scrunches compose into a pyramid
+    fully = cube.tscrunch(2).fscrunch(4).tscrunch().fscrunch().pscrunch()
+    direct = cube.tscrunch().fscrunch().pscrunch()
+    assert np.allclose(fully.data, direct.data, atol=1e-4)
+
+
+def test_archive_cube_chunked(tmp_path):
+    filename, data, weights = make_test_archive(tmp_path, nsub=11)
+    cube = ArchiveCube.load(filename)
+    # A budget smaller than the cube forces bounded-memory chunked reductions
+    chunked = ArchiveCube.load(filename, memory_budget=cube.nbytes // 5)
+    assert not chunked.in_memory
+    assert chunked.chunk_nsub < chunked.nsub
+
+    for scrunch in (
+            lambda c: c.tscrunch(),
+            lambda c: c.tscrunch(3),
+            lambda c: c.fscrunch(2),
+            lambda c: c.pscrunch(),
+            lambda c: c.bscrunch(8),
+        ):
+        assert np.allclose(scrunch(chunked).data, scrunch(cube).data, atol=1e-5)
+
+
+def test_archive_cube_chunked_memory(tmp_path):
+    # The dedispersing frequency scrunch holds about 7 cube sized temporaries, so a budget the size of the
+    # cube has to be reduced in chunks to stay within it
+    data = np.tile(gaussian_pulse(256), (32, 2, 64, 1))
+    filename = write_psrfits(os.path.join(tmp_path, "dispersed.ar"), data, pol_type="AABB", dm=30.)
+    cube = ArchiveCube.load(filename)
+    chunked = ArchiveCube.load(filename, memory_budget=cube.nbytes)
+    assert not chunked.in_memory
+
+    tracemalloc.start()
+    try:
+        fscrunched = chunked.fscrunch()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak <= chunked.memory_budget
+    assert np.allclose(fscrunched.data, cube.fscrunch().data, atol=1e-5)
+
+
+def test_archive_cube_fscrunch_dedisperses(tmp_path):
+    nsub, nchan, nbin = 2, 8, 128
+    dm, period = 30., 0.005
+    freqs = np.linspace(900., 1600., nchan)
+    # Delay the pulse in each channel by its dispersion delay relative to the weighted centre frequency
+    delays = DISPERSION_CONSTANT * dm * (freqs ** -2 - freqs.mean() ** -2) / period
+    profiles = np.array([gaussian_pulse(nbin, centre=(0.5 + delay) % 1.) for delay in delays])
+    data = np.broadcast_to(profiles, (nsub, 1, nchan, nbin)).copy()
+    filename = write_psrfits(os.path.join(tmp_path, "dispersed.ar"), data, freqs=freqs, pol_type="AA+BB", dm=dm, period=period)
+
+    cube = ArchiveCube.load(filename)
+    assert not cube.dedispersed
+    fscrunched = cube.fscrunch()
+    assert np.isclose(fscrunched.freqs[0], freqs.mean())
+    assert np.allclose(fscrunched.data[0, 0, 0], gaussian_pulse(nbin), atol=1e-3)
+
+
+def test_archive_cube_noop_views(tmp_path):
+    # Converting to the state the data are already in keeps the memory map rather than reading the data
+    filename, data, weights = make_test_archive(tmp_path, npol=1)
+    cube = ArchiveCube.load(filename, memory_budget=1024)
+    for view in (cube.pscrunch(), cube.dedisperse(), cube.pscrunch().dedisperse()):
+        assert view._data is None and view is not cube
+        assert np.allclose(view.data, data, atol=1e-3)
+    assert cube.dedisperse().dedispersed and not cube.dedispersed
+
+    filename = write_psrfits(os.path.join(tmp_path, "stokes.ar"), data.repeat(4, axis=1), weights=weights, pol_type="IQUV")
+    stokes = ArchiveCube.load(filename, memory_budget=1024).convert_to_stokes()
+    assert stokes._data is None and stokes.pol_type == "IQUV"
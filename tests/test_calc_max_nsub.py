@@ -0,0 +1,46 @@
+import os
+import numpy as np
+
+from meerpipe.entry_points import run_entry_point
+from meerpipe.calc_max_nsub import calc_max_nsub, calc_max_nsub_array, plan_toa_yield
+
+
+def test_calc_max_nsub_array_matches_scalar():
+    rng = np.random.default_rng(42)
+    sn         = rng.uniform(0., 5000., 1000)
+    nchan      = rng.choice([1, 16, 32], 1000)
+    duration   = rng.uniform(60., 8000., 1000)
+    input_nsub = np.ceil(duration / 8.)
+
+    nsubs = calc_max_nsub_array(sn, nchan, duration, input_nsub)
+    for i in range(len(sn)):
+        assert nsubs[i] == calc_max_nsub(sn[i], nchan[i], duration[i], input_nsub[i])
+
+
+def test_plan_toa_yield():
+    plan = plan_toa_yield(
+        [0., 10., 5000.],
+        16,
+        [1000., 1000., 1000.],
+        [125, 125, 125],
+        nbin=1024,
+        npol=1,
+    )
+    # Low S/N observations still produce a single subint
+    assert list(plan["nsub"]) == [1, 1, 2]
+    assert list(plan["ntoa"]) == [16, 16, 32]
+    assert plan["size_bytes"][2] == 2 * plan["size_bytes"][1]
+    assert plan["timing_cost"][0] == 16.
+
+
+def test_plan_toa_yield_script(tmp_path, capsys):
+    # An nchan column of floats (e.g. from a spreadsheet export) still prints the summary
+    csv_file = os.path.join(tmp_path, "obs.csv")
+    with open(csv_file, "w") as f:
+        f.write("sn,duration,input_nsub,nchan\n10.,1000.,125,16.0\n5000.,1000.,125,32.0\n")
+    output = os.path.join(tmp_path, "plan.csv")
+    assert run_entry_point("plan_toa_yield", ["--csv", csv_file, "--output", output]) == 0
+    summary = capsys.readouterr().out.splitlines()
+    assert summary[1].split()[:3] == ["16", "1", "16"]
+    assert summary[2].split()[:2] == ["32", "1"]
+    assert np.loadtxt(output, delimiter=",", skiprows=1).shape == (2, 6)
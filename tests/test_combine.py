@@ -0,0 +1,45 @@
+import os
+import pytest
+import numpy as np
+from astropy.io import fits
+
+from meerpipe.archive_cube import ArchiveCube
+from meerpipe.combine import combine_archives
+from tests.synthetic_psrfits import write_psrfits
+
+
+def test_combine_archives(tmp_path):
+    rng = np.random.default_rng(12)
+    data = rng.normal(0., 1., (6, 2, 4, 32))
+    # Three 2 subint (16 s) archives spanning midnight, given out of time order
+    start_mjds = {0: (60000, 86390, 0.5), 1: (60001, 6, 0.5), 2: (60001, 22, 0.5)}
+    archives = [
+        write_psrfits(os.path.join(tmp_path, f"sub{i}.ar"), data[2 * i:2 * i + 2], pol_type="AABB", start_mjd=start_mjds[i])
+        for i in (2, 0, 1)
+    ]
+
+    output = os.path.join(tmp_path, "combined.ar")
+    # A tiny memory budget to stream a row at a time
+    assert combine_archives(archives, output, nthreads=2, memory_budget=1) == 6
+    cube = ArchiveCube.load(output)
+    assert cube.shape == (6, 2, 4, 32)
+    assert np.allclose(cube.offs_sub, 4. + 8. * np.arange(6))
+    assert np.allclose(cube.data, data, atol=1e-3)
+    assert cube.start_mjd == ArchiveCube.load(archives[1]).start_mjd
+    # The HISTORY of the earliest sub-archive with a row for the combination
+    with fits.open(output) as hdul:
+        history = hdul["HISTORY"].data
+        assert len(history) == 2
+        assert history["PROC_CMD"][-1] == "combine_archives (3 sub-archives)"
+        assert history["NCHAN"][-1] == 4
+
+    # The same sub-archive twice, or ones covering overlapping times, would duplicate subints
+    with pytest.raises(ValueError, match="overlaps"):
+        combine_archives(archives + [archives[0]], os.path.join(tmp_path, "duplicated.ar"))
+    overlapping = write_psrfits(os.path.join(tmp_path, "overlapping.ar"), data[:2], pol_type="AABB", start_mjd=(60001, 14, 0.5))
+    with pytest.raises(ValueError, match="overlapping.ar overlaps .*sub1.ar by 8.000 s"):
+        combine_archives(archives + [overlapping], os.path.join(tmp_path, "overlapping_combined.ar"))
+
+    mismatched = write_psrfits(os.path.join(tmp_path, "mismatched.ar"), data[:1, :, :2], pol_type="AABB")
+    with pytest.raises(ValueError, match="nchan"):
+        combine_archives(archives + [mismatched], os.path.join(tmp_path, "bad.ar"))
@@ -0,0 +1,54 @@
+import os
+import numpy as np
+from astropy.io import fits
+
+from meerpipe.archive_cube import ArchiveCube
+from meerpipe.corrections import lookup_rm, faraday_angles, correct_cube, correct_archive
+from meerpipe.profile_utils import DISPERSION_CONSTANT, fft_shift_profiles
+from tests.synthetic_psrfits import gaussian_pulse, write_psrfits
+
+
+def test_lookup_rm():
+    assert np.isclose(lookup_rm("J0101-6422"), 18.488850598020075)
+    assert lookup_rm("J0000+0000") is None
+
+
+def test_correct_archive(tmp_path):
+    nsub, nchan, nbin = 2, 8, 128
+    dm, rm, period = 30., 50., 0.01
+    freqs = np.linspace(900., 1600., nchan)
+    pulse = gaussian_pulse(nbin, centre=0.4, width=0.03)
+    # A 100% linearly polarised pulse with a position angle of 0.3 rad at the centre frequency
+    angles = 0.3 + faraday_angles(freqs, rm, np.mean(freqs))
+    stokes = np.stack([np.ones(nchan), np.cos(2 * angles), np.sin(2 * angles), np.zeros(nchan)])
+    data = stokes[:, :, np.newaxis] * pulse
+    delays = DISPERSION_CONSTANT * dm * (freqs ** -2 - np.mean(freqs) ** -2) / period * nbin
+    data = np.tile(fft_shift_profiles(data, delays[np.newaxis]), (nsub, 1, 1, 1))
+    archive = write_psrfits(os.path.join(tmp_path, "pol.ar"), data, freqs=freqs, pol_type="IQUV", dm=dm, period=period)
+
+    output = os.path.join(tmp_path, "pol.corrected.ar")
+    assert correct_archive(archive, output, rm=rm) == rm
+    corrected = ArchiveCube.load(output)
+    expected = np.stack([pulse, np.cos(0.6) * pulse, np.sin(0.6) * pulse, np.zeros(nbin)])
+    assert corrected.dedispersed
+    assert np.allclose(corrected.data, expected[np.newaxis, :, np.newaxis], atol=1e-3)
+    with fits.open(output) as hdul:
+        assert hdul["HISTORY"].data["RM_CORR"][-1] == 1 and hdul["HISTORY"].data["DEDISP"][-1] == 1
+        assert hdul["SUBINT"].header["RM"] == rm
+
+    # Rotating the coherence products is the same as rotating the Stokes parameters
+    coherence = np.stack([(stokes[0] + stokes[1]) / 2, (stokes[0] - stokes[1]) / 2, stokes[2] / 2, stokes[3] / 2])
+    coherence = np.tile(coherence[:, :, np.newaxis] * pulse, (nsub, 1, 1, 1))
+    archive = write_psrfits(os.path.join(tmp_path, "coherence.ar"), coherence, freqs=freqs, dm=0.)
+    stokes_corrected = correct_cube(ArchiveCube.load(archive), rm=rm).convert_to_stokes()
+    assert np.allclose(stokes_corrected.data, expected[np.newaxis, :, np.newaxis], atol=1e-3)
+
+    # A total intensity archive can't be Faraday corrected, so only the DM correction is recorded
+    archive = write_psrfits(os.path.join(tmp_path, "inten.ar"), data[:, :1], freqs=freqs, pol_type="INTEN", dm=dm, period=period)
+    output = os.path.join(tmp_path, "inten.corrected.ar")
+    assert correct_archive(archive, output, rm=rm) is None
+    with fits.open(output) as hdul:
+        assert hdul["HISTORY"].data["RM_CORR"][-1] == 0 and hdul["HISTORY"].data["DEDISP"][-1] == 1
+        assert hdul["SUBINT"].header["RM"] == 0.
+        assert "-R" not in hdul["HISTORY"].data["PROC_CMD"][-1]
+    assert np.allclose(ArchiveCube.load(output).data, pulse, atol=1e-3)
@@ -0,0 +1,71 @@
+import os
+import numpy as np
+
+from meerpipe.archive_cube import ArchiveCube
+from meerpipe.profile_utils import DISPERSION_CONSTANT
+from meerpipe.decimate import parse_decimation_products, is_nested, decimate_archive
+from tests.synthetic_psrfits import gaussian_pulse, write_psrfits
+
+
+def test_parse_decimation_products(tmp_path):
+    list_file = os.path.join(tmp_path, "decimation.list")
+    with open(list_file, "w") as f:
+        f.write("# nsub nchan stokes_op\n1 1 p\n32 16\nmax 32 S\n")
+    assert parse_decimation_products(list_file) == [(1, 1, "p"), (32, 16, "S"), ("max", 32, "S")]
+    assert parse_decimation_products("1 1 p, 1 16") == [(1, 1, "p"), (1, 16, "S")]
+
+
+def test_is_nested():
+    assert is_nested(64, 16, 4)
+    assert is_nested(64, 64, 3)
+    assert not is_nested(10, 4, 3)
+
+
+def test_decimate_archive(tmp_path):
+    rng = np.random.default_rng(1)
+    nsub, nchan, nbin = 8, 16, 64
+    data = rng.normal(0., 1., (nsub, 4, nchan, nbin)) + 10. * gaussian_pulse(nbin)
+    weights = rng.uniform(0.5, 1., (nsub, nchan))
+    archive = write_psrfits(os.path.join(tmp_path, "obs_zap.ar"), data, weights=weights)
+
+    outputs = decimate_archive(archive, ["1 1 p", "1 4 S", "4 16 S", "2 4 S"], output_dir=os.path.join(tmp_path, "decimated"))
+    assert [os.path.basename(output) for output in outputs] == [
+        "obs_zap.1ch1p1t.ar",
+        "obs_zap.4ch4p1t.ar",
+        "obs_zap.16ch4p4t.ar",
+        "obs_zap.4ch4p2t.ar",
+    ]
+
+    cube = ArchiveCube.load(archive)
+    for output, (nsub, nchan, npol) in zip(outputs, [(1, 1, 1), (1, 4, 4), (4, 16, 4), (2, 4, 4)]):
+        product = ArchiveCube.load(output)
+        # Products from the pyramid match decimating the archive directly
+        expected = cube.scrunch(nsub=nsub, nchan=nchan).convert_to_stokes()
+        if npol == 1:
+            expected = expected.pscrunch()
+        assert product.shape == (nsub, npol, nchan, nbin)
+        assert product.pol_type == ("INTEN" if npol == 1 else "IQUV")
+        # Dedispersing with sub-bin shifts can't keep the Nyquist harmonic, so the intermediate products
+        # only reproduce the direct scrunch below it
+        assert np.allclose(np.fft.rfft(product.data)[..., :-1], np.fft.rfft(expected.data)[..., :-1], atol=1e-2)
+        assert np.allclose(product.weights, expected.weights)
+        assert np.allclose(product.freqs, expected.freqs)
+        assert np.isclose(product.length, cube.length)
+
+
+def test_decimate_dispersed_archive(tmp_path):
+    # The channels are dedispersed when they are combined, so the frequency scrunched pulse isn't smeared
+    nsub, nchan, nbin = 2, 16, 128
+    dm, period = 30., 0.005
+    freqs = np.linspace(900., 1600., nchan)
+    delays = DISPERSION_CONSTANT * dm * (freqs ** -2 - freqs.mean() ** -2) / period
+    profiles = np.array([gaussian_pulse(nbin, centre=(0.5 + delay) % 1.) for delay in delays])
+    data = np.broadcast_to(profiles, (nsub, 1, nchan, nbin)).copy()
+    archive = write_psrfits(os.path.join(tmp_path, "obs_zap.ar"), data, freqs=freqs, pol_type="AA+BB", dm=dm, period=period)
+
+    outputs = decimate_archive(archive, ["1 4 p", "1 1 p"], output_dir=os.path.join(tmp_path, "decimated"))
+    product = ArchiveCube.load(outputs[1])
+    assert product.shape == (1, 1, 1, nbin)
+    # The delayed pulses are sampled rather than shifted, so they only match to about a percent
+    assert np.allclose(product.data[0, 0, 0], gaussian_pulse(nbin), atol=2e-2)
+    assert profiles.mean(axis=0).max() < 0.5
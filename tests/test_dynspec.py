@@ -0,0 +1,47 @@
+import os
+import numpy as np
+
+from meerpipe.dynspec import template_flux, dynamic_spectrum, write_psrflux_dynspec
+from meerpipe.profile_utils import DISPERSION_CONSTANT, fft_shift_profiles
+from tests.synthetic_psrfits import gaussian_pulse, write_psrfits
+
+
+def test_template_flux():
+    rng = np.random.default_rng(6)
+    template = gaussian_pulse(128)
+    gains = rng.uniform(0., 5., (20, 3))
+    profiles = gains[..., np.newaxis] * template + 2. + rng.normal(0., 0.1, (20, 3, 128))
+    scale, scale_err = template_flux(profiles, template)
+    assert np.allclose(scale, gains, atol=5 * scale_err)
+    assert np.allclose(scale_err, 0.1 / np.sqrt(np.sum((template - template.mean()) ** 2)), rtol=0.3)
+
+
+def test_dynamic_spectrum(tmp_path):
+    rng = np.random.default_rng(7)
+    nsub, nchan, nbin = 5, 16, 128
+    dm, period = 20., 0.005
+    freqs = np.linspace(900., 1600., nchan)
+    gains = rng.uniform(1., 3., (nsub, nchan))
+    # Dispersed pulses scaled by a scintillation pattern
+    delays = DISPERSION_CONSTANT * dm * (freqs ** -2 - freqs.mean() ** -2) / period
+    pulses = fft_shift_profiles(np.tile(gaussian_pulse(nbin, centre=0.3), (nchan, 1)), delays * nbin)
+    data = gains[:, np.newaxis, :, np.newaxis] * pulses + rng.normal(0., 0.05, (nsub, 1, nchan, nbin))
+    weights = np.ones((nsub, nchan))
+    weights[2, 4] = 0.
+    archive = write_psrfits(os.path.join(tmp_path, "scint.ar"), data, weights=weights, freqs=freqs, pol_type="AA+BB", dm=dm, period=period)
+
+    # A template at a different phase and resolution
+    flux, flux_err, cube = dynamic_spectrum(archive, gaussian_pulse(256, centre=0.6))
+    assert np.isclose(cube.centre_frequency, freqs.mean())
+    expected = gains * np.mean(gaussian_pulse(nbin))
+    assert flux[2, 4] == 0. and flux_err[2, 4] == 0.
+    good = weights > 0.
+    assert np.allclose(flux[good], expected[good], rtol=0.05)
+
+    dynspec_file = os.path.join(tmp_path, "scint.ar.dynspec")
+    write_psrflux_dynspec(dynspec_file, cube, flux, flux_err)
+    rows = np.loadtxt(dynspec_file)
+    assert rows.shape == (nsub * nchan, 6)
+    assert np.allclose(rows[:, 4].reshape(nsub, nchan), flux, rtol=1e-5)
+    with open(dynspec_file) as f:
+        assert any(line.startswith("# MJD0:") for line in f)
@@ -0,0 +1,32 @@
+from meerpipe.entry_points import CONSOLE_SCRIPTS
+from meerpipe.import_benchmark import parse_importtime, lazy_violations, benchmark_entry_points, THRESHOLDS
+
+
+def test_parse_importtime():
+    stderr = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       120 |        120 |     numpy._core",
+        "import time:      2000 |       2120 |   numpy",
+        "import time:       300 |       2420 | meerpipe.toa_select",
+        "Traceback (most recent call last):",
+    ])
+    imports = parse_importtime(stderr)
+    assert [entry[0] for entry in imports] == ["numpy._core", "numpy", "meerpipe.toa_select"]
+    assert [entry[3] for entry in imports] == [2, 1, 0]
+    assert abs(imports[2][2] - 2.42e-3) < 1e-9
+    assert lazy_violations("toa_select", ["numpy", "matplotlib.pyplot"]) == ["matplotlib"]
+    assert lazy_violations("plot_global_residuals", ["numpy", "matplotlib.pyplot"]) == []
+
+
+def test_benchmark_entry_points():
+    # Every console script has a budget, imports within it and defers its heavy imports
+    assert set(THRESHOLDS) == set(CONSOLE_SCRIPTS)
+    report = benchmark_entry_points(repeat=3)
+    assert set(report) == set(CONSOLE_SCRIPTS)
+    for script, result in report.items():
+        assert result["error"] is None, script
+        assert result["lazy_violations"] == [], script
+        assert 0. < result["seconds"] <= THRESHOLDS[script], (script, result["seconds"], result["slowest"])
+        assert result["passed"]
+    report = benchmark_entry_points(["toa_select"], thresholds={"toa_select": 0.}, repeat=1)
+    assert not report["toa_select"]["passed"]
@@ -0,0 +1,57 @@
+import os
+import shutil
+import logging
+import pytest
+import numpy as np
+from PIL import Image
+
+from meerpipe.scripts import make_stokes_movie
+from meerpipe.scripts.make_stokes_movie import make_profile_plot, extract_profiles
+from tests.synthetic_psrfits import gaussian_pulse
+
+
+def test_make_profile_plot(tmp_path, monkeypatch):
+    rng = np.random.default_rng(15)
+    nobs, nbin = 4, 128
+    pulse = gaussian_pulse(nbin, centre=0.4, width=0.05)
+    stokes = np.array([1., 0.6, 0.3, 0.2])[:, np.newaxis] * pulse
+    profile_data = stokes + rng.normal(0., 0.02, (nobs, 4, nbin))
+    utcs = [f"2023-01-0{i + 1}-00:00:00" for i in range(nobs)]
+
+    monkeypatch.chdir(tmp_path)
+    make_profile_plot(profile_data, utcs, writer="pillow")
+    # One frame per observation, the size of the static plot
+    with Image.open(os.path.join(tmp_path, "profile.png")) as png, Image.open(os.path.join(tmp_path, "profile.gif")) as gif:
+        assert gif.n_frames == nobs
+        assert gif.size == png.size
+
+
+def test_make_profile_plot_without_ffmpeg(tmp_path, monkeypatch, caplog):
+    nobs, nbin = 2, 64
+    profile_data = np.tile(gaussian_pulse(nbin), (nobs, 4, 1))
+    utcs = [f"2023-01-0{i + 1}-00:00:00" for i in range(nobs)]
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(shutil, "which", lambda name: None)
+    with caplog.at_level(logging.WARNING):
+        make_profile_plot(profile_data, utcs, writer="ffmpeg", logger=logging.getLogger("test_make_stokes_movie"))
+    assert "ffmpeg not found" in caplog.text
+    assert os.path.isfile(os.path.join(tmp_path, "profile.gif"))
+
+
+def fake_stokes_profile(archive):
+    # Stands in for the psrchive extraction, with the nbin in the file name
+    nbin = int(archive.split("_")[-1].split(".")[0])
+    return np.tile(gaussian_pulse(nbin), (4, 1)).astype(np.float32), 100.
+
+
+def test_extract_profiles_mixed_nbin(monkeypatch):
+    # The pool forks, so the workers see the patched extraction
+    monkeypatch.setattr(make_stokes_movie, "extract_stokes_profile", fake_stokes_profile)
+    archives = ["J0000+0000_2023-01-01-00:00:00_1024.ar", "J0000+0000_2023-01-02-00:00:00_1024.ar"]
+    profiles, sn = extract_profiles(archives, nproc=2)
+    assert profiles.shape == (2, 4, 1024)
+
+    mixed = archives + ["J0000+0000_2023-01-03-00:00:00_512.ar"]
+    with pytest.raises(ValueError, match="512 bins: J0000\\+0000_2023-01-03-00:00:00_512.ar"):
+        extract_profiles(mixed, nproc=2)
@@ -0,0 +1,50 @@
+import os
+import numpy as np
+
+from meerpipe.obs_stats import off_pulse_window, snr_pdmp, compute_obs_stats, write_obs_stats, load_obs_stats
+from meerpipe.scripts.fluxcal_meerkat import get_median_offrms
+from tests.synthetic_psrfits import gaussian_pulse, write_psrfits
+
+
+def test_snr_pdmp():
+    rng = np.random.default_rng(3)
+    nbin = 256
+    noise = rng.normal(0., 1., nbin)
+    pulse = 5. * gaussian_pulse(nbin, width=0.01)
+    off_mask = off_pulse_window(pulse + noise)
+    assert not np.any(off_mask[120:136])
+    snr = snr_pdmp(pulse + noise)
+    # Close to the matched filter S/N, allowing for the search over noisy boxcars
+    ideal = np.sqrt(np.sum(pulse ** 2))
+    assert 0.8 * ideal < snr < 1.6 * ideal
+    assert snr_pdmp(np.zeros(nbin)) == 0.
+
+
+def test_obs_stats_sidecar(tmp_path):
+    rng = np.random.default_rng(4)
+    nsub, nchan, nbin = 6, 8, 128
+    data = rng.normal(0., 1., (nsub, 1, nchan, nbin)) + 3. * gaussian_pulse(nbin)
+    weights = np.ones((nsub, nchan))
+    weights[:, 0] = 0.
+    weights[2, :] = 0.
+    archive = write_psrfits(os.path.join(tmp_path, "obs.ar"), data, weights=weights, pol_type="AA+BB")
+
+    stats, arrays = compute_obs_stats(archive)
+    assert stats["nsub"] == nsub
+    assert stats["length"] == nsub * 8.
+    assert np.isclose(stats["zap_fraction"], 1. - 5 * 7 / 48)
+    assert np.allclose(arrays["chan_zap_fraction"], [1.] + [1 / 6] * 7)
+    assert arrays["subint_zap_fraction"][2] == 1.
+    # Off-pulse rms of 5 averaged subints of unit noise, and NaN for the zapped channel
+    assert np.isnan(arrays["offrms"][0])
+    assert np.allclose(arrays["offrms"][1:], 1. / np.sqrt(5), rtol=0.3)
+    assert stats["sn"] > 10.
+
+    json_file = write_obs_stats(archive, stats, arrays)
+    loaded = load_obs_stats(json_file)
+    assert loaded["sn"] == stats["sn"]
+    assert np.array_equal(loaded["offrms"], arrays["offrms"], equal_nan=True)
+
+    # fluxcal leaves the zapped channel out of the median off-pulse rms
+    offrms_freq = dict(zip([1385., 1390., 1395.], arrays["offrms"][:3]))
+    assert np.isclose(get_median_offrms(offrms_freq, "LBAND"), np.median(arrays["offrms"][1:3]))
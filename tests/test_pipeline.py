@@ -0,0 +1,150 @@
+import os
+import json
+import importlib.util
+import pytest
+import numpy as np
+from astropy.io import fits
+
+import meerpipe
+from meerpipe import pipeline
+from meerpipe.entry_points import ENTRY_POINTS, CONSOLE_SCRIPTS, run_entry_point
+from meerpipe.pipeline import FileHasher, Stage, load_pipeline, stage_dependencies, run_pipeline
+from tests.synthetic_psrfits import gaussian_pulse, write_psrfits
+
+PYPROJECT = os.path.join(os.path.dirname(os.path.dirname(__file__)), "pyproject.toml")
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), "test_data")
+
+
+def poetry_scripts(pyproject=PYPROJECT):
+    # tomllib needs python 3.11, and the [tool.poetry.scripts] table only holds name = "target" lines
+    scripts = {}
+    in_scripts = False
+    with open(pyproject, "r") as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if line.startswith("["):
+                in_scripts = line == "[tool.poetry.scripts]"
+            elif in_scripts and "=" in line:
+                name, target = line.split("=", 1)
+                scripts[name.strip()] = target.strip().strip("\"'")
+    return scripts
+
+
+def test_entry_points():
+    scripts = poetry_scripts()
+    # Every console script is registered, and every one except the pipeline runner can be run as a task
+    assert CONSOLE_SCRIPTS == scripts
+    assert ENTRY_POINTS == {name: target for name, target in scripts.items() if name != "meerpipe"}
+    assert run_entry_point("obs_stats", ["--help"]) == 0
+    assert run_entry_point("obs_stats", []) == 2
+
+
+def test_run_pipeline(tmp_path):
+    rng = np.random.default_rng(13)
+    data = np.tile(gaussian_pulse(64), (4, 1, 8, 1)) + rng.normal(0., 0.1, (4, 1, 8, 64))
+    write_psrfits(os.path.join(tmp_path, "obs.ar"), data, pol_type="AA+BB", dm=0.)
+    with open(os.path.join(tmp_path, "decimate.cfg"), "w") as f:
+        f.write("decimation_products = 1 1\n")
+    pipeline_file = os.path.join(tmp_path, "pipeline.json")
+    with open(pipeline_file, "w") as f:
+        json.dump({
+            "variables": {"archive": "obs.ar"},
+            "stages": [
+                {"name": "stats", "entry_point": "obs_stats", "args": ["{archive}"],
+                 "inputs": ["{archive}"], "outputs": ["{archive}.stats.json", "{archive}.stats.npz"]},
+                {"name": "decimate", "entry_point": "decimate_archive", "args": ["{archive}", "-c", "decimate.cfg", "-o", "decimated"],
+                 "inputs": ["{archive}", "decimate.cfg"], "outputs": ["decimated/obs.1ch1p1t.ar"]},
+                {"name": "toas", "entry_point": "generate_toas", "args": ["decimated/obs.1ch1p1t.ar", "-t", "{archive}", "-o", "obs.tim", "-n", "1"],
+                 "inputs": ["decimated/obs.1ch1p1t.ar", "{archive}"], "outputs": ["obs.tim"]},
+                {"name": "broken", "entry_point": "calc_max_nsub", "args": [], "outputs": ["never.txt"]},
+                {"name": "after_broken", "entry_point": "obs_stats", "args": ["{archive}"], "after": ["broken"]},
+            ],
+        }, f)
+
+    stages, workdir = load_pipeline(pipeline_file)
+    status = run_pipeline(stages, workdir=workdir, nproc=2)
+    assert status == {"stats": "ran", "decimate": "ran", "toas": "ran", "broken": "failed", "after_broken": "skipped"}
+    assert os.path.isfile(os.path.join(tmp_path, "obs.tim"))
+
+    # Nothing changed so everything that succeeded is cached
+    status = run_pipeline(stages, workdir=workdir, nproc=2)
+    assert status["stats"] == status["decimate"] == status["toas"] == "cached"
+
+    # Changing the decimation config only reruns the stages downstream of it
+    with open(os.path.join(tmp_path, "decimate.cfg"), "w") as f:
+        f.write("# One product\ndecimation_products = 1 1\n")
+    status = run_pipeline(stages, workdir=workdir, nproc=2)
+    assert status["stats"] == "cached" and status["decimate"] == "ran"
+
+
+def pyproject_version(pyproject=PYPROJECT):
+    with open(pyproject, "r") as f:
+        for line in f:
+            if line.startswith("version"):
+                return line.split("=", 1)[1].strip().strip("\"'")
+
+
+def test_stage_key(tmp_path, monkeypatch):
+    assert meerpipe.__version__ == pyproject_version()
+    stage = Stage("max_nsub", "calc_max_nsub", args=["--sn", "100", "--nchan", "16", "--duration", "3840", "--input_nsub", "480"], stdout="obs.max_nsub")
+    assert stage.outputs == ["obs.max_nsub"]
+    status = run_pipeline([stage], workdir=tmp_path)
+    assert status == {"max_nsub": "ran"}
+    with open(os.path.join(tmp_path, "obs.max_nsub"), "r") as f:
+        assert f.read().startswith("max_")
+    assert run_pipeline([stage], workdir=tmp_path) == {"max_nsub": "cached"}
+
+    # A new meerpipe version (or a change to the entry point's script) invalidates the cached outputs
+    hasher = FileHasher()
+    key = stage.key(hasher, tmp_path)
+    monkeypatch.setattr(pipeline, "__version__", "0.0.0")
+    assert stage.key(hasher, tmp_path) != key
+    assert run_pipeline([stage], workdir=tmp_path) == {"max_nsub": "ran"}
+
+
+def undelayfixed_archive(archive, output):
+    # The test archives have already been delay corrected, which dlyfix refuses to do twice
+    with fits.open(archive) as hdul:
+        history = hdul["HISTORY"]
+        history.data = history.data[[not command.startswith("dlyfix") for command in history.data["PROC_CMD"]]]
+        hdul.writeto(output)
+
+
+def test_observation_pipeline(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    undelayfixed_archive(os.path.join(TEST_DATA_DIR, "J1644-4559_2019-08-07-15:41:45_zap.ar"), "J1644-4559.ar")
+    variables = {
+        "archive":    "J1644-4559.ar",
+        "obs":        "J1644-4559",
+        "nsub":       "8",
+        "psr_name":   "J1644-4559",
+        "obs_name":   "2019-08-07-15:41:45",
+        "obs_header": "obs.header",
+        "par_file":   "J1644-4559.par",
+        "template":   "J1644-4559.std",
+        "dm_file":    "dm.json",
+        "flux":       "1.",
+    }
+    with pytest.raises(ValueError, match="dm_file"):
+        load_pipeline("observation", {name: value for name, value in variables.items() if name != "dm_file"})
+    stages, workdir = load_pipeline("observation", variables)
+    assert workdir == os.path.join(os.getcwd(), ".")
+    assert stage_dependencies(stages) == {
+        "dlyfix":        set(),
+        "chop":          {"dlyfix"},
+        "chopped_stats": {"chop"},
+        "fluxcal":       {"chop", "chopped_stats"},
+        "fluxcal_stats": {"fluxcal"},
+        "max_nsub":      {"fluxcal_stats"},
+        "snr_archive":   {"fluxcal"},
+        "images":        {"fluxcal", "fluxcal_stats", "snr_archive"},
+    }
+    assert {stage.entry_point for stage in stages} <= set(ENTRY_POINTS)
+
+    status = run_pipeline(stages, workdir=workdir, nproc=2)
+    assert status["dlyfix"] == "ran"
+    assert os.path.isfile("J1644-4559_dly.ar")
+    if importlib.util.find_spec("psrchive") is None:
+        # Chopping the edge channels needs psrchive so nothing downstream of it can run
+        assert status["chop"] == "failed"
+        assert all(status[stage.name] == "skipped" for stage in stages if stage.name not in ("dlyfix", "chop"))
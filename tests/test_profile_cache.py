@@ -0,0 +1,52 @@
+import os
+import numpy as np
+
+from meerpipe.profile_cache import (
+    profile_cache_file,
+    load_profile_cache,
+    save_profile_cache,
+    stale_archives,
+    update_profile_cache,
+    select_cached_profiles,
+)
+
+
+def test_profile_cache(tmp_path):
+    archives = []
+    for i in range(3):
+        archive = os.path.join(tmp_path, f"J0000+0000_2023-01-0{i+1}-00:00:00_zap.ar")
+        with open(archive, 'w') as f:
+            f.write("archive")
+        archives.append(archive)
+    profiles = np.random.default_rng(0).normal(size=(3, 4, 64)).astype(np.float32)
+    utcs = [archive.split("/")[-1].split("_")[1] for archive in archives]
+
+    cache_file = profile_cache_file(tmp_path, "J0000+0000")
+    cache = load_profile_cache(cache_file)
+    assert stale_archives(cache, archives) == archives
+
+    cache = update_profile_cache(cache, archives[:2], profiles[:2], [30., 40.], utcs[:2])
+    save_profile_cache(cache_file, cache)
+    cache = load_profile_cache(cache_file)
+    assert stale_archives(cache, archives) == archives[2:]
+
+    # Changing an archive makes it stale again
+    with open(archives[0], 'a') as f:
+        f.write("changed")
+    stale = stale_archives(cache, archives)
+    assert stale == [archives[0], archives[2]]
+
+    cache = update_profile_cache(cache, stale, profiles[[0, 2]], [35., 50.], [utcs[0], utcs[2]])
+    assert stale_archives(cache, archives) == []
+    assert len(cache["paths"]) == 3
+
+    cached_profiles, sn, cached_utcs = select_cached_profiles(cache, archives)
+    assert np.array_equal(cached_profiles, profiles)
+    assert list(sn) == [35., 40., 50.]
+    assert cached_utcs == utcs
+
+    # A new number of bins drops the old profiles, so the other archives have to be reloaded
+    cache = update_profile_cache(cache, archives[:1], np.zeros((1, 4, 128), dtype=np.float32), [35.], utcs[:1])
+    assert stale_archives(cache, archives) == archives[1:]
+    cache = update_profile_cache(cache, archives[1:], np.ones((2, 4, 128), dtype=np.float32), [40., 50.], utcs[1:])
+    assert select_cached_profiles(cache, archives)[0].shape == (3, 4, 128)
@@ -0,0 +1,49 @@
+import numpy as np
+
+from meerpipe.profile_utils import fft_shift_profiles, cross_correlation_shifts, align_profiles
+
+
+def gaussian_profiles(centres, nbin=256, width=0.02):
+    phase = np.arange(nbin) / nbin
+    return np.exp(-0.5 * ((phase - np.asarray(centres)[:, np.newaxis]) / width) ** 2)
+
+
+def test_fft_shift_profiles():
+    profiles = gaussian_profiles([0.3, 0.3])
+    shifted = fft_shift_profiles(profiles, [25.6, -12.8])
+    expected = gaussian_profiles([0.4, 0.25])
+    assert np.allclose(shifted, expected, atol=1e-6)
+
+
+def test_cross_correlation_shifts():
+    nbin = 256
+    rng = np.random.default_rng(1)
+    true_shifts = rng.uniform(-100., 100., 50)
+    template = gaussian_profiles([0.5], nbin=nbin)[0]
+    profiles = fft_shift_profiles(np.tile(template, (50, 1)), true_shifts)
+    profiles += rng.normal(0., 0.05, profiles.shape)
+
+    shifts = cross_correlation_shifts(profiles, template)
+    assert np.all(np.abs(shifts - true_shifts) < 0.5)
+
+
+def test_align_profiles():
+    nbin = 256
+    rng = np.random.default_rng(2)
+    # Double peaked profile where the brightest peak changes with noise
+    template = gaussian_profiles([0.45], nbin=nbin)[0] + 0.95 * gaussian_profiles([0.55], nbin=nbin)[0]
+    true_shifts = rng.uniform(-50., 50., 20)
+    stokes = np.zeros((20, 4, nbin))
+    stokes[:, 0] = fft_shift_profiles(np.tile(template, (20, 1)), true_shifts)
+    stokes[:, 1] = 0.5 * stokes[:, 0]
+    stokes += rng.normal(0., 0.02, stokes.shape)
+
+    aligned, shifts = align_profiles(stokes)
+    # All observations are shifted by the same amount relative to the truth
+    offset = shifts + true_shifts
+    assert np.all(np.abs(offset - np.mean(offset)) < 0.1)
+    assert np.allclose(aligned[:, 1], 0.5 * aligned[:, 0], atol=0.2)
+
+    aligned, shifts = align_profiles(stokes, template=template)
+    offset = shifts + true_shifts
+    assert np.all(np.abs(offset - np.mean(offset)) < 0.1)
@@ -0,0 +1,74 @@
+import os
+import time
+import glob
+import pstats
+import numpy as np
+
+from meerpipe.utils import PROFILE_ENV, TIMINGS_ENV
+from meerpipe.profiling import StackSampler
+from meerpipe.entry_points import run_entry_point
+from tests.synthetic_psrfits import gaussian_pulse, write_psrfits
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), "test_data")
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def _inner():
+    _busy(0.2)
+
+
+def _outer():
+    _inner()
+    _busy(0.1)
+
+
+def test_stack_sampler():
+    sampler = StackSampler(interval=0.002)
+    sampler.start()
+    _outer()
+    sampler.stop()
+    stacks = sampler.collapsed_stacks()
+    inner = sum(time for stack, time in stacks.items() if "_outer" in stack and "_inner" in stack)
+    outer = sum(time for stack, time in stacks.items() if "_outer" in stack and "_inner" not in stack)
+    # Sampling is approximate, but the split between the two calls should be roughly 2:1
+    assert 1e5 < inner < 3e5
+    assert 3e4 < outer < 2e5
+    assert all(stack.split(";")[-1].startswith("_busy") for stack in stacks if "_outer" in stack)
+
+
+def test_profiled_entry_point(tmp_path, monkeypatch):
+    profile_dir = os.path.join(tmp_path, "profiles")
+    monkeypatch.setenv(PROFILE_ENV, profile_dir)
+    monkeypatch.setenv(TIMINGS_ENV, "0")
+    archive = os.path.join(tmp_path, "obs.ar")
+    write_psrfits(archive, np.tile(gaussian_pulse(64), (2, 1, 4, 1)), pol_type="AA+BB", dm=0.)
+    assert run_entry_point("obs_stats", [archive]) == 0
+
+    assert len(glob.glob(os.path.join(profile_dir, f"obs_stats.{os.getpid()}.prof"))) == 1
+    with open(os.path.join(profile_dir, f"obs_stats.{os.getpid()}.collapsed"), "r") as f:
+        lines = f.read().splitlines()
+    assert any("compute_obs_stats" in line for line in lines)
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+
+
+def test_profiled_decimate(tmp_path, monkeypatch):
+    # A real archive through the decimation pyramid has a large call graph (astropy, numpy, ...)
+    profile_dir = os.path.join(tmp_path, "profiles")
+    monkeypatch.setenv(PROFILE_ENV, profile_dir)
+    monkeypatch.setenv(TIMINGS_ENV, "0")
+    archive = os.path.join(TEST_DATA, "J1644-4559_2019-08-07-15:41:45_zap.ar")
+    start = time.perf_counter()
+    assert run_entry_point("decimate_archive", [archive, "-p", "1 1 p", "1 4 S", "-o", os.path.join(tmp_path, "decimated")]) == 0
+    assert time.perf_counter() - start < 60.
+
+    stem = os.path.join(profile_dir, f"decimate_archive.{os.getpid()}")
+    assert len(pstats.Stats(f"{stem}.prof").stats) > 500
+    with open(f"{stem}.collapsed", "r") as f:
+        lines = f.read().splitlines()
+    assert any("decimate_archive (decimate.py" in line for line in lines)
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
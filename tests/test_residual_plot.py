@@ -0,0 +1,59 @@
+import os
+import numpy as np
+
+from meerpipe.residuals import ResidualStore
+from meerpipe.residual_plot import BinnedResiduals, plot_residuals, update_global_residual_plot
+
+
+def test_binned_residuals_merge(tmp_path):
+    rng = np.random.default_rng(10)
+    mjd = np.sort(rng.uniform(58000., 60000., 5000))
+    err = rng.uniform(0.5, 2., mjd.size)
+    residual = rng.normal(0., err)
+
+    whole = BinnedResiduals(58000., 1., npix=100)
+    whole.update(mjd, residual, err)
+    # Updating observation by observation, extending the span and merging bins, gives the same statistics
+    split = BinnedResiduals(59000., 0.1, npix=100)
+    for part in np.array_split(np.arange(mjd.size), 7)[::-1]:
+        split.update(mjd[part], residual[part], err[part])
+    assert split.nbin < 200 and split.stats["count"].sum() == mjd.size
+
+    cache_file = os.path.join(tmp_path, "binned.npz")
+    split.save(cache_file)
+    split = BinnedResiduals.load(cache_file)
+    summary = split.summary()
+    assert np.isclose(np.sum(summary["count"] * summary["mean"]), residual.sum())
+    assert summary["min"].min() == residual.min() and summary["max"].max() == residual.max()
+    first = (mjd >= split.edges[0]) & (mjd < split.edges[1])
+    assert np.isclose(summary["wmean"][0], np.sum(residual[first] / err[first] ** 2) / np.sum(err[first] ** -2))
+
+    # The number of points drawn depends on the number of pixels, not ToAs
+    ax = plot_residuals(whole, {"mjd": mjd[-10:], "residual": residual[-10:], "err": err[-10:]})
+    assert len(ax.lines[0].get_xdata()) == len(whole.summary()["mjd"]) <= 2 * whole.npix
+
+
+def test_update_global_residual_plot(tmp_path):
+    rng = np.random.default_rng(11)
+    store_dir = os.path.join(tmp_path, "J0000+0000")
+    store = ResidualStore(store_dir)
+    for i in range(4):
+        mjd = 58000. + 30. * i + rng.uniform(0., 0.1, 50)
+        store.append({"bat": mjd, "post": rng.normal(0., 1e-6, 50), "err": np.ones(50)}, source=f"obs{i}")
+
+    image = os.path.join(tmp_path, "residuals.png")
+    binned = update_global_residual_plot(store_dir, image, npix=50)
+    assert os.path.isfile(image)
+    assert binned.sources == ["obs0", "obs1", "obs2"] and binned.stats["count"].sum() == 150
+
+    # The next observation only adds the previous latest observation to the cache
+    store.append({"bat": 58200. + np.zeros(5), "post": np.zeros(5), "err": np.ones(5)}, source="obs4")
+    binned = update_global_residual_plot(store_dir, image, npix=50)
+    assert binned.sources == ["obs0", "obs1", "obs2", "obs3"] and binned.stats["count"].sum() == 200
+
+    # Replacing the residuals of a cached observation rebuilds the statistics from the new shard
+    store.append({"bat": 58030. + np.zeros(10), "post": np.zeros(10), "err": np.ones(10)}, source="obs1")
+    binned = update_global_residual_plot(store_dir, image, latest_source="obs4", npix=50)
+    assert sorted(binned.sources) == ["obs0", "obs1", "obs2", "obs3"] and binned.stats["count"].sum() == 160
+    store = ResidualStore(store_dir)
+    assert sorted(binned.shards) == sorted(shard for source, shard in zip(store.sources, store.shard_files) if source != "obs4")
@@ -0,0 +1,44 @@
+import os
+import numpy as np
+
+from meerpipe.residuals import parse_general2, read_general2, ResidualStore
+
+
+GENERAL2_LINES = [
+    "Starting general2 plugin",
+    "58000.1000000001 1.5e-06 0.8 1284.0 0.0003 -snr 12.5 -f KAT_MKBF -chan 0",
+    "58000.1000000002 -2.0e-06 1.1 1390.0 -0.0004 -snr 9.0 -f KAT_MKBF",
+    "58000.1000000003 0.5e-06 0.9 1500.0 0.0001 -f KAT_MKBF -chan 2",
+    "Finished general2 plugin",
+]
+
+
+def test_parse_general2():
+    residuals = parse_general2(GENERAL2_LINES)
+    assert np.allclose(residuals["post"], [1.5e-6, -2e-6, 0.5e-6])
+    assert residuals["freq"].dtype == np.float64
+    # Flags which a ToA doesn't have are NaN or empty
+    assert np.isnan(residuals["snr"][2]) and residuals["snr"][0] == 12.5
+    assert np.isnan(residuals["chan"][1])
+    assert residuals["f"].dtype.kind == "U" and list(residuals["f"]) == ["KAT_MKBF"] * 3
+
+
+def test_residual_store(tmp_path):
+    residual_file = os.path.join(tmp_path, "obs1.residual")
+    with open(residual_file, "w") as f:
+        f.write("\n".join(GENERAL2_LINES) + "\n")
+    store = ResidualStore(os.path.join(tmp_path, "J0000+0000"))
+    store.append_file(residual_file)
+    store.append({"bat": np.array([58100., 58101.]), "post": np.array([1e-6, 2e-6]), "f": np.array(["KAT_PTUSE"] * 2)}, source="obs2")
+    # Appending the same source replaces it
+    store.append_file(residual_file)
+    assert len(store) == 5 and len(store.manifest["shards"]) == 2
+
+    # A reopened store reads only the requested columns, filling those a shard lacks
+    store = ResidualStore(os.path.join(tmp_path, "J0000+0000"))
+    residuals = store.read(columns=["post", "snr", "f"])
+    assert set(residuals) == {"post", "snr", "f"}
+    assert np.allclose(np.sort(residuals["post"]), np.sort(np.concatenate([read_general2(residual_file)["post"], [1e-6, 2e-6]])))
+    assert np.count_nonzero(np.isnan(residuals["snr"])) == 3
+    residuals = store.read(columns=["post", "f"], mjd_range=(58050., 58100.5))
+    assert list(residuals["f"]) == ["KAT_PTUSE"] and np.allclose(residuals["post"], [1e-6])
@@ -0,0 +1,55 @@
+import os
+import json
+import numpy as np
+
+from meerpipe.scintillation import acf_2d, fit_scint_params, save_refilled, refill, batch_scintillation, update_results_json
+
+
+def scintillated_dynspec(rng, nchan, nsub, width, tau):
+    """
+    Intensity of a complex gaussian field with an exponential frequency and 5/3 power time ACF.
+    """
+    chan_lag = np.minimum(np.arange(nchan), nchan - np.arange(nchan))
+    time_lag = np.minimum(np.arange(nsub), nsub - np.arange(nsub))
+    field_acf = np.exp(-chan_lag[:, np.newaxis] / (2 * width)) * np.exp(-0.5 * (time_lag[np.newaxis] / tau) ** (5. / 3.))
+    power = np.clip(np.fft.fft2(field_acf).real, 0., None)
+    noise = rng.normal(size=(nchan, nsub)) + 1j * rng.normal(size=(nchan, nsub))
+    return np.abs(np.fft.ifft2(np.fft.fft2(noise) * np.sqrt(power))) ** 2
+
+
+def test_acf_2d():
+    dyn = np.random.default_rng(8).normal(size=(16, 8))
+    acf = acf_2d(dyn)
+    assert acf.shape == (31, 15)
+    assert acf[15, 7] == 1.
+    assert np.allclose(acf, acf[::-1, ::-1])
+
+
+def test_fit_scint_params():
+    rng = np.random.default_rng(9)
+    dyn = scintillated_dynspec(rng, 512, 256, 8, 6)
+    dyn[rng.uniform(size=dyn.shape) < 0.1] = 0.
+    params = fit_scint_params(dyn, 0.5, 8.)
+    # Half width at half maximum of exp(-lag / width) and the 1/e timescale
+    assert np.isclose(params["dnu"], 8 * np.log(2) * 0.5, rtol=0.25)
+    assert np.isclose(params["tau"], 6 * 8., rtol=0.25)
+
+
+def test_batch_scintillation(tmp_path):
+    rng = np.random.default_rng(10)
+    files = []
+    for i, width in enumerate([4, 16]):
+        files.append(os.path.join(tmp_path, f"obs{i}.dynspec.refilled.npz"))
+        save_refilled(files[-1], refill(scintillated_dynspec(rng, 256, 64, width, 4)), 1., 8.)
+    params = batch_scintillation(files, nproc=2)
+    assert [param["file"] for param in params] == files
+    assert params[0]["dnu"] < params[1]["dnu"]
+
+    results_file = os.path.join(tmp_path, "results.json")
+    with open(results_file, "w") as f:
+        json.dump({"sn": 10.}, f)
+    update_results_json(results_file, params[0])
+    with open(results_file) as f:
+        results = json.load(f)
+    assert results["sn"] == 10.
+    assert results["scint_bandwidth"] == params[0]["dnu"]
@@ -0,0 +1,34 @@
+import os
+import sys
+import pytest
+import subprocess
+
+from meerpipe.scratch import SCRATCH_ENV, scratch_dir, choose_scratch_root
+
+
+def test_scratch_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv(SCRATCH_ENV, str(tmp_path))
+    with scratch_dir("snr") as first, scratch_dir("snr") as second:
+        assert first != second
+        assert os.path.dirname(first) == str(tmp_path)
+        with open(os.path.join(first, "zaptemp.ar"), "w") as f:
+            f.write("temporary")
+    assert not os.path.exists(first) and not os.path.exists(second)
+
+    with pytest.raises(ValueError):
+        with scratch_dir("snr") as path:
+            raise ValueError
+    assert not os.path.exists(path)
+
+    # Locations without room are skipped
+    assert choose_scratch_root(0) == str(tmp_path)
+    assert choose_scratch_root(1 << 62) == os.getcwd()
+
+
+def test_make_scratch_dir_cleanup(tmp_path):
+    code = "from meerpipe.scratch import make_scratch_dir; print(make_scratch_dir('template'))"
+    env = dict(os.environ, **{SCRATCH_ENV: str(tmp_path)})
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    path = result.stdout.strip()
+    assert os.path.dirname(path) == str(tmp_path)
+    assert not os.path.exists(path)
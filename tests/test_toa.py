@@ -0,0 +1,165 @@
+import os
+import shutil
+import pytest
+import numpy as np
+
+from meerpipe.utils import run_command
+from meerpipe.toa_select import TimFile
+from meerpipe.archive_cube import ArchiveCube
+from meerpipe.entry_points import run_entry_point
+from meerpipe.toa import Template, fftfit, archive_toas, format_tim_lines, write_tim
+from meerpipe.predictor import ChebyPredictor
+from meerpipe.profile_utils import fft_shift_profiles, DISPERSION_CONSTANT
+from tests.synthetic_psrfits import gaussian_pulse, write_psrfits
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), 'test_data')
+PAT_ARCHIVE = os.path.join(TEST_DATA_DIR, "J1644-4559_2019-08-07-15:41:45_zap.ar")
+# The ToAs of pat -A PGS -f tempo2 for the archive and template made by pat_test_files. When it isn't
+# committed the test runs pat itself, and is skipped if pat isn't installed
+PAT_REFERENCE = os.path.join(TEST_DATA_DIR, "J1644-4559_2019-08-07-15:41:45_zap.8ch.pat.tim")
+# The agreement with pat stated in meerpipe.toa, for ToAs with S/N > PAT_MIN_SNR
+PAT_TOLERANCE_SIGMA = 0.1
+PAT_TOLERANCE_US = 25.
+PAT_ERR_RTOL = 0.1
+PAT_MIN_SNR = 10.
+
+
+def test_fftfit():
+    rng = np.random.default_rng(8)
+    nbin, noise = 256, 0.05
+    template = Template(gaussian_pulse(512, centre=0.4, width=0.03))
+    shifts = rng.uniform(-20., 20., (40, 8))
+    profiles = 3. * fft_shift_profiles(np.tile(gaussian_pulse(nbin, centre=0.4, width=0.03), (40, 8, 1)), shifts)
+    profiles += 1. + rng.normal(0., noise, profiles.shape)
+
+    shift, shift_err, scale, snr = fftfit(profiles, template.spectrum(nbin))
+    # The template is resampled once and the uncertainties describe the scatter
+    assert list(template._spectra) == [nbin]
+    normalised = (shift - shifts) / shift_err
+    assert np.all(np.abs(normalised) < 5.)
+    assert 0.8 < np.std(normalised) < 1.2
+    assert np.allclose(scale, 3., rtol=0.02)
+    expected_snr = 3. * np.sqrt(np.sum((template.profile[::2] - template.profile[::2].mean()) ** 2)) / noise
+    assert np.isclose(np.median(snr), expected_snr, rtol=0.05)
+
+
+def test_archive_toas(tmp_path):
+    rng = np.random.default_rng(9)
+    nsub, nchan, nbin, period = 3, 4, 128, 0.005
+    shifts = rng.uniform(-5., 5., (nsub, nchan))
+    pulses = fft_shift_profiles(np.tile(gaussian_pulse(nbin, centre=0.3), (nsub, nchan, 1)), shifts)
+    data = pulses[:, np.newaxis] + rng.normal(0., 0.01, (nsub, 1, nchan, nbin))
+    weights = np.ones((nsub, nchan))
+    weights[1, 2] = 0.
+    archive = write_psrfits(os.path.join(tmp_path, "toa.ar"), data, weights=weights, pol_type="AA+BB", period=period, dm=0.)
+
+    toas = archive_toas(archive, Template(gaussian_pulse(nbin, centre=0.3), name="std"))
+    assert len(toas["imjd"]) == nsub * nchan - 1
+    # Without a predictor the ToAs are the subint epochs offset by the measured shifts
+    epochs = 43200. + (toas["subint"] + 0.5) * 8.
+    seconds = (toas["imjd"] - 60000) * 86400. + toas["frac"] * 86400.
+    expected = epochs + shifts[toas["subint"], toas["chan"]] / nbin * period
+    assert np.all(np.abs(seconds - expected) < 5 * toas["err"] * 1e-6 + 1e-9)
+
+    lines = format_tim_lines(toas)
+    assert "-snr" in lines[0].split() and "-tmplt std" in lines[0]
+    tim_file = os.path.join(tmp_path, "toa.tim")
+    write_tim(tim_file, [toas])
+    with open(tim_file) as f:
+        assert f.readline().strip() == "FORMAT 1"
+        assert len(f.readlines()) == len(lines)
+
+
+def test_dedispersed_archive_toas(tmp_path):
+    # The ToAs of a dedispersed archive are at each channel's frequency, like those of the dispersed archive
+    rng = np.random.default_rng(10)
+    nsub, nchan, nbin, period, dm = 2, 8, 128, 0.005, 20.
+    freqs = np.linspace(900., 1600., nchan)
+    delays = DISPERSION_CONSTANT * dm * (freqs ** -2 - freqs.mean() ** -2) / period * nbin
+    pulses = fft_shift_profiles(np.tile(gaussian_pulse(nbin, centre=0.3), (nsub, nchan, 1)), np.tile(delays, (nsub, 1)))
+    data = pulses[:, np.newaxis] + rng.normal(0., 0.01, (nsub, 1, nchan, nbin))
+    archive = write_psrfits(os.path.join(tmp_path, "dispersed.ar"), data, freqs=freqs, pol_type="AA+BB", period=period, dm=dm)
+    dedispersed = os.path.join(tmp_path, "dedispersed.ar")
+    ArchiveCube.load(archive).dedisperse().unload(dedispersed, history_updates={"DEDISP": 1})
+
+    template = Template(gaussian_pulse(nbin, centre=0.3), name="std")
+    toas, dedispersed_toas = archive_toas(archive, template), archive_toas(dedispersed, template)
+    # The fits of the dispersed profiles only know the delays modulo a turn
+    seconds = (toas["frac"] - dedispersed_toas["frac"]) * 86400.
+    seconds -= np.round(seconds / period) * period
+    assert np.all(np.abs(seconds) < 5 * np.hypot(toas["err"], dedispersed_toas["err"]) * 1e-6)
+    seconds = (dedispersed_toas["frac"] - dedispersed_toas["frac"][0]) * 86400.
+    assert np.allclose(seconds[:nchan], (delays - delays[0]) / nbin * period, atol=1e-5)
+
+
+def test_cheby_predictor():
+    # phase = 100 + 43200 (mjd - 60000.5) / 0.5, a 1 Hz pulsar (the constant term is halved twice)
+    lines = [
+        "ChebyModelSet 1 segments",
+        "ChebyModel BEGIN",
+        "PSRNAME J0000+0000",
+        "SITENAME meerkat",
+        "TIME_RANGE 60000 60001",
+        "FREQ_RANGE 800 1800",
+        "DISPERSION_CONSTANT 0",
+        "NCOEFF_TIME 3",
+        "NCOEFF_FREQ 2",
+        "COEFFS 400 0 86400 0",
+        "0 0",
+        "ChebyModel END",
+    ]
+    predictor = ChebyPredictor.parse(lines)
+    assert np.isclose(float(predictor.phase(60000, 0.5, 1000.)), 100.)
+    assert np.isclose(float(predictor.phase(60000, 0.75, 1000.)), 100. + 21600.)
+    assert np.isclose(predictor.frequency(60000, 0.5, 1000.), 1.)
+
+
+def test_cheby_predictor_archive():
+    archive = os.path.join(TEST_DATA_DIR, "J1644-4559_2019-08-07-15:41:45_zap.ar")
+    predictor = ChebyPredictor.from_archive(archive)
+    # The topocentric spin frequency of PSR J1644-4559 is within a Doppler shift of F0
+    assert abs(predictor.frequency(58702, 0.66, 1284.) / 2.1974 - 1.) < 2e-4
+
+
+def pat_test_files(directory):
+    """
+    Write the 8 channel archive and the fully scrunched template the pat comparison is made with.
+    """
+    cube = ArchiveCube.load(PAT_ARCHIVE)
+    archive = os.path.join(directory, "J1644-4559.8ch.ar")
+    template = os.path.join(directory, "J1644-4559.std")
+    cube.scrunch(nchan=8).unload(archive)
+    cube.scrunch(nsub=1, nchan=1).unload(template)
+    return archive, template
+
+
+def test_toas_match_pat(tmp_path):
+    archive, template = pat_test_files(tmp_path)
+    if os.path.isfile(PAT_REFERENCE):
+        pat = TimFile.read(PAT_REFERENCE)
+    elif shutil.which("pat") is not None:
+        pat_file = os.path.join(tmp_path, "pat.tim")
+        result = run_command(["pat", "-A", "PGS", "-f", "tempo2", "-s", template, archive], check=True)
+        with open(pat_file, "w") as f:
+            f.write(result.stdout)
+        pat = TimFile.read(pat_file)
+    else:
+        pytest.skip("pat isn't installed and there are no reference pat ToAs")
+
+    tim_file = os.path.join(tmp_path, "toas.tim")
+    assert run_entry_point("generate_toas", [archive, "-t", template, "-o", tim_file, "-n", "1"]) == 0
+    toas = TimFile.read(tim_file)
+    assert len(toas) == len(pat)
+    assert np.allclose(toas.freq, pat.freq, atol=1e-3)
+
+    # Difference the integer and fractional days separately to keep sub-microsecond precision
+    offset = np.array([
+        (int(ours.split()[2].split(".")[0]) - int(theirs.split()[2].split(".")[0])) * 86400e6 +
+        (float("0." + ours.split()[2].split(".")[1]) - float("0." + theirs.split()[2].split(".")[1])) * 86400e6
+        for ours, theirs in zip(toas.lines, pat.lines)
+    ])
+    bright = toas.column("-snr") > PAT_MIN_SNR
+    assert np.count_nonzero(bright) > 0
+    assert np.all(np.abs(offset[bright]) < PAT_TOLERANCE_US)
+    assert np.all(np.abs(offset[bright]) < PAT_TOLERANCE_SIGMA * pat.err[bright])
+    assert np.allclose(toas.err[bright], pat.err[bright], rtol=PAT_ERR_RTOL)
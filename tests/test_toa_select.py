@@ -0,0 +1,66 @@
+import os
+import numpy as np
+
+from meerpipe.toa_select import TimFile, parse_select, select_mask, snr_cut_masks
+
+SELECT_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "default_toa_logic.select")
+
+
+def write_tim(tim_file, snrs):
+    with open(tim_file, "w") as f:
+        f.write("FORMAT 1\n")
+        f.write("C a commented out ToA\n")
+        for i, snr in enumerate(snrs):
+            backend = "MKBF" if i % 2 else "PTUSE"
+            snr_flag = "" if snr is None else f" -snr {snr}"
+            f.write(f"obs{i}.ar {900 + 100 * i:.3f} 60000.{i:015d} 1.500 meerkat -be {backend}{snr_flag} -chan {i}\n")
+
+
+def test_select_mask(tmp_path):
+    tim_file = os.path.join(tmp_path, "test.tim")
+    snrs = [5., 12., None, 30., 9.9, 10.]
+    write_tim(tim_file, snrs)
+    tim = TimFile.read(tim_file)
+    assert len(tim) == len(snrs)
+    assert np.isnan(tim.column("-snr")[2])
+
+    # The default logic rejects low S/N ToAs, but not ToAs without an S/N
+    assert parse_select(SELECT_FILE) == [("REJECT", "-snr", "<", "10")]
+    assert list(select_mask(tim, parse_select(SELECT_FILE))) == [False, True, True, True, False, True]
+    mask = select_mask(tim, "LOGIC -snr < 10 REJECT\nLOGIC freq > 1200 REJECT\nPASS -be MKBF")
+    assert list(mask) == [False, True, False, True, False, False]
+
+    masks = snr_cut_masks(tim, [10., 20.])
+    assert list(masks[20.]) == [False, False, True, True, False, False]
+
+    tim.write(os.path.join(tmp_path, "filtered.tim"), mask)
+    filtered = TimFile.read(os.path.join(tmp_path, "filtered.tim"))
+    assert filtered.header == ["FORMAT 1", "C a commented out ToA"]
+    assert list(filtered.names) == ["obs1.ar", "obs3.ar"]
+    assert filtered.flags["-chan"][0] == "1"
+
+
+def test_write_keeps_commands(tmp_path):
+    # Commands, comments and blank lines between the ToAs are written back in place
+    tim_lines = [
+        "FORMAT 1",
+        "obs0.ar 900.000 60000.000000000000000 1.500 meerkat -snr 5",
+        "",
+        "JUMP",
+        "obs1.ar 1000.000 60000.000000000000001 1.500 meerkat -snr 20",
+        "obs2.ar 1100.000 60000.000000000000002 1.500 meerkat -snr 8",
+        "JUMP",
+        "# the last ToA",
+        "EFAC 1.2",
+        "obs3.ar 1200.000 60000.000000000000003 1.500 meerkat -snr 30",
+    ]
+    tim_file = os.path.join(tmp_path, "jump.tim")
+    with open(tim_file, "w") as f:
+        f.write("\n".join(tim_lines) + "\n")
+    tim = TimFile.read(tim_file)
+    assert len(tim) == 4
+    assert tim.header == ["FORMAT 1"]
+
+    tim.write(os.path.join(tmp_path, "filtered.tim"), select_mask(tim, "LOGIC -snr < 10 REJECT"))
+    with open(os.path.join(tmp_path, "filtered.tim"), "r") as f:
+        assert f.read().splitlines() == [line for line in tim_lines if not line.startswith(("obs0", "obs2"))]
@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import pytest
+import subprocess
+import numpy as np
+
+from meerpipe.utils import stage_timer, run_command, TIMINGS, TIMINGS_ENV, COMMAND_MEMO
+from meerpipe.entry_points import run_entry_point
+from tests.synthetic_psrfits import gaussian_pulse, write_psrfits
+
+
+def test_stage_timer(tmp_path):
+    timings = []
+    with stage_timer("write", timings=timings):
+        with open(os.path.join(tmp_path, "data.bin"), "wb") as f:
+            f.write(b"\0" * 1000000)
+    with stage_timer("sleep 0.1", kind="subprocess", timings=timings):
+        subprocess.run(["sleep", "0.1"], check=True)
+    try:
+        with stage_timer("broken", timings=timings):
+            raise ValueError
+    except ValueError:
+        pass
+
+    write, sleep, broken = timings
+    assert write["status"] == "ok" and write["kind"] == "stage"
+    assert write["write_bytes"] >= 1000000
+    assert write["peak_rss"] > 0
+    assert sleep["kind"] == "subprocess"
+    assert sleep["wall"] >= 0.1
+    assert broken["status"] == "failed"
+
+
+def test_instrumented_entry_point(tmp_path, monkeypatch):
+    timings_file = os.path.join(tmp_path, "timings.json")
+    monkeypatch.setenv(TIMINGS_ENV, timings_file)
+    archive = os.path.join(tmp_path, "obs.ar")
+    data = np.tile(gaussian_pulse(64), (2, 1, 4, 1))
+    write_psrfits(archive, data, pol_type="AA+BB", dm=0.)
+
+    # Argument errors and --help aren't recorded
+    assert run_entry_point("obs_stats", ["--help"]) == 0
+    assert not os.path.exists(timings_file)
+    assert run_entry_point("obs_stats", [archive]) == 0
+    assert run_entry_point("obs_stats", [archive]) == 0
+    with open(timings_file, "r") as f:
+        runs = json.load(f)
+    assert [run["name"] for run in runs] == ["obs_stats", "obs_stats"]
+    assert runs[0]["kind"] == "entry_point"
+    assert runs[0]["args"] == [archive]
+    assert runs[0]["status"] == "ok"
+    assert runs[0]["wall"] > 0.
+    assert runs[0]["read_bytes"] > 0
+
+    monkeypatch.setenv(TIMINGS_ENV, "0")
+    assert run_entry_point("obs_stats", [archive]) == 0
+    with open(timings_file, "r") as f:
+        assert len(json.load(f)) == 2
+
+
+def test_run_command(tmp_path):
+    script = os.path.join(tmp_path, "count.sh")
+    with open(script, "w") as f:
+        f.write("echo run >> \"$(dirname $0)/calls\"\nhead -c 200000 /dev/zero | tr '\\0' 'x'\ncat \"$1\"\n")
+    data = os.path.join(tmp_path, "data.txt")
+    with open(data, "w") as f:
+        f.write("one\n")
+    cache_dir = os.path.join(tmp_path, "cache")
+
+    def calls():
+        with open(os.path.join(tmp_path, "calls"), "r") as f:
+            return len(f.readlines())
+
+    # Large outputs are read without blocking, and the call is recorded in the timings
+    result = run_command(["sh", script, data], cache=True, cache_dir=cache_dir)
+    assert TIMINGS[-1]["kind"] == "subprocess" and TIMINGS[-1]["returncode"] == 0
+    assert result.returncode == 0
+    assert len(result.stdout) == 200000 + 4 and result.stdout.endswith("one\n")
+    assert run_command(["sh", script, data], cache=True, cache_dir=cache_dir).stdout == result.stdout
+    assert calls() == 1
+
+    # A new process reuses the on-disk cache, and changing the input reruns the command
+    COMMAND_MEMO.clear()
+    assert run_command(["sh", script, data], cache=True, cache_dir=cache_dir).stdout == result.stdout
+    assert calls() == 1
+    with open(data, "w") as f:
+        f.write("two words\n")
+    assert run_command(["sh", script, data], cache=True, cache_dir=cache_dir).stdout.endswith("two words\n")
+    assert calls() == 2
+
+    assert run_command("sh -c 'exit 3'").returncode == 3
+    with pytest.raises(subprocess.CalledProcessError):
+        run_command("sh -c 'exit 3'", check=True)
+
+
+LOGGING_SCRIPT = """
+import os
+import sys
+import logging
+from meerpipe.utils import setup_logging
+
+directory = sys.argv[1]
+logger = setup_logging(console=True, logfile=True, filedir=directory, level=logging.DEBUG, jsonfile=os.path.join(directory, "log.jsonl"))
+logger = setup_logging(console=True, logfile=True, filedir=directory, level=logging.DEBUG, jsonfile=os.path.join(directory, "log.jsonl"))
+assert len(logging.getLogger().handlers) == 1
+for subint in range(1000):
+    logger.debug(f"Subint {subint}")
+logger.info("parent")
+if os.fork() == 0:
+    logging.getLogger("child").info("child")
+    os._exit(0)
+os.wait()
+"""
+
+
+def test_setup_logging(tmp_path):
+    result = subprocess.run([sys.executable, "-c", LOGGING_SCRIPT, str(tmp_path)], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    # The console only shows INFO, each message once
+    console = result.stderr.splitlines()
+    assert sum("Console logger enabled" in line for line in console) == 1
+    assert sum(":: parent" in line for line in console) == 1
+    assert sum(":: child" in line for line in console) == 1
+    assert not any("Subint" in line for line in console)
+
+    with open(os.path.join(tmp_path, "meerpipe.log"), "r") as f:
+        assert sum("Subint" in line for line in f) == 1000
+    with open(os.path.join(tmp_path, "log.jsonl"), "r") as f:
+        records = [json.loads(line) for line in f]
+    debug = [record for record in records if record["level"] == "DEBUG"]
+    assert [record["message"] for record in debug] == [f"Subint {subint}" for subint in range(1000)]
+    assert {"child", "parent"} <= {record["message"] for record in records}
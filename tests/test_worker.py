@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+import subprocess
+import numpy as np
+
+from meerpipe.worker import _stdio_fds
+from tests.synthetic_psrfits import gaussian_pulse, write_psrfits
+
+REPO_DIR = os.path.dirname(os.path.dirname(__file__))
+
+
+def test_worker(tmp_path):
+    rng = np.random.default_rng(14)
+    data = np.tile(gaussian_pulse(64), (2, 1, 4, 1)) + rng.normal(0., 0.1, (2, 1, 4, 64))
+    write_psrfits(os.path.join(tmp_path, "obs.ar"), data, pol_type="AA+BB", dm=0.)
+    socket_path = os.path.join(tmp_path, "worker.sock")
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, MEERPIPE_WORKER_SOCKET=socket_path)
+    server = subprocess.Popen([sys.executable, "-m", "meerpipe.scripts.run", "worker"], env=env, cwd=REPO_DIR, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(300):
+            if os.path.exists(socket_path):
+                break
+            time.sleep(0.1)
+        assert os.path.exists(socket_path)
+        # Only the user that started the worker can connect to it
+        assert os.stat(socket_path).st_mode & 0o777 == 0o600
+
+        # The task runs in the client's directory and its output and exit code come back to the client
+        client = [sys.executable, "-m", "meerpipe.scripts.run", "call"]
+        result = subprocess.run(client + ["obs_stats", "obs.ar"], env=env, cwd=tmp_path, capture_output=True, text=True)
+        assert result.returncode == 0
+        assert result.stdout.strip() == "obs.ar.stats.json"
+        # The task's queued log records are emitted before it exits
+        assert "Computing observation statistics" in result.stderr
+        assert os.path.isfile(os.path.join(tmp_path, "obs.ar.stats.json"))
+
+        result = subprocess.run(client + ["obs_stats"], env=env, cwd=tmp_path, capture_output=True, text=True)
+        assert result.returncode == 2 and "usage" in result.stderr
+
+        # Only the registered entry points can be run, not any importable function
+        result = subprocess.run(client + ["meerpipe.scripts.obs_stats:main", "obs.ar"], env=env, cwd=tmp_path, capture_output=True, text=True)
+        assert result.returncode == 1 and "Unknown entry point" in result.stderr
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def test_stdio_fds(monkeypatch):
+    # Streams without a file descriptor are replaced by /dev/null, which the caller closes
+    monkeypatch.setattr(sys, "stdin", None)
+    fds, opened = _stdio_fds()
+    assert fds[0] == opened[0] and len(opened) == 1
+    assert os.readlink(f"/proc/self/fd/{opened[0]}") == os.devnull
+    os.close(opened[0])
@@ -0,0 +1,29 @@
+import os
+import numpy as np
+
+from meerpipe.zap_stats import run_length_encode, run_length_decode, zap_stats, archive_zap_stats
+from tests.synthetic_psrfits import write_psrfits
+
+
+def test_run_length_round_trip():
+    rng = np.random.default_rng(5)
+    mask = rng.uniform(size=(12, 32)) > 0.7
+    mask[-1, -4:] = True
+    runs = run_length_encode(mask)
+    assert runs[-1].sum() == mask.size
+    assert np.array_equal(run_length_decode(runs, mask.shape), mask)
+    assert run_length_encode(np.zeros((3, 4), dtype=bool)).shape == (0, 2)
+
+
+def test_archive_zap_stats(tmp_path):
+    weights = np.ones((4, 8))
+    weights[:, :2] = 0.
+    weights[1] = 0.
+    archive = write_psrfits(os.path.join(tmp_path, "zapped.ar"), np.zeros((4, 1, 8, 16)), weights=weights, pol_type="AA+BB")
+
+    stats = archive_zap_stats(archive)
+    assert stats["zap_fraction"] == np.mean(weights == 0.)
+    assert np.allclose(stats["chan_zap_fraction"], [1., 1.] + [0.25] * 6)
+    assert np.allclose(stats["subint_zap_fraction"], [0.25, 1., 0.25, 0.25])
+    assert np.array_equal(run_length_decode(stats["zap_runs"], stats["zap_shape"]), weights == 0.)
+    assert zap_stats(weights)["zap_runs"].tolist() == [[0, 2], [8, 10], [24, 2]]